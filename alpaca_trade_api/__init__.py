@@ -1,5 +1,42 @@
 __version__ = '3.2.0'
 
-from .rest import REST, TimeFrame, TimeFrameUnit  # noqa
-from .rest_async import AsyncRest  # noqa
-from .stream import Stream  # noqa
+import importlib
+from typing import TYPE_CHECKING
+
+# the clients are imported on first use, so that e.g. a script only using
+# REST doesn't pay for aiohttp, websockets and msgpack at startup
+_LAZY = {
+    'REST': 'rest',
+    'TimeFrame': 'rest',
+    'TimeFrameUnit': 'rest',
+    'AsyncRest': 'rest_async',
+    'Stream': 'stream',
+}
+
+__all__ = list(_LAZY)
+
+if TYPE_CHECKING:
+    from .rest import REST, TimeFrame, TimeFrameUnit  # noqa
+    from .rest_async import AsyncRest  # noqa
+    from .stream import Stream  # noqa
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        # submodules, e.g. tradeapi.rest.APIError, which used to be loaded
+        # by importing the package (not __main__, that would run the cli)
+        if not name.startswith('_'):
+            try:
+                return importlib.import_module(f'.{name}', __name__)
+            except ModuleNotFoundError as e:
+                if e.name != f'{__name__}.{name}':
+                    raise
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    module = importlib.import_module(f'.{_LAZY[name]}', __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
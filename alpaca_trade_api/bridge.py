@@ -0,0 +1,165 @@
+"""
+Runs blocking calls, REST requests in particular, from asyncio code (e.g.
+stream handlers) on a bounded thread pool, so they don't stall the event
+loop and the websockets it reads.
+
+    rest = stream.bridge(REST())
+
+    @stream.on_trade('AAPL')
+    async def on_trade(trade):
+        await rest.submit_order('AAPL', qty=1)
+
+ExecutorBridge.stats() tells how saturated the pool is: how many calls
+found all the threads busy, how long they waited for one and ran.
+"""
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from .metrics import Histogram
+
+DEFAULT_WORKERS = 8
+
+
+class ExecutorBridge:
+    """
+    A thread pool of `max_workers` threads, created on first use, that
+    blocking functions are awaited on. Thread safe.
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_WORKERS):
+        if max_workers < 1:
+            raise ValueError('max_workers must be at least 1')
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._submitted = 0
+        self._completed = 0
+        self._errors = 0
+        self._cancelled = 0
+        self._saturated = 0
+        self._running = 0
+        self._waiting = 0
+        self._max_waiting = 0
+        self._busy = 0.0
+        self._wait = Histogram()
+        self._run = Histogram()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='alpaca-bridge')
+            return self._executor
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """runs fn(*args, **kwargs) on the pool, returns its result"""
+        executor = self._get_executor()
+        with self._lock:
+            self._submitted += 1
+            if self._running + self._waiting >= self.max_workers:
+                self._saturated += 1
+            self._waiting += 1
+            self._max_waiting = max(self._max_waiting, self._waiting)
+        future = executor.submit(self._call, time.perf_counter(), fn, args,
+                                 kwargs)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # dropped before a thread picked it up
+            if future.cancel():
+                with self._lock:
+                    self._waiting -= 1
+                    self._cancelled += 1
+            raise
+
+    def _call(self, submitted: float, fn: Callable, args, kwargs):
+        started = time.perf_counter()
+        with self._lock:
+            self._waiting -= 1
+            self._running += 1
+            self._wait.observe(started - submitted)
+        try:
+            return fn(*args, **kwargs)
+        except BaseException:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+                self._busy += elapsed
+                self._run.observe(elapsed)
+
+    def wrap(self, client) -> 'AsyncProxy':
+        """see AsyncProxy"""
+        return AsyncProxy(self, client)
+
+    def shutdown(self, wait: bool = True):
+        """
+        stops the threads once the calls already submitted are done, a new
+        pool is started if the bridge is used again
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def stats(self) -> dict:
+        """
+        saturated counts the calls submitted while no thread was free,
+        utilization is the share of the pool's thread time spent running
+        calls since the bridge was created.
+        """
+        with self._lock:
+            uptime = max(time.monotonic() - self._started, 1e-9)
+            return {
+                'workers':     self.max_workers,
+                'running':     self._running,
+                'waiting':     self._waiting,
+                'max_waiting': self._max_waiting,
+                'submitted':   self._submitted,
+                'completed':   self._completed,
+                'errors':      self._errors,
+                'cancelled':   self._cancelled,
+                'saturated':   self._saturated,
+                'utilization': self._busy / (self.max_workers * uptime),
+                'wait':        self._wait.snapshot(),
+                'run':         self._run.snapshot(),
+            }
+
+
+class AsyncProxy:
+    """
+    Wraps a blocking client: calling one of its methods returns an
+    awaitable running the call on the bridge. Other attributes are returned
+    as they are. Iterators (e.g. REST.get_trades_iter) would still be
+    consumed on the event loop, await bridge.run(lambda: list(...)) instead.
+    """
+
+    def __init__(self, bridge: ExecutorBridge, client):
+        self._bridge = bridge
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+        bridge = self._bridge
+
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            return await bridge.run(attr, *args, **kwargs)
+
+        self.__dict__[name] = call
+        return call
+
+    def __repr__(self):
+        return f'AsyncProxy({self._client!r})'
@@ -0,0 +1,379 @@
+"""
+Local on-disk cache for historical market data (bars, trades, quotes).
+
+Data is stored in Parquet files, one per finished trading day (New York
+date) and symbol, partitioned by the request parameters:
+
+    <path>/<endpoint_base>/<endpoint>/<param>=<value>/.../symbol=<S>/<day>
+"""
+from __future__ import annotations
+
+import datetime as dt
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import quote
+
+from .common import LazyModule, rfc3339_nanos, to_unix_nanos
+
+pd = LazyModule('pandas', 'DataCache')
+
+NY = 'America/New_York'
+DAY_NS = 24 * 3600 * 10**9
+
+# only these aggregate independently of the requested time range
+CACHEABLE_TIMEFRAME_UNITS = ('Min', 'Hour', 'Day')
+
+# (symbols, start, end) -> pages of items, each item carrying its symbol
+# as item['S']
+Fetch = Callable[[List[str], str, str], Iterable[List[dict]]]
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError(
+            'DataCache needs pyarrow, install it with: '
+            'pip install alpaca-trade-api[cache]') from None
+    return pyarrow
+
+
+class DataCache:
+    """
+    Keeps finished trading days of historical data on disk so they are
+    only downloaded once. Pass it to REST to have get_bars, get_trades,
+    get_quotes (and their _iter/_frame variants) read through it:
+
+        api = REST(data_cache=DataCache('~/.alpaca/cache', max_bytes=10e9))
+
+    Only requests with both start and end (and no limit) go through the
+    cache. The days missing from it are fetched whole and stored, today's
+    (not finished) data is always fetched from the api and never stored.
+
+    :param max_bytes: once the cache grows past this size, the least
+        recently used days are evicted. None means no limit.
+    """
+
+    def __init__(self, path: str, max_bytes: Optional[float] = None):
+        _import_pyarrow()
+        self._path = os.path.abspath(os.path.expanduser(path))
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index: Optional[Dict[str, list]] = None  # path -> [size, used]
+        self._size = 0
+        # path -> number of requests about to read it, not evicted
+        self._pinned: Dict[str, int] = {}
+        self._stats = {
+            'hits':      0,
+            'misses':    0,
+            'live':      0,
+            'writes':    0,
+            'evictions': 0,
+        }
+
+    @staticmethod
+    def accepts(endpoint: str, start=None, end=None, limit=None,
+                timeframe=None, **kwargs) -> bool:
+        """whether a _data_get request can be served from the cache"""
+        if endpoint not in ('bars', 'trades', 'quotes'):
+            return False
+        if not start or not end or limit:
+            return False
+        if endpoint == 'bars':
+            tf = str(timeframe or '')
+            if not tf.endswith(CACHEABLE_TIMEFRAME_UNITS):
+                return False
+        return True
+
+    def pages(self,
+              fetch: Fetch,
+              endpoint: str,
+              symbols: List[str],
+              start,
+              end,
+              grouped: bool,
+              sort: Optional[str] = None,
+              **params) -> Iterator[List[dict]]:
+        """
+        yields one page per symbol and day, in the order the api would
+        return the items. items have 'S' set only when grouped.
+        """
+        start_ns = to_unix_nanos(start)
+        end_ns = _end_nanos(end)
+        days = _ny_days(start_ns, end_ns)
+        now_ns = time.time_ns()
+        finished = [d for d in days if _day_end(d) <= now_ns]
+        live_days = days[len(finished):]
+        prefix = self._prefix(endpoint, params)
+
+        fetched = self._fill(fetch, prefix, symbols, finished)
+        if live_days:
+            live_start = max(start_ns, _day_start(live_days[0]))
+            with self._lock:
+                self._stats['live'] += len(live_days) * len(symbols)
+            fetched.update(_split(fetch(list(symbols),
+                                        rfc3339_nanos(live_start),
+                                        rfc3339_nanos(end_ns))))
+
+        desc = str(sort or '') == 'desc'
+        for symbol in sorted(symbols) if grouped else symbols:
+            for day in reversed(days) if desc else days:
+                items = fetched.get((symbol, day))
+                if items is None:
+                    if day in live_days:
+                        continue
+                    items = self._read(self._file(prefix, symbol, day))
+                if items is None:
+                    # evicted since _fill, e.g. by another request
+                    items = self._fill(fetch, prefix, [symbol],
+                                       [day])[symbol, day]
+                if day == days[0] or day == days[-1]:
+                    items = _trim(items, start_ns, end_ns)
+                if not items:
+                    continue
+                if grouped:
+                    for item in items:
+                        item['S'] = symbol
+                if desc:
+                    items.reverse()
+                yield items
+
+    def _fill(self, fetch: Fetch, prefix: str, symbols: List[str],
+              days: List[dt.date]) -> Dict[tuple, List[dict]]:
+        """
+        fetches and stores the days missing from the cache, returns their
+        items by (symbol, day). The days found are marked used, and can't
+        be evicted to make room for the missing ones.
+        """
+        fetched = {}
+        missing = {}
+        hits = []
+        for symbol in symbols:
+            for day in days:
+                path = self._file(prefix, symbol, day)
+                if self._use(path):
+                    self._count('hits')
+                    hits.append(path)
+                else:
+                    self._count('misses')
+                    missing.setdefault(day, set()).add(symbol)
+        if not missing:
+            return fetched
+        self._pin(hits, 1)
+        try:
+            self._fetch_missing(fetch, prefix, missing, fetched)
+        finally:
+            self._pin(hits, -1)
+        return fetched
+
+    def _fetch_missing(self, fetch: Fetch, prefix: str,
+                       missing: Dict[dt.date, set],
+                       fetched: Dict[tuple, List[dict]]):
+        for run in _consecutive(sorted(missing)):
+            run_symbols = sorted(set().union(*(missing[d] for d in run)))
+            items = _split(fetch(run_symbols,
+                                 rfc3339_nanos(_day_start(run[0])),
+                                 rfc3339_nanos(_day_end(run[-1]) - 1)))
+            for symbol in run_symbols:
+                for day in run:
+                    day_items = items.get((symbol, day), [])
+                    self._write(self._file(prefix, symbol, day), day_items)
+                    fetched[symbol, day] = day_items
+
+    def _pin(self, paths: List[str], n: int):
+        with self._lock:
+            for path in paths:
+                count = self._pinned.get(path, 0) + n
+                if count:
+                    self._pinned[path] = count
+                else:
+                    del self._pinned[path]
+
+    def _prefix(self, endpoint: str, params: dict) -> str:
+        parts = [params.pop('endpoint_base', None) or 'stocks', endpoint]
+        parts += [f'{k}={quote(str(v), safe="")}'
+                  for k, v in sorted(params.items()) if v is not None]
+        return os.path.join(self._path, *parts)
+
+    @staticmethod
+    def _file(prefix: str, symbol: str, day: dt.date) -> str:
+        return os.path.join(prefix, f'symbol={quote(symbol, safe="")}',
+                            f'{day.isoformat()}.parquet')
+
+    def _load_index(self):
+        if self._index is not None:
+            return
+        self._index = {}
+        for root, _, files in os.walk(self._path):
+            for name in files:
+                if name.endswith('.parquet'):
+                    path = os.path.join(root, name)
+                    st = os.stat(path)
+                    self._index[path] = [st.st_size, st.st_mtime]
+                    self._size += st.st_size
+
+    def _use(self, path: str) -> bool:
+        """whether path is cached, marking it recently used if so"""
+        with self._lock:
+            self._load_index()
+            entry = self._index.get(path)
+            if entry is None:
+                return False
+            entry[1] = time.time()
+            return True
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _read(self, path: str) -> Optional[List[dict]]:
+        """the items stored in path, None when it is gone"""
+        pyarrow = _import_pyarrow()
+        try:
+            table = pyarrow.parquet.read_table(path)
+        except (FileNotFoundError, pyarrow.ArrowInvalid):
+            # evicted (or broken) in the meantime
+            with self._lock:
+                self._forget(path)
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._index.get(path)
+            if entry:
+                entry[1] = now
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        items = table.to_pylist()
+        nullable = [name for name, col in zip(table.column_names,
+                                              table.columns)
+                    if col.null_count]
+        if nullable:
+            # keys missing from some items come back as None
+            for item in items:
+                for name in nullable:
+                    if item[name] is None:
+                        del item[name]
+        return items
+
+    def _write(self, path: str, items: List[dict]):
+        pyarrow = _import_pyarrow()
+        table = pyarrow.Table.from_pylist(items) if items \
+            else pyarrow.table({})
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        pyarrow.parquet.write_table(table, tmp)
+        os.replace(tmp, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._forget(path)
+            self._index[path] = [size, time.time()]
+            self._size += size
+            self._stats['writes'] += 1
+            self._evict()
+
+    def _forget(self, path: str):
+        entry = self._index.pop(path, None)
+        if entry:
+            self._size -= entry[0]
+
+    def _evict(self):
+        if self._max_bytes is None or self._size <= self._max_bytes:
+            return
+        by_use = sorted(self._index.items(), key=lambda e: e[1][1])
+        for path, (size, _) in by_use:
+            if self._size <= self._max_bytes:
+                break
+            if path in self._pinned:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._forget(path)
+            self._stats['evictions'] += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        hits/misses count symbol-days found or not in the cache, live the
+        symbol-days of the current day (never cached)
+        """
+        with self._lock:
+            self._load_index()
+            return dict(self._stats, files=len(self._index),
+                        bytes=self._size)
+
+    def clear(self):
+        """removes all the cached files"""
+        with self._lock:
+            self._load_index()
+            for path in list(self._index):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self._forget(path)
+
+
+def _end_nanos(end) -> int:
+    # a date only end includes the whole (UTC) day, as it does for the api
+    if isinstance(end, str) and len(end) == 10:
+        return to_unix_nanos(end) + DAY_NS - 1
+    return to_unix_nanos(end)
+
+
+def _ny_days(start_ns: int, end_ns: int) -> List[dt.date]:
+    first = pd.Timestamp(start_ns, tz='UTC').tz_convert(NY).date()
+    last = pd.Timestamp(end_ns, tz='UTC').tz_convert(NY).date()
+    return [first + dt.timedelta(days=i)
+            for i in range((last - first).days + 1)]
+
+
+def _day_start(day: dt.date) -> int:
+    return pd.Timestamp(day, tz=NY).value
+
+
+def _day_end(day: dt.date) -> int:
+    """first nanosecond after the day"""
+    return _day_start(day + dt.timedelta(days=1))
+
+
+def _consecutive(days: List[dt.date]) -> Iterator[List[dt.date]]:
+    run = []
+    for day in days:
+        if run and (day - run[-1]).days != 1:
+            yield run
+            run = []
+        run.append(day)
+    if run:
+        yield run
+
+
+def _split(pages: Iterable[List[dict]]) -> Dict[tuple, List[dict]]:
+    """groups fetched items by (symbol, New York day), dropping 'S'"""
+    items = [item for page in pages for item in page]
+    if not items:
+        return {}
+    days = pd.to_datetime([item['t'] for item in items],
+                          utc=True).tz_convert(NY).date
+    result = {}
+    for item, day in zip(items, days):
+        result.setdefault((item.pop('S'), day), []).append(item)
+    return result
+
+
+def _trim(items: List[dict], start_ns: int, end_ns: int) -> List[dict]:
+    if not items:
+        return items
+    ts = pd.to_datetime([item['t'] for item in items], utc=True)
+    if hasattr(ts, 'as_unit'):
+        # pandas 2+ may pick a coarser unit than ns
+        ts = ts.as_unit('ns')
+    ts = ts.asi8
+    if ts[0] >= start_ns and ts[-1] <= end_ns:
+        return items
+    return [item for item, t in zip(items, ts) if start_ns <= t <= end_ns]
@@ -1,9 +1,54 @@
+import datetime as dt
+import importlib
+import importlib.util
 import os
-from typing import Tuple
+import re
+from typing import Tuple, Union
 import dateutil.parser
 
 Credentials = Tuple[str, str, str]
 
+# optional dependencies -> the setup.py extra installing them
+_EXTRAS = {
+    'pandas': 'pandas',
+    'numpy':  'pandas',
+}
+
+
+class LazyModule:
+    """
+    Stands in for a module until one of its attributes is used, so that
+    importing the sdk doesn't import pandas (or numpy) for code that never
+    builds a DataFrame.
+
+        pd = LazyModule('pandas', 'DataFrames')
+
+    When the module isn't installed, using it raises an ImportError saying
+    what it is needed for.
+    """
+
+    def __init__(self, name: str, needed_for: str = None):
+        self.__name = name
+        self.__needed_for = needed_for
+
+    def __getattr__(self, attr):
+        try:
+            module = importlib.import_module(self.__name)
+        except ImportError as e:
+            if self.__needed_for is None:
+                raise
+            extra = _EXTRAS.get(self.__name)
+            install = f'alpaca-trade-api[{extra}]' if extra else self.__name
+            raise ImportError(
+                f'{self.__name} is required for {self.__needed_for}, '
+                f'install it with `pip install {install}`') from e
+        # found by regular lookup from now on, __getattr__ isn't called again
+        self.__dict__.update(vars(module))
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return f'<lazy module {self.__name!r}>'
+
 
 class URL(str):
     def __new__(cls, *value):
@@ -57,6 +102,49 @@ class FLOAT(str):
         raise ValueError(f'Unexpected float format "{value}"')
 
 
+_FRACTION = re.compile(r'(\d{2}:\d{2}:\d{2})\.(\d+)')
+_EPOCH = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+
+
+def to_unix_nanos(value: Union[str, int, dt.datetime]) -> int:
+    """
+    converts an api timestamp (RFC3339 or YYYY-MM-DD string), a datetime
+    (naive ones are assumed to be UTC) or a pandas Timestamp to nanoseconds
+    since the epoch. ints are assumed to already be nanoseconds.
+    """
+    if isinstance(value, int):
+        return value
+    nanos = 0
+    if isinstance(value, str):
+        m = _FRACTION.search(value)
+        if m:
+            fraction = m.group(2)[:9]
+            nanos = int(fraction.ljust(9, '0'))
+            value = value[:m.end(1)] + value[m.end():]
+        value = dateutil.parser.isoparse(value)
+    elif hasattr(value, 'nanosecond'):
+        # pandas.Timestamp, keeps the sub-microsecond part
+        nanos = value.nanosecond
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt.timezone.utc)
+    delta = value - _EPOCH
+    return ((delta.days * 86400 + delta.seconds) * 10**9 +
+            delta.microseconds * 1000 + nanos)
+
+
+def rfc3339_nanos(nanos: int) -> str:
+    """
+    formats nanoseconds since the epoch as an RFC3339 UTC timestamp, the
+    fraction of a second is only added when it is not zero.
+    """
+    seconds, fraction = divmod(nanos, 10**9)
+    value = (_EPOCH + dt.timedelta(seconds=seconds)).strftime(
+        '%Y-%m-%dT%H:%M:%S')
+    if fraction:
+        value += f'.{fraction:09d}'
+    return value + 'Z'
+
+
 def get_base_url() -> URL:
     return URL(os.environ.get(
         'APCA_API_BASE_URL', 'https://api.alpaca.markets').rstrip('/'))
@@ -92,6 +180,17 @@ def get_credentials(key_id: str = None,
     return key_id, secret_key, oauth
 
 
+def get_lite_mode() -> bool:
+    """
+    lite mode (APCA_LITE_MODE=1, or pandas not installed): entities return
+    timestamps as datetimes, or ints of nanoseconds as received, instead of
+    pandas Timestamps, so pandas is only needed for DataFrames.
+    """
+    if os.environ.get('APCA_LITE_MODE', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return importlib.util.find_spec('pandas') is None
+
+
 def get_api_version(api_version: str) -> str:
     api_version = api_version or os.environ.get('APCA_API_VERSION')
     if api_version is None:
@@ -1,30 +1,75 @@
-import pandas as pd
+from __future__ import annotations
+
+import datetime as dt
 import pprint
 import re
 
+import dateutil.parser
+import dateutil.tz
+
+from .common import LazyModule, get_lite_mode
+
+np = LazyModule('numpy', 'DataFrames')
+pd = LazyModule('pandas', 'DataFrames')
+
 ISO8601YMD = re.compile(r'\d{4}-\d{2}-\d{2}T')
 NY = 'America/New_York'
+NY_TZ = dateutil.tz.gettz(NY)
+
+# see get_lite_mode, decided once when the module is loaded
+LITE_MODE = get_lite_mode()
 
 
 class Entity(object):
     '''This helper class provides property access (the "dot notation")
     to the json object, backed by the original object stored in the _raw
     field.
+
+    How a key is decoded is worked out once per class by _accessor, and
+    decoded values (e.g. timestamps) are cached on the instance, so the
+    raw object is expected not to change once wrapped.
     '''
+    __slots__ = ('_raw', '_cache')
+    _accessors = {}
 
     def __init__(self, raw):
         self._raw = raw
+        self._cache = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._accessors = {}
+
+    @classmethod
+    def _accessor(cls, key):
+        """
+        returns the raw key backing the attribute `key` and the function
+        decoding its value, or None if the value is returned as is.
+        """
+        if key.endswith(('_at', '_timestamp', '_time')):
+            return key, _iso_timestamp
+        return key, None
 
     def __getattr__(self, key):
-        if key in self._raw:
-            val = self._raw[key]
-            if (isinstance(val, str) and
-                    (key.endswith('_at') or
-                     key.endswith('_timestamp') or
-                     key.endswith('_time')) and
-                    ISO8601YMD.match(val)):
-                return pd.Timestamp(val)
-            else:
+        if key in Entity.__slots__:
+            # not set yet, e.g. while unpickling
+            raise AttributeError(key)
+        try:
+            raw_key, decode = self._accessors[key]
+        except KeyError:
+            raw_key, decode = self._accessors[key] = self._accessor(key)
+        raw = self._raw
+        if raw_key in raw:
+            if decode is None:
+                return raw[raw_key]
+            try:
+                cache = self._cache
+            except AttributeError:
+                cache = self._cache = {}
+            try:
+                return cache[key]
+            except KeyError:
+                val = cache[key] = decode(raw[raw_key])
                 return val
         return super().__getattribute__(key)
 
@@ -35,12 +80,28 @@ class Entity(object):
         )
 
 
+def _timestamp(val):
+    """
+    an ISO 8601 string as a pandas Timestamp, or a datetime (to the
+    microsecond) in lite mode
+    """
+    if LITE_MODE:
+        return dateutil.parser.isoparse(val)
+    return pd.Timestamp(val)
+
+
+def _iso_timestamp(val):
+    if isinstance(val, str) and ISO8601YMD.match(val):
+        return _timestamp(val)
+    return val
+
+
 class Account(Entity):
     """
     Entity properties:
     https://alpaca.markets/docs/api-documentation/api-v2/account/
     """
-    pass
+    __slots__ = ()
 
 
 class AccountConfigurations(Entity):
@@ -48,7 +109,7 @@ class AccountConfigurations(Entity):
     Entity properties:
     https://alpaca.markets/docs/api-documentation/api-v2/account-configuration/
     """
-    pass
+    __slots__ = ()
 
 
 class Asset(Entity):
@@ -56,7 +117,7 @@ class Asset(Entity):
     Entity properties:
     https://alpaca.markets/docs/api-documentation/api-v2/assets/#asset-entity
     """
-    pass
+    __slots__ = ()
 
 
 class Order(Entity):
@@ -64,6 +125,7 @@ class Order(Entity):
     Entity properties:
     https://alpaca.markets/docs/api-documentation/api-v2/orders/#order-entity
     """
+    __slots__ = ('legs',)
 
     def __init__(self, raw):
         super().__init__(raw)
@@ -79,7 +141,7 @@ class Position(Entity):
     Entity properties:
 https://alpaca.markets/docs/api-documentation/api-v2/positions/#position-entity
     """
-    pass
+    __slots__ = ()
 
 
 class AccountActivity(Entity):
@@ -87,7 +149,7 @@ class AccountActivity(Entity):
     Entity properties:
     https://alpaca.markets/docs/api-documentation/api-v2/account-activities/
     """
-    pass
+    __slots__ = ()
 
 
 class Bar(Entity):
@@ -96,12 +158,58 @@ class Bar(Entity):
     https://alpaca.markets/docs/api-documentation/api-v2/market-data/bars/
     #bars-entity
     """
+    __slots__ = ()
 
-    def __getattr__(self, key):
+    @classmethod
+    def _accessor(cls, key):
         if key == 't':
-            val = self._raw[key[0]]
-            return pd.Timestamp(val, unit='s', tz=NY)
-        return super().__getattr__(key)
+            return key, _epoch_timestamp
+        return super()._accessor(key)
+
+
+def _epoch_timestamp(val):
+    if LITE_MODE:
+        return dt.datetime.fromtimestamp(val, NY_TZ)
+    return pd.Timestamp(val, unit='s', tz=NY)
+
+
+def rfc3339_index(values) -> pd.DatetimeIndex:
+    """
+    Parses api timestamps (RFC3339 UTC, e.g. 2021-06-08T08:00:00.123Z) to
+    a UTC DatetimeIndex. Without the Z, numpy parses them directly, a lot
+    faster than pandas inferring the format. Anything else goes through
+    pandas as before.
+    """
+    name = getattr(values, 'name', None)
+    if getattr(getattr(values, 'dtype', None), 'kind', None) == 'M':
+        # already parsed, e.g. by EntityList.df
+        return pd.DatetimeIndex(values, name=name)
+    # iterating a list is a lot faster than iterating an Index
+    items = values.tolist() if hasattr(values, 'tolist') else values
+    try:
+        stripped = [v[:-1] for v in items if v[-1:] == 'Z']
+        if len(stripped) == len(values):
+            parsed = np.array(stripped, dtype='datetime64[ns]')
+            return pd.DatetimeIndex(parsed, name=name).tz_localize('UTC')
+    except (TypeError, ValueError):
+        pass
+    return pd.DatetimeIndex(values, name=name)
+
+
+def epoch_index(values) -> pd.DatetimeIndex:
+    """
+    seconds since the epoch (v1 bars, portfolio history) to a New York
+    DatetimeIndex
+    """
+    name = getattr(values, 'name', None)
+    seconds = np.asarray(values)
+    if seconds.dtype.kind in 'iu':
+        parsed = seconds.astype('datetime64[s]').astype('datetime64[ns]')
+        return pd.DatetimeIndex(parsed, name=name).tz_localize(
+            'UTC').tz_convert(NY)
+    return pd.to_datetime(
+        (values * 1e9).astype('int64'), utc=True,
+    ).tz_convert(NY)
 
 
 class Bars(list):
@@ -126,9 +234,7 @@ class Bars(list):
             df.columns = [alias[c] for c in df.columns]
             df.set_index('time', inplace=True)
             if not df.empty:
-                df.index = pd.to_datetime(
-                    (df.index * 1e9).astype('int64'), utc=True,
-                ).tz_convert(NY)
+                df.index = epoch_index(df.index)
             else:
                 df.index = pd.to_datetime(
                     df.index, utc=True
@@ -138,23 +244,37 @@ class Bars(list):
 
 
 class _Timestamped(object):
+    __slots__ = ()
     _tskeys = ('timestamp',)
 
-    def __getattr__(self, key):
-        if key in self._raw:
-            val = self._raw[key]
-            if key in self._tskeys:
-                return pd.Timestamp(val, tz=NY, unit=self._unit)
-            return val
-        return getattr(super(), key)
+    @classmethod
+    def _accessor(cls, key):
+        if key in cls._tskeys:
+            return key, cls._decode_timestamp
+        return key, None
+
+    @classmethod
+    def _decode_timestamp(cls, val):
+        if LITE_MODE:
+            # numbers are left as they are, in cls._unit
+            if isinstance(val, (int, float)):
+                return val
+            val = dateutil.parser.isoparse(val)
+            if val.tzinfo is None:
+                return val.replace(tzinfo=NY_TZ)
+            return val.astimezone(NY_TZ)
+        if isinstance(val, (int, float)):
+            return pd.Timestamp(val, tz=NY, unit=cls._unit)
+        return pd.Timestamp(val, tz=NY)
 
 
 class _NanoTimestamped(_Timestamped):
+    __slots__ = ()
     _unit = 'ns'
 
 
 class Trade(_NanoTimestamped, Entity):
-    pass
+    __slots__ = ()
 
 
 class Quote(_NanoTimestamped, Entity):
@@ -163,7 +283,7 @@ class Quote(_NanoTimestamped, Entity):
     https://alpaca.markets/docs/api-documentation/api-v2/market-data/last-quote
     /#last-quote-entity
     """
-    pass
+    __slots__ = ()
 
 
 class Clock(Entity):
@@ -171,15 +291,13 @@ class Clock(Entity):
     Entity properties:
     https://alpaca.markets/docs/api-documentation/api-v2/clock/#clock-entity
     """
+    __slots__ = ()
 
-    def __getattr__(self, key):
-        if key in self._raw:
-            val = self._raw[key]
-            if key in ('timestamp', 'next_open', 'next_close'):
-                return pd.Timestamp(val)
-            else:
-                return val
-        return super().__getattr__(key)
+    @classmethod
+    def _accessor(cls, key):
+        if key in ('timestamp', 'next_open', 'next_close'):
+            return key, _timestamp
+        return super()._accessor(key)
 
 
 class Calendar(Entity):
@@ -188,19 +306,29 @@ class Calendar(Entity):
     https://alpaca.markets/docs/api-documentation/api-v2/calendar/
     #calendar-entity
     """
+    __slots__ = ()
+
+    @classmethod
+    def _accessor(cls, key):
+        if key in ('date',):
+            return key, _timestamp
+        elif key in ('open', 'close'):
+            return key, _time_of_day
+        elif key in ('session_open', 'session_close'):
+            return key, _session_time_of_day
+        return super()._accessor(key)
+
+
+def _time_of_day(val):
+    if LITE_MODE:
+        return dt.time.fromisoformat(val)
+    return pd.Timestamp(val).time()
 
-    def __getattr__(self, key):
-        if key in self._raw:
-            val = self._raw[key]
-            if key in ('date',):
-                return pd.Timestamp(val)
-            elif key in ('open', 'close'):
-                return pd.Timestamp(val).time()
-            elif key in ('session_open', 'session_close'):
-                return pd.Timestamp(val[:2] + ':' + val[-2:]).time()
-            else:
-                return val
-        return super().__getattr__(key)
+
+def _session_time_of_day(val):
+    if LITE_MODE:
+        return dt.time(int(val[:2]), int(val[-2:]))
+    return pd.Timestamp(val[:2] + ':' + val[-2:]).time()
 
 
 class Watchlist(Entity):
@@ -209,7 +337,7 @@ class Watchlist(Entity):
     https://alpaca.markets/docs/api-documentation/api-v2/watchlist/
     #watchlist-entity
     """
-    pass
+    __slots__ = ()
 
 
 class PortfolioHistory(Entity):
@@ -218,9 +346,7 @@ class PortfolioHistory(Entity):
     https://alpaca.markets/docs/api-documentation/api-v2/portfolio-history/
     #portfoliohistory-entity
     """
-
-    def __init__(self, raw):
-        self._raw = raw
+    __slots__ = ('_df',)
 
     @property
     def df(self):
@@ -232,9 +358,7 @@ class PortfolioHistory(Entity):
             )
             df.set_index('timestamp', inplace=True)
             if not df.empty:
-                df.index = pd.to_datetime(
-                    (df.index * 1e9).astype('int64'), utc=True,
-                ).tz_convert(NY)
+                df.index = epoch_index(df.index)
             else:
                 df.index = pd.to_datetime(
                     df.index, utc=True
@@ -1,7 +1,15 @@
+from __future__ import annotations
+
 from enum import Enum
-import pandas as pd
-from .entity import Bar, Entity, Trade, Quote, _NanoTimestamped
-from typing import Dict
+import operator
+from .entity import (
+    Bar, Entity, Trade, Quote, _NanoTimestamped, rfc3339_index
+)
+from typing import Dict, Iterable, Iterator, List, Optional
+from .common import LazyModule
+
+np = LazyModule('numpy', 'DataFrames')
+pd = LazyModule('pandas', 'DataFrames')
 
 trade_mapping_v2 = {
     "i": "id",
@@ -119,21 +127,260 @@ class EntityList(list):
             df.columns = [self.mapping.get(c, c) for c in df.columns]
             if not df.empty:
                 df.set_index('timestamp', inplace=True)
-                df.index = pd.DatetimeIndex(df.index)
+                df.index = rfc3339_index(df.index)
             self._df = df
         return self._df
 
+    def to_df(self,
+              multiindex: bool = False,
+              downcast: Optional[str] = None,
+              symbol: Optional[str] = None) -> pd.DataFrame:
+        """
+        Same as .df, with the options of format_frame.
+        """
+        return format_frame(self.df, multiindex, downcast, symbol)
+
+
+class ColumnarFrameBuilder:
+    """
+    Builds the same DataFrame as EntityList.df straight from the raw api
+    pages, without wrapping every item with an Entity object first.
+    Numeric fields are copied page by page into preallocated numpy arrays
+    (grown geometrically), other fields are kept as plain lists.
+    """
+
+    def __init__(self, mapping: Dict[str, str], capacity: int = 0):
+        self.mapping = mapping
+        self._capacity = capacity
+        self._size = 0
+        self._columns = {}
+
+    def __len__(self):
+        return self._size
+
+    def append(self, page: List[dict]):
+        n = len(page)
+        if not n:
+            return
+        start = self._size
+        end = start + n
+        if end > self._capacity:
+            self._grow(end)
+        keys = list(page[0])
+        present = set().union(*page)
+        keys.extend(present.difference(keys))
+        for key in keys:
+            self._set(key, start, _column(page, key))
+        for key in list(self._columns):
+            if key not in present:
+                self._set(key, start, [None] * n)
+        self._size = end
+
+    def extend(self, pages: Iterable[List[dict]]):
+        for page in pages:
+            self.append(page)
+        return self
+
+    def _grow(self, needed: int):
+        capacity = max(needed, self._capacity * 2)
+        for key, col in self._columns.items():
+            if isinstance(col, np.ndarray):
+                grown = np.empty(capacity, dtype=col.dtype)
+                grown[:self._size] = col[:self._size]
+                self._columns[key] = grown
+        self._capacity = capacity
+
+    def _set(self, key: str, start: int, values: list):
+        col = self._columns.get(key)
+        if col is None:
+            col = self._new_column(values, start)
+            self._columns[key] = col
+        if isinstance(col, list):
+            col.extend(values)
+            return
+        arr = _numeric_array(values)
+        if arr is None:
+            # not numeric after all, fall back to a plain list
+            self._columns[key] = col[:start].tolist() + values
+            return
+        if arr.dtype.kind == 'f' and col.dtype.kind != 'f':
+            col = col.astype(np.float64)
+            self._columns[key] = col
+        col[start:start + len(values)] = arr
+
+    def _new_column(self, values: list, start: int):
+        first = next((v for v in values if v is not None), None)
+        if first is None or isinstance(first, bool) or \
+                not isinstance(first, (int, float)):
+            return [None] * start
+        if start or isinstance(first, float):
+            col = np.empty(self._capacity, dtype=np.float64)
+            col[:start] = np.nan
+            return col
+        return np.empty(self._capacity, dtype=np.int64)
+
+    @property
+    def df(self) -> pd.DataFrame:
+        return self.frame()
+
+    def frame(self,
+              multiindex: bool = False,
+              downcast: Optional[str] = None,
+              symbol: Optional[str] = None) -> pd.DataFrame:
+        """
+        the DataFrame of the data appended so far, see format_frame for the
+        options
+        """
+        _check_downcast(downcast)
+        size = self._size
+        if not size:
+            return pd.DataFrame()
+        columns = {
+            self.mapping.get(key, key):
+                col[:size] if isinstance(col, np.ndarray) else col
+            for key, col in self._columns.items()
+        }
+        if multiindex or downcast:
+            return _build_frame(columns, columns.pop('timestamp'),
+                                multiindex, downcast, symbol)
+        df = pd.DataFrame(columns)
+        df.set_index('timestamp', inplace=True)
+        df.index = rfc3339_index(df.index)
+        return df
+
+
+DOWNCAST_OPTIONS = (None, 'float', 'integer', 'all')
+
+
+def format_frame(df: pd.DataFrame,
+                 multiindex: bool = False,
+                 downcast: Optional[str] = None,
+                 symbol: Optional[str] = None) -> pd.DataFrame:
+    """
+    Reshapes a DataFrame shaped like EntityList.df, returning a new one.
+
+    :param multiindex: index the rows by (symbol, timestamp), sorted, with
+        the symbol level categorical. df.loc['AAPL'] is then a binary
+        search instead of a scan (or a groupby copy) of the whole frame.
+        `symbol` names the symbol of single symbol data, which has no
+        symbol column.
+    :param downcast: 'float' stores the float columns as float32,
+        'integer' the integer ones as int32 (when all their values fit),
+        'all' both.
+    """
+    _check_downcast(downcast)
+    if df.empty or not (multiindex or downcast):
+        return df
+    columns = {name: df[name].to_numpy() for name in df.columns}
+    return _build_frame(columns, df.index, multiindex, downcast, symbol)
+
+
+def _check_downcast(downcast: Optional[str]):
+    if downcast not in DOWNCAST_OPTIONS:
+        raise ValueError(f'downcast must be one of {DOWNCAST_OPTIONS}')
+
+
+def _build_frame(columns: dict, timestamps, multiindex: bool,
+                 downcast: Optional[str], symbol: Optional[str]):
+    columns = {name: _downcast(col, downcast)
+               for name, col in columns.items()}
+    timestamps = pd.DatetimeIndex(rfc3339_index(timestamps),
+                                  name='timestamp')
+    if not multiindex:
+        return pd.DataFrame(columns, index=timestamps)
+    symbols = columns.pop('symbol', None)
+    if symbols is not None:
+        level = pd.Categorical(symbols)
+    elif symbol is not None:
+        level = pd.Categorical.from_codes(
+            np.zeros(len(timestamps), dtype=np.int8), [symbol])
+    else:
+        raise ValueError('the data has no symbol column, pass symbol')
+    index = pd.MultiIndex.from_arrays([level, timestamps],
+                                      names=['symbol', 'timestamp'])
+    df = pd.DataFrame(columns, index=index)
+    if not index.is_monotonic_increasing:
+        df = df.sort_index()
+    return df
+
+
+_INT32_MIN, _INT32_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+def _downcast(col, downcast: Optional[str]):
+    if not downcast or not isinstance(col, np.ndarray):
+        return col
+    if col.dtype.kind == 'f' and downcast in ('float', 'all'):
+        return col.astype(np.float32)
+    if col.dtype.kind == 'i' and downcast in ('integer', 'all') and \
+            len(col) and _INT32_MIN <= col.min() and col.max() <= _INT32_MAX:
+        return col.astype(np.int32)
+    return col
+
+
+def frame_chunks(mapping: Dict[str, str],
+                 pages: Iterable[List[dict]],
+                 chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """
+    Builds DataFrames of chunk_rows rows (the last one may be shorter) from
+    the api pages, so only one chunk is held in memory at a time.
+    """
+    if chunk_rows < 1:
+        raise ValueError('chunk_rows must be positive')
+    builder = ColumnarFrameBuilder(mapping)
+    for page in pages:
+        while page:
+            room = chunk_rows - len(builder)
+            builder.append(page[:room])
+            page = page[room:]
+            if len(builder) >= chunk_rows:
+                yield builder.df
+                builder = ColumnarFrameBuilder(mapping)
+    if len(builder):
+        yield builder.df
+
+
+def _column(page: List[dict], key: str) -> list:
+    """
+    collects the values of one field of a page of api items
+    """
+    try:
+        # fast path, every item has the field
+        return list(map(operator.itemgetter(key), page))
+    except KeyError:
+        return [item.get(key) for item in page]
+
+
+def _numeric_array(values: list):
+    """
+    converts a list of api values to a numeric numpy array, or returns None
+    if the values are not numeric. missing values are converted to NaN.
+    """
+    arr = np.asarray(values)
+    if arr.dtype.kind in 'iuf':
+        return arr
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return None
+
 
 class Remapped:
-    def __init__(self, mapping: Dict[str, str], *args, **kwargs):
-        self._reversed_mapping = {
-            value: key for (key, value) in mapping.items()}
-        super().__init__(*args, **kwargs)
+    """
+    Lets the entity be accessed with the readable names of _mapping
+    (e.g. trade.price) besides the short api keys (e.g. trade.p).
+    """
+    __slots__ = ()
+    _mapping: Dict[str, str] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._reversed_mapping = {
+            value: key for (key, value) in cls._mapping.items()}
 
-    def __getattr__(self, key):
-        if key in self._reversed_mapping:
-            return super().__getattr__(self._reversed_mapping[key])
-        return super().__getattr__(key)
+    @classmethod
+    def _accessor(cls, key):
+        return super()._accessor(cls._reversed_mapping.get(key, key))
 
 
 class BarsV2(EntityList):
@@ -152,53 +399,46 @@ class QuotesV2(EntityList):
 
 
 class TradeV2(Remapped, _NanoTimestamped, Entity):
+    __slots__ = ()
+    _mapping = trade_mapping_v2
     _tskeys = ('t',)
 
-    def __init__(self, raw):
-        super().__init__(trade_mapping_v2, raw)
-
 
 class QuoteV2(Remapped, _NanoTimestamped, Entity):
+    __slots__ = ()
+    _mapping = quote_mapping_v2
     _tskeys = ('t',)
 
-    def __init__(self, raw):
-        super().__init__(quote_mapping_v2, raw)
-
 
 class BarV2(Remapped, _NanoTimestamped, Entity):
+    __slots__ = ()
+    _mapping = bar_mapping_v2
     _tskeys = ('t',)
 
-    def __init__(self, raw):
-        super().__init__(bar_mapping_v2, raw)
-
 
 class StatusV2(Remapped, _NanoTimestamped, Entity):
+    __slots__ = ()
+    _mapping = status_mapping_v2
     _tskeys = ('t',)
 
-    def __init__(self, raw):
-        super().__init__(status_mapping_v2, raw)
-
 
 class LULDV2(Remapped, _NanoTimestamped, Entity):
+    __slots__ = ()
+    _mapping = luld_mapping_v2
     _tskeys = ('t',)
 
-    def __init__(self, raw):
-        super().__init__(luld_mapping_v2, raw)
-
 
 class CancelErrorV2(Remapped, _NanoTimestamped, Entity):
+    __slots__ = ()
+    _mapping = cancel_error_mapping_v2
     _tskeys = ('t',)
 
-    def __init__(self, raw):
-        super().__init__(cancel_error_mapping_v2, raw)
-
 
 class CorrectionV2(Remapped, _NanoTimestamped, Entity):
+    __slots__ = ()
+    _mapping = correction_mapping_v2
     _tskeys = ('t',)
 
-    def __init__(self, raw):
-        super().__init__(correction_mapping_v2, raw)
-
 
 class SnapshotV2:
     def __init__(self, raw):
@@ -234,11 +474,12 @@ class LatestQuotesV2(dict):
 
 
 class BidOrAsk(Entity):
-    def __init__(self, raw):
-        super().__init__(raw)
+    __slots__ = ()
 
 
 class OrderbookV2(Entity):
+    __slots__ = ()
+
     def __init__(self, raw):
         super().__init__(raw)
         if self.bids:
@@ -262,8 +503,7 @@ class OrderbooksV2(dict):
 
 
 class NewsV2(Entity):
-    def __init__(self, raw):
-        super().__init__(raw)
+    __slots__ = ()
 
 
 class NewsListV2(list):
@@ -0,0 +1,41 @@
+"""
+JSON decoding of the api responses.
+
+Responses are decoded straight from the body bytes, with the fastest
+library installed: orjson, then ujson, then the standard json module.
+Install one with `pip install alpaca-trade-api[fast-json]`.
+"""
+import importlib
+import json
+from typing import Any, Callable, Optional
+
+JsonDecoder = Callable[[bytes], Any]
+
+# in order of preference
+DECODERS = ('orjson', 'ujson', 'json')
+
+
+def get_decoder(name: Optional[str] = None) -> JsonDecoder:
+    """
+    returns the loads function of the named library, or of the first one
+    of DECODERS that is installed when name is None
+    """
+    if name is not None:
+        if name not in DECODERS:
+            raise ValueError(f'unknown json decoder {name}, '
+                             f'expected one of {DECODERS}')
+        return _import(name)
+    for candidate in DECODERS:
+        try:
+            return _import(candidate)
+        except ImportError:
+            pass
+
+
+def _import(name: str) -> JsonDecoder:
+    if name == 'json':
+        return json.loads
+    return importlib.import_module(name).loads
+
+
+default_decoder: JsonDecoder = get_decoder()
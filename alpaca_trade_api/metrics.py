@@ -0,0 +1,206 @@
+"""
+Client side request metrics for REST and AsyncRest.
+
+    metrics = RequestMetrics()
+    api = REST(metrics=metrics)
+    ...
+    metrics.snapshot()
+
+Endpoints are keyed by method and url path, with the symbols and ids in
+the path replaced by '*' (e.g. 'GET /v2/stocks/*/trades') so they don't
+grow one entry per symbol. To forward the measurements somewhere else,
+subclass RequestMetrics and override the methods the clients call:
+request, retry, decode, wrap, connection and rate_limit.
+"""
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Mapping, Optional
+from urllib.parse import urlsplit
+
+# bucket upper bounds in seconds, 0.5ms to about 65s
+LATENCY_BUCKETS = tuple(0.0005 * 2 ** i for i in range(18))
+
+# symbols (upper case) and ids (uuids, numbers) in url paths
+_VARIABLE_SEGMENT = re.compile(r'[A-Z]|^[0-9a-f]{8}-|^\d+$')
+
+
+def endpoint_key(method: str, url: str) -> str:
+    path = urlsplit(url).path
+    segments = ['*' if _VARIABLE_SEGMENT.search(s) else s
+                for s in path.split('/')]
+    return f'{method.upper()} {"/".join(segments)}'
+
+
+class Histogram:
+    """
+    Counts observations in fixed buckets, which is enough to estimate
+    percentiles without keeping every value.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        upper bound of the bucket holding the p-th percentile (0 < p <=
+        100), never more than the largest value seen
+        """
+        if not self.count:
+            return None
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'sum':   self.sum,
+            'mean':  self.sum / self.count,
+            'min':   self.min,
+            'max':   self.max,
+            'p50':   self.percentile(50),
+            'p90':   self.percentile(90),
+            'p99':   self.percentile(99),
+            'buckets': {
+                str(bound): n
+                for bound, n in zip(self.buckets + ('inf',), self.counts)
+                if n
+            },
+        }
+
+
+class _Endpoint:
+    def __init__(self):
+        self.latency = Histogram()
+        self.server = Histogram()
+        self.decode = Histogram()
+        self.status: Dict[str, int] = defaultdict(int)
+        self.retries = 0
+        self.errors = 0
+        self.bytes = 0
+
+    def snapshot(self) -> dict:
+        return {
+            'requests': self.latency.count,
+            'errors':   self.errors,
+            'retries':  self.retries,
+            'bytes':    self.bytes,
+            'status':   dict(self.status),
+            'latency':  self.latency.snapshot(),
+            'server':   self.server.snapshot(),
+            'decode':   self.decode.snapshot(),
+        }
+
+
+class RequestMetrics:
+    """
+    Collects, per endpoint: request latency (the whole attempt, body
+    included), server latency (until the response headers came back),
+    json decode time, status codes, retries, errors and bytes received.
+    Plus the time spent wrapping responses in entities, DNS and connect
+    times (AsyncRest only, requests doesn't expose them) and the rate limit
+    headroom from the X-RateLimit-* headers. Thread safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._endpoints: Dict[str, _Endpoint] = defaultdict(_Endpoint)
+            self._wrap: Dict[str, Histogram] = defaultdict(Histogram)
+            self._connections: Dict[str, Histogram] = defaultdict(Histogram)
+            self._rate_limit = {}
+
+    def request(self,
+                method: str,
+                url: str,
+                status: Optional[int],
+                seconds: float,
+                nbytes: int = 0,
+                server_seconds: Optional[float] = None):
+        """
+        one attempt of a request, status is None when it failed without a
+        response (connection error, timeout)
+        """
+        key = endpoint_key(method, url)
+        with self._lock:
+            endpoint = self._endpoints[key]
+            endpoint.latency.observe(seconds)
+            if server_seconds is not None:
+                endpoint.server.observe(server_seconds)
+            if status is None or status >= 400:
+                endpoint.errors += 1
+            endpoint.status[str(status)] += 1
+            endpoint.bytes += nbytes
+
+    def retry(self, method: str, url: str):
+        with self._lock:
+            self._endpoints[endpoint_key(method, url)].retries += 1
+
+    def decode(self, method: str, url: str, seconds: float):
+        with self._lock:
+            self._endpoints[endpoint_key(method, url)].decode.observe(
+                seconds)
+
+    def wrap(self, entity: str, seconds: float):
+        """time spent turning a response into `entity` objects"""
+        with self._lock:
+            self._wrap[entity].observe(seconds)
+
+    def connection(self, phase: str, seconds: float):
+        """phase is 'dns' or 'connect' (tcp and tls)"""
+        with self._lock:
+            self._connections[phase].observe(seconds)
+
+    def rate_limit(self, headers: Mapping[str, str]):
+        try:
+            limit = int(headers['X-RateLimit-Limit'])
+            remaining = int(headers['X-RateLimit-Remaining'])
+        except (KeyError, TypeError, ValueError):
+            return
+        with self._lock:
+            state = self._rate_limit
+            state['limit'] = limit
+            state['remaining'] = remaining
+            state['min_remaining'] = min(
+                remaining, state.get('min_remaining', remaining))
+            if 'X-RateLimit-Reset' in headers:
+                state['reset'] = headers['X-RateLimit-Reset']
+
+    def snapshot(self) -> dict:
+        """everything collected so far, as plain dicts"""
+        with self._lock:
+            return {
+                'endpoints': {k: e.snapshot()
+                              for k, e in sorted(self._endpoints.items())},
+                'wrap': {k: h.snapshot()
+                         for k, h in sorted(self._wrap.items())},
+                'connections': {k: h.snapshot() for k, h in
+                                sorted(self._connections.items())},
+                'rate_limit': dict(self._rate_limit),
+            }
@@ -0,0 +1,115 @@
+import threading
+import time
+from typing import Mapping, Optional
+
+DEFAULT_RATE_LIMIT = 200  # requests per minute, per account
+DEFAULT_RATE_PERIOD = 60  # seconds
+
+
+class RateLimiter:
+    """
+    Client side token bucket pacing the requests sent to the api, so bulk
+    jobs run at the allowed rate instead of hitting 429s and sleeping.
+
+    The bucket refills continuously at `limit` tokens per `period` seconds
+    and follows the X-RateLimit-Limit/Remaining/Reset headers of every
+    response it is updated with. One instance can be shared by several
+    REST and AsyncRest objects (and threads) to pace them together:
+
+        limiter = RateLimiter()
+        api = REST(rate_limiter=limiter)
+        async_api = AsyncRest(rate_limiter=limiter)
+    """
+
+    def __init__(self,
+                 limit: int = DEFAULT_RATE_LIMIT,
+                 period: float = DEFAULT_RATE_PERIOD):
+        if limit <= 0 or period <= 0:
+            raise ValueError('limit and period must be positive')
+        self._period = period
+        self._capacity = limit
+        self._rate = limit / period
+        self._tokens = float(limit)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self) -> int:
+        return self._capacity
+
+    @property
+    def tokens(self) -> float:
+        """approximate number of requests that can be sent right away"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self._capacity,
+                               self._tokens + elapsed * self._rate)
+            self._updated = now
+
+    def _reserve(self) -> float:
+        """
+        takes a token and returns how many seconds the caller has to wait
+        before using it. tokens may go negative: waiting callers queue up
+        behind each other instead of racing for the next token.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            wait = max(0.0, self._blocked_until - now)
+            if self._tokens < 0:
+                wait = max(wait, -self._tokens / self._rate)
+            return wait
+
+    def acquire(self):
+        """blocks until a request may be sent"""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """same as acquire, without blocking the event loop"""
+        # imported here, the sync clients shouldn't pay for asyncio
+        import asyncio
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def update(self, headers: Mapping[str, str]):
+        """
+        syncs the bucket with the rate limit headers of a response
+        """
+        limit = _int_header(headers, 'X-RateLimit-Limit')
+        remaining = _int_header(headers, 'X-RateLimit-Remaining')
+        reset = _int_header(headers, 'X-RateLimit-Reset')
+        if limit is None and remaining is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if limit and limit != self._capacity:
+                self._capacity = limit
+                self._rate = limit / self._period
+            if remaining is not None:
+                self._tokens = min(self._tokens, remaining)
+                if remaining <= 0 and reset is not None:
+                    # the quota is used up until the reset time (epoch secs)
+                    self._blocked_until = max(
+                        self._blocked_until,
+                        now + max(0.0, reset - time.time()))
+
+
+def _int_header(headers: Mapping[str, str], name: str) -> Optional[int]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        return None
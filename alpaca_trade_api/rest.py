@@ -1,17 +1,30 @@
+from __future__ import annotations
+
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 import logging
-import os
-from typing import Iterator, List, Optional, Union
+from typing import Dict, Iterator, List, Optional, Union
 import requests
-from requests.exceptions import HTTPError
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, HTTPError, Timeout
 import time
 from enum import Enum
+import urllib.parse
+import uuid
 from alpaca_trade_api import __version__
 from .common import (
     get_base_url,
     get_data_url,
     get_credentials,
-    get_api_version, URL, FLOAT,
+    get_api_version, URL, FLOAT, to_unix_nanos, rfc3339_nanos, LazyModule,
 )
+from .cache import DataCache
+from .jsonlib import JsonDecoder, default_decoder
+from .metrics import RequestMetrics
+from .ratelimit import RateLimiter
+from .sync import BarStore
+from .retry import RetryPolicy
 from .entity import (
     Bar, Entity, Account, AccountConfigurations, AccountActivity,
     Asset, Order, Position, Clock, Calendar,
@@ -20,9 +33,12 @@ from .entity import (
 from .entity_v2 import (
     BarV2, BarsV2, LatestBarsV2, LatestQuotesV2, LatestTradesV2,
     SnapshotV2, SnapshotsV2, TradesV2, TradeV2, QuotesV2, QuoteV2,
-    NewsV2, NewsListV2, OrderbookV2, OrderbooksV2
+    NewsV2, NewsListV2, OrderbookV2, OrderbooksV2, ColumnarFrameBuilder,
+    bar_mapping_v2, quote_mapping_v2, trade_mapping_v2, frame_chunks
 )
 
+pd = LazyModule('pandas')
+
 logger = logging.getLogger(__name__)
 Positions = List[Position]
 Orders = List[Order]
@@ -37,10 +53,25 @@ NewsIterator = Iterator[Union[NewsV2, dict]]
 
 DATA_V2_MAX_LIMIT = 10000  # max items per api call
 NEWS_MAX_LIMIT = 50  # max items per api call
+# longer symbol lists are split into batches requested concurrently
+DATA_MAX_SYMBOLS_PER_REQUEST = 1000
+DATA_MAX_URL_LENGTH = 8000
+DATA_URL_RESERVE = 512  # for the rest of the url (path, other params)
+DATA_MAX_CONCURRENT_BATCHES = 4
+# shards of one request paged at the same time, the others wait for a thread
+DATA_MAX_CONCURRENT_SHARDS = 8
+MAX_CONCURRENT_ORDERS = 8  # submit_orders default
 
 
 class RetryException(Exception):
-    pass
+    """
+    Raised for a response the retry policy wants to send again.
+    error.response holds that response.
+    """
+
+    def __init__(self, response=None):
+        super().__init__()
+        self.response = response
 
 
 class APIError(Exception):
@@ -63,16 +94,27 @@ class APIError(Exception):
         http_error = self._http_error
         if http_error is not None and hasattr(http_error, 'response'):
             return http_error.response.status_code
+        # aiohttp.ClientResponseError, raised for AsyncRest
+        return getattr(http_error, 'status', None)
 
     @property
     def request(self):
         if self._http_error is not None:
-            return self._http_error.request
+            return getattr(self._http_error, 'request', None)
 
     @property
     def response(self):
         if self._http_error is not None:
-            return self._http_error.response
+            return getattr(self._http_error, 'response', None)
+
+
+def _error_status(error: Exception) -> Optional[int]:
+    """http status code of an APIError or HTTPError, if there was one"""
+    if isinstance(error, APIError):
+        return error.status_code
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
 
 def raise_api_error(resp: requests.Response, http_error: requests.HTTPError):
     try:
@@ -168,11 +210,39 @@ class REST(object):
                  base_url: URL = None,
                  api_version: str = None,
                  oauth=None,
-                 raw_data: bool = False
+                 raw_data: bool = False,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 data_cache: Optional[DataCache] = None,
+                 symbols_per_request: int = DATA_MAX_SYMBOLS_PER_REQUEST,
+                 max_url_length: int = DATA_MAX_URL_LENGTH,
+                 json_decoder: Optional[JsonDecoder] = None,
+                 metrics: Optional[RequestMetrics] = None,
+                 max_shard_workers: int = DATA_MAX_CONCURRENT_SHARDS,
                  ):
         """
         :param raw_data: should we return api response raw or wrap it with
                          Entity objects.
+        :param rate_limiter: paces the requests on the client side, can be
+                         shared with other REST/AsyncRest instances.
+        :param retry_policy: when and how often failed requests are sent
+                         again, built from the APCA_RETRY_* environment
+                         variables by default.
+        :param data_cache: serves historical bars/trades/quotes of finished
+                         days from a local cache, see DataCache.
+        :param symbols_per_request: historical data requests for more
+                         symbols than this are split into several ones,
+                         sent concurrently.
+        :param max_url_length: same, for symbol lists too long to fit in
+                         an url of this length.
+        :param json_decoder: decodes the response bodies (bytes), the
+                         fastest json library installed by default, see
+                         jsonlib.
+        :param metrics: records latencies, retries, bytes received... of
+                         the requests, see RequestMetrics.
+        :param max_shard_workers: threads (and connections) paging the
+                         shards of one historical data request, however
+                         many shards are asked for.
         """
         self._key_id, self._secret_key, self._oauth = get_credentials(
             key_id, secret_key, oauth)
@@ -180,10 +250,41 @@ class REST(object):
         self._api_version = get_api_version(api_version)
         self._session = requests.Session()
         self._use_raw_data = raw_data
-        self._retry = int(os.environ.get('APCA_RETRY_MAX', 3))
-        self._retry_wait = int(os.environ.get('APCA_RETRY_WAIT', 3))
-        self._retry_codes = [int(o) for o in os.environ.get(
-            'APCA_RETRY_CODES', '429,504').split(',')]
+        self._retry_policy = retry_policy or RetryPolicy.from_env()
+        self._rate_limiter = rate_limiter
+        self._data_cache = data_cache
+        self._symbols_per_request = symbols_per_request
+        self._max_url_length = max_url_length
+        self._json_decoder = json_decoder or default_decoder
+        self._metrics = metrics
+        if max_shard_workers < 1:
+            raise ValueError('max_shard_workers must be at least 1')
+        self._max_shard_workers = max_shard_workers
+
+    # kept for code that tunes these on the instance
+    @property
+    def _retry(self) -> int:
+        return self._retry_policy.max_retries
+
+    @_retry.setter
+    def _retry(self, value: int):
+        self._retry_policy.max_retries = value
+
+    @property
+    def _retry_wait(self) -> float:
+        return self._retry_policy.backoff
+
+    @_retry_wait.setter
+    def _retry_wait(self, value: float):
+        self._retry_policy.backoff = value
+
+    @property
+    def _retry_codes(self) -> List[int]:
+        return self._retry_policy.retry_codes
+
+    @_retry_codes.setter
+    def _retry_codes(self, value: List[int]):
+        self._retry_policy.retry_codes = value
 
     def _request(self,
                  method,
@@ -214,41 +315,83 @@ class REST(object):
         else:
             opts['json'] = data
 
-        retry = self._retry
-        if retry < 0:
-            retry = 0
-        while retry >= 0:
+        policy = self._retry_policy
+        deadline = policy.deadline(time.monotonic())
+        attempt = 0
+        while True:
+            retry = max(policy.max_retries - attempt, 0)
             try:
                 return self._one_request(method, url, opts, retry)
-            except RetryException:
-                retry_wait = self._retry_wait
-                logger.warning(
-                    'sleep {} seconds and retrying {} '
-                    '{} more time(s)...'.format(
-                        retry_wait, url, retry))
-                time.sleep(retry_wait)
-                retry -= 1
-                continue
+            except RetryException as e:
+                error = e
+                retry_wait = policy.delay(
+                    attempt, e.response.headers.get('Retry-After'))
+            except (ConnectionError, Timeout) as e:
+                if not retry or not policy.should_retry(method, error=e):
+                    raise
+                error = e
+                retry_wait = policy.delay(attempt)
+            if (deadline is not None and
+                    time.monotonic() + retry_wait > deadline):
+                logger.warning('giving up on {} after {} attempt(s)'.format(
+                    url, attempt + 1))
+                if isinstance(error, RetryException):
+                    raise_api_error(error.response, error.__cause__)
+                raise error
+            logger.warning(
+                'sleep {:.2f} seconds and retrying {} '
+                '{} more time(s)...'.format(
+                    retry_wait, url, retry))
+            if self._metrics is not None:
+                self._metrics.retry(method, url)
+            time.sleep(retry_wait)
+            attempt += 1
 
     def _one_request(self, method: str, url: URL, opts: dict, retry: int):
         """
         Perform one request, possibly raising RetryException in the case
-        the response is 429. Otherwise, if error text contain "code" string,
+        the response is 429 (or another code the retry policy wants to
+        retry). Otherwise, if error text contain "code" string,
         then it decodes to json object and returns APIError.
         Returns the body json in the 200 status.
         """
-        retry_codes = self._retry_codes
-        resp = self._session.request(method, url, **opts)
+        rate_limiter = self._rate_limiter
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        metrics = self._metrics
+        started = time.perf_counter()
+        try:
+            resp = self._session.request(method, url, **opts)
+        except (ConnectionError, Timeout):
+            if metrics is not None:
+                metrics.request(method, url, None,
+                                time.perf_counter() - started)
+            raise
+        if rate_limiter is not None:
+            rate_limiter.update(resp.headers)
+        if metrics is not None:
+            metrics.request(method, url, resp.status_code,
+                            time.perf_counter() - started, len(resp.content),
+                            resp.elapsed.total_seconds())
+            metrics.rate_limit(resp.headers)
         try:
             resp.raise_for_status()
         except HTTPError as http_error:
             # retry if we hit Rate Limit
-            if resp.status_code in retry_codes and retry > 0:
-                raise RetryException()
+            if retry > 0 and self._retry_policy.should_retry(
+                    method, resp.status_code):
+                raise RetryException(resp) from http_error
             raise_api_error(resp, http_error)
-        if resp.text != '':
-            return resp.json()
-        return None
+        content = resp.content
+        if not content:
+            return None
+        # straight from the bytes, without decoding them to text first
+        if metrics is None:
+            return self._json_decoder(content)
+        started = time.perf_counter()
+        data = self._json_decoder(content)
+        metrics.decode(method, url, time.perf_counter() - started)
+        return data
 
     def get(self, path, data=None):
         return self._request('GET', path, data)
@@ -334,24 +477,8 @@ class REST(object):
         :param symbols: list of str (symbols)
         :param side: Lets you filter to only 'buy' or 'sell' orders
         """
-        if params is None:
-            params = dict()
-        if limit is not None:
-            params['limit'] = limit
-        if after is not None:
-            params['after'] = after
-        if until is not None:
-            params['until'] = until
-        if direction is not None:
-            params['direction'] = direction
-        if status is not None:
-            params['status'] = status
-        if nested is not None:
-            params['nested'] = nested
-        if side is not None:
-            params['side'] = side
-        if symbols is not None:
-            params['symbols'] = ",".join(symbols)
+        params = _list_orders_params(status, limit, after, until, direction,
+                                     params, nested, symbols, side)
         url = '/orders'
         resp = self.get(url, params)
         if self._use_raw_data:
@@ -396,43 +523,73 @@ class REST(object):
         :param notional: float. Mutually exclusive with "qty".
         """
         """Request a new order"""
-        params = {
-            'symbol':        symbol,
-            'side':          side,
-            'type':          type,
-            'time_in_force': time_in_force
-        }
-        if qty is not None:
-            params['qty'] = qty
-        if notional is not None:
-            params['notional'] = notional
-        if limit_price is not None:
-            params['limit_price'] = FLOAT(limit_price)
-        if stop_price is not None:
-            params['stop_price'] = FLOAT(stop_price)
-        if client_order_id is not None:
-            params['client_order_id'] = client_order_id
-        if extended_hours is not None:
-            params['extended_hours'] = extended_hours
-        if order_class is not None:
-            params['order_class'] = order_class
-        if take_profit is not None:
-            if 'limit_price' in take_profit:
-                take_profit['limit_price'] = FLOAT(take_profit['limit_price'])
-            params['take_profit'] = take_profit
-        if stop_loss is not None:
-            if 'limit_price' in stop_loss:
-                stop_loss['limit_price'] = FLOAT(stop_loss['limit_price'])
-            if 'stop_price' in stop_loss:
-                stop_loss['stop_price'] = FLOAT(stop_loss['stop_price'])
-            params['stop_loss'] = stop_loss
-        if trail_price is not None:
-            params['trail_price'] = trail_price
-        if trail_percent is not None:
-            params['trail_percent'] = trail_percent
+        params = _order_params(symbol, qty, side, type, time_in_force,
+                               limit_price, stop_price, client_order_id,
+                               extended_hours, order_class, take_profit,
+                               stop_loss, trail_price, trail_percent, notional)
         resp = self.post('/orders', params)
         return self.response_wrapper(resp, Order)
 
+    def submit_orders(self,
+                      orders: List[dict],
+                      max_concurrency: int = MAX_CONCURRENT_ORDERS,
+                      ) -> List[Union[Order, Exception]]:
+        """
+        Submits orders concurrently, on up to `max_concurrency` pooled
+        connections. Requests still go through the rate limiter, if any.
+
+        :param orders: one dict of submit_order arguments per order, e.g.
+               {'symbol': 'AAPL', 'qty': 10, 'side': 'buy'}
+        :return: one entry per order, in the same order: the Order, or the
+                 exception submitting it raised.
+
+        Orders without a client_order_id get a random one. When a
+        submission fails in a way that leaves its outcome unknown
+        (connection error, timeout, 5xx), the order is looked up by that
+        id and only sent again if the api doesn't have it, so orders are
+        never placed twice.
+        """
+        specs = []
+        for order in orders:
+            spec = dict(order)
+            if not spec.get('client_order_id'):
+                spec['client_order_id'] = str(uuid.uuid4())
+            specs.append(spec)
+        if not specs:
+            return []
+        workers = max(1, min(max_concurrency, len(specs)))
+        self._ensure_pool_size(workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self._submit_order_idempotent, spec)
+                       for spec in specs]
+        return [f.exception() or f.result() for f in futures]
+
+    def _submit_order_idempotent(self, spec: dict) -> Order:
+        policy = self._retry_policy
+        attempt = 0
+        while True:
+            try:
+                return self.submit_order(**spec)
+            except (ConnectionError, Timeout, APIError, HTTPError) as e:
+                if not isinstance(e, (ConnectionError, Timeout)) and \
+                        (_error_status(e) or 0) < 500:
+                    raise
+                if attempt >= policy.max_retries:
+                    raise
+            try:
+                # the first attempt may have gone through
+                return self.get_order_by_client_order_id(
+                    spec['client_order_id'])
+            except (APIError, HTTPError) as e:
+                if _error_status(e) != 404:
+                    raise
+            retry_wait = policy.delay(attempt)
+            logger.warning(
+                'sleep {:.2f} seconds and resubmitting order {}'.format(
+                    retry_wait, spec['client_order_id']))
+            time.sleep(retry_wait)
+            attempt += 1
+
     def get_order_by_client_order_id(self, client_order_id: str) -> Order:
         """Get an order by client order id"""
         params = {
@@ -471,19 +628,8 @@ class REST(object):
         note: you cannot replace type of order. so, it was trailing_stop(e.g)
               it will remain trailing_stop.
         """
-        params = {}
-        if qty is not None:
-            params['qty'] = qty
-        if limit_price is not None:
-            params['limit_price'] = FLOAT(limit_price)
-        if stop_price is not None:
-            params['stop_price'] = FLOAT(stop_price)
-        if trail is not None:
-            params['trail'] = FLOAT(trail)
-        if time_in_force is not None:
-            params['time_in_force'] = time_in_force
-        if client_order_id is not None:
-            params['client_order_id'] = client_order_id
+        params = _replace_order_params(qty, limit_price, stop_price, trail,
+                                       time_in_force, client_order_id)
         resp = self.patch('/orders/{}'.format(order_id), params)
         return self.response_wrapper(resp, Order)
 
@@ -556,19 +702,215 @@ class REST(object):
     def _data_get(self,
                   endpoint: str,
                   symbol_or_symbols: Union[str, List[str]],
-                  api_version: str = 'v2',
-                  endpoint_base: str = 'stocks',
-                  resp_grouped_by_symbol: Optional[bool] = None,
-                  page_limit: int = DATA_V2_MAX_LIMIT,
-                  feed: Optional[str] = None,
-                  asof: Optional[str] = None,
-                  loc: Optional[str] = None,
                   **kwargs):
+        for page in self._data_get_pages(endpoint, symbol_or_symbols,
+                                         **kwargs):
+            yield from page
+
+    def _data_get_pages(self,
+                        endpoint: str,
+                        symbol_or_symbols: Union[str, List[str]],
+                        shards: Optional[int] = None,
+                        **kwargs):
+        """
+        Same as _data_get, but yields the items of every api page as a list,
+        which lets callers process the data page by page.
+        :param shards: when > 1 and both start and end are given (and no
+               limit), the time range is split into that many shards which
+               are paged concurrently. Items are still returned in the same
+               order as a serial request.
+        """
+        cache = self._data_cache
+        if cache is not None and cache.accepts(endpoint, **kwargs):
+            return self._cached_pages(endpoint, symbol_or_symbols, shards,
+                                      **kwargs)
+        return self._fetch_data_pages(endpoint, symbol_or_symbols, shards,
+                                      **kwargs)
+
+    def _cached_pages(self,
+                      endpoint: str,
+                      symbol_or_symbols: Union[str, List[str]],
+                      shards: Optional[int],
+                      start,
+                      end,
+                      sort: Optional[str] = None,
+                      page_limit: int = DATA_V2_MAX_LIMIT,
+                      resp_grouped_by_symbol: Optional[bool] = None,
+                      limit=None,
+                      **params):
+        grouped = _is_grouped_by_symbol(
+            symbol_or_symbols, params.get('api_version', 'v2'),
+            resp_grouped_by_symbol)
+        symbols = [symbol_or_symbols] if isinstance(symbol_or_symbols, str) \
+            else list(symbol_or_symbols)
+
+        def fetch(syms, fetch_start, fetch_end):
+            # always the multi symbol endpoint, so items come with 'S'
+            return self._fetch_data_pages(
+                endpoint, syms, shards, start=fetch_start, end=fetch_end,
+                page_limit=page_limit, resp_grouped_by_symbol=True,
+                **params)
+
+        return self._data_cache.pages(fetch, endpoint, symbols, start, end,
+                                      grouped, sort=sort, **params)
+
+    def _fetch_data_pages(self,
+                          endpoint: str,
+                          symbol_or_symbols: Union[str, List[str]],
+                          shards: Optional[int] = None,
+                          **kwargs):
+        batches = self._symbol_batches(symbol_or_symbols, **kwargs)
+        if len(batches) > 1:
+            return self._fetch_batched_pages(endpoint, batches, shards,
+                                             **kwargs)
+        if (shards and shards > 1 and not kwargs.get('limit') and
+                kwargs.get('start') and kwargs.get('end')):
+            return self._fetch_sharded_pages(endpoint, symbol_or_symbols,
+                                             shards, **kwargs)
+        return self._fetch_pages(endpoint, symbol_or_symbols, **kwargs)
+
+    def _fetch_sharded_pages(self,
+                             endpoint: str,
+                             symbol_or_symbols: Union[str, List[str]],
+                             shards: int,
+                             start: str,
+                             end: str,
+                             **kwargs):
+        windows = _split_time_range(start, end, shards)
+        if str(kwargs.get('sort') or '') == Sort.Desc.value:
+            windows.reverse()
+        workers = min(len(windows), self._max_shard_workers)
+        self._ensure_pool_size(workers)
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = [
+            executor.submit(
+                lambda s, e: list(self._fetch_pages(
+                    endpoint, symbol_or_symbols, start=s, end=e, **kwargs)),
+                s, e)
+            for s, e in windows
+        ]
+        try:
+            if not _is_grouped_by_symbol(symbol_or_symbols, **kwargs):
+                # the shards are consecutive, so is their concatenation
+                for future in futures:
+                    yield from future.result()
+            else:
+                # multi symbol responses are ordered by symbol first
+                by_symbol = defaultdict(list)
+                for future in futures:
+                    for page in future.result():
+                        for item in page:
+                            by_symbol[item['S']].append(item)
+                for sym in sorted(by_symbol):
+                    yield by_symbol[sym]
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _symbol_batches(self,
+                        symbol_or_symbols: Union[str, List[str]],
+                        **kwargs) -> list:
+        """
+        splits a symbol list that doesn't fit in one request into sorted,
+        consecutive batches, so that their responses (ordered by symbol)
+        can simply be concatenated.
+        """
+        if (isinstance(symbol_or_symbols, str) or
+                not _is_grouped_by_symbol(symbol_or_symbols, **kwargs)):
+            return [symbol_or_symbols]
+        budget = self._max_url_length - DATA_URL_RESERVE
+        batches = [[]]
+        size = 0
+        for symbol in sorted(set(symbol_or_symbols)):
+            length = len(urllib.parse.quote(symbol, safe='')) + len('%2C')
+            batch = batches[-1]
+            if batch and (len(batch) >= self._symbols_per_request or
+                          size + length > budget):
+                batch = []
+                batches.append(batch)
+                size = 0
+            batch.append(symbol)
+            size += length
+        if len(batches) == 1:
+            return [symbol_or_symbols]
+        return batches
+
+    def _fetch_batched_pages(self,
+                             endpoint: str,
+                             batches: List[List[str]],
+                             shards: Optional[int] = None,
+                             limit: Optional[int] = None,
+                             **kwargs):
+        if limit:
+            # the limit is shared by all the symbols, in symbol order
+            remaining = int(limit)
+            for batch in batches:
+                for page in self._fetch_data_pages(endpoint, batch, shards,
+                                                   limit=remaining,
+                                                   **kwargs):
+                    remaining -= len(page)
+                    yield page
+                if remaining <= 0:
+                    return
+            return
+
+        def fetch(batch):
+            return list(self._fetch_data_pages(endpoint, batch, shards,
+                                               **kwargs))
+
+        workers = min(len(batches), DATA_MAX_CONCURRENT_BATCHES)
+        self._ensure_pool_size(
+            workers * min(max(shards or 1, 1), self._max_shard_workers))
+        executor = ThreadPoolExecutor(max_workers=workers)
+        batches = iter(batches)
+        # only a few batches ahead of the consumer are kept in memory
+        pending = deque(executor.submit(fetch, batch)
+                        for batch in islice(batches, workers))
+        try:
+            while pending:
+                pages = pending.popleft().result()
+                for batch in islice(batches, 1):
+                    pending.append(executor.submit(fetch, batch))
+                yield from pages
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _ensure_pool_size(self, size: int):
+        """
+        makes sure the session keeps enough connections around to serve
+        `size` concurrent requests. The mounted adapters are resized in
+        place, so they keep their retries, TLS or proxy settings, and are
+        never shrunk.
+        """
+        adapters = {id(a): a for a in self._session.adapters.values()}
+        for adapter in adapters.values():
+            if (not isinstance(adapter, HTTPAdapter) or
+                    adapter._pool_maxsize >= size):
+                continue
+            previous = adapter.poolmanager
+            adapter.init_poolmanager(adapter._pool_connections, size,
+                                     block=adapter._pool_block)
+            # closes the connections the previous pools kept around
+            previous.clear()
+
+    def _fetch_pages(self,
+                     endpoint: str,
+                     symbol_or_symbols: Union[str, List[str]],
+                     api_version: str = 'v2',
+                     endpoint_base: str = 'stocks',
+                     resp_grouped_by_symbol: Optional[bool] = None,
+                     page_limit: int = DATA_V2_MAX_LIMIT,
+                     feed: Optional[str] = None,
+                     asof: Optional[str] = None,
+                     loc: Optional[str] = None,
+                     **kwargs):
         page_token = None
         total_items = 0
         limit = kwargs.get('limit')
-        is_multi_symbol = api_version == 'v1beta3' or \
-            not isinstance(symbol_or_symbols, str)
+        is_multi_symbol = _is_multi_symbol(symbol_or_symbols, api_version)
         if resp_grouped_by_symbol is None:
             resp_grouped_by_symbol = is_multi_symbol
         while True:
@@ -595,16 +937,17 @@ class REST(object):
                                  api_version=api_version)
             if not resp_grouped_by_symbol:
                 k = endpoint or endpoint_base
-                for item in resp.get(k, []) or []:
-                    yield item
-                    total_items += 1
+                page = resp.get(k, []) or []
             else:
+                page = []
                 by_symbol = resp.get(endpoint, {}) or {}
                 for sym, items in sorted(by_symbol.items()):
                     for item in items or []:
                         item['S'] = sym
-                        yield item
-                        total_items += 1
+                    page.extend(items or [])
+            if page:
+                yield page
+                total_items += len(page)
             page_token = resp.get('next_page_token')
             if not page_token:
                 break
@@ -617,7 +960,8 @@ class REST(object):
                         feed: Optional[str] = None,
                         asof: Optional[str] = None,
                         sort: Optional[Sort] = None,
-                        raw=False) -> TradeIterator:
+                        raw=False,
+                        shards: Optional[int] = None) -> TradeIterator:
         trades = self._data_get('trades', symbol,
                                 start=start,
                                 end=end,
@@ -625,6 +969,7 @@ class REST(object):
                                 feed=feed,
                                 asof=asof,
                                 sort=sort,
+                                shards=shards,
                                 )
         for trade in trades:
             if raw:
@@ -640,6 +985,7 @@ class REST(object):
                    feed: Optional[str] = None,
                    asof: Optional[str] = None,
                    sort: Optional[Sort] = None,
+                   shards: Optional[int] = None,
                    ) -> TradesV2:
         trades = list(self.get_trades_iter(symbol,
                                            start=start,
@@ -648,9 +994,68 @@ class REST(object):
                                            feed=feed,
                                            asof=asof,
                                            sort=sort,
+                                           shards=shards,
                                            raw=True))
         return TradesV2(trades)
 
+    def get_trades_frame(self,
+                         symbol: Union[str, List[str]],
+                         start: Optional[str] = None,
+                         end: Optional[str] = None,
+                         limit: int = None,
+                         feed: Optional[str] = None,
+                         asof: Optional[str] = None,
+                         sort: Optional[Sort] = None,
+                         shards: Optional[int] = None,
+                         multiindex: bool = False,
+                         downcast: Optional[str] = None,
+                         ) -> pd.DataFrame:
+        """
+        Same result as get_trades(...).df, built column by column from the
+        api pages without creating a Trade entity per item.
+        multiindex and downcast reshape it, see entity_v2.format_frame.
+        """
+        pages = self._data_get_pages('trades', symbol,
+                                     start=start,
+                                     end=end,
+                                     limit=limit,
+                                     feed=feed,
+                                     asof=asof,
+                                     sort=sort,
+                                     shards=shards,
+                                     )
+        builder = ColumnarFrameBuilder(trade_mapping_v2).extend(pages)
+        return builder.frame(multiindex, downcast,
+                             symbol if isinstance(symbol, str) else None)
+
+    def get_trades_chunks(self,
+                          symbol: Union[str, List[str]],
+                          start: Optional[str] = None,
+                          end: Optional[str] = None,
+                          limit: int = None,
+                          feed: Optional[str] = None,
+                          asof: Optional[str] = None,
+                          sort: Optional[Sort] = None,
+                          shards: Optional[int] = None,
+                          chunk_rows: int = 1_000_000,
+                          ) -> Iterator[pd.DataFrame]:
+        """
+        Same data as get_trades_frame(...), yielded as DataFrames of
+        chunk_rows rows (the last one may be shorter), so memory stays
+        bounded however long the range is. Note that with shards, a whole
+        shard is held in memory while it is being consumed.
+        """
+        pages = self._data_get_pages('trades', symbol,
+                                     start=start,
+                                     end=end,
+                                     limit=limit,
+                                     feed=feed,
+                                     asof=asof,
+                                     sort=sort,
+                                     shards=shards,
+                                     )
+        return frame_chunks(trade_mapping_v2, pages, chunk_rows)
+
     def get_quotes_iter(self,
                         symbol: Union[str, List[str]],
                         start: Optional[str] = None,
@@ -659,7 +1064,8 @@ class REST(object):
                         feed: Optional[str] = None,
                         asof: Optional[str] = None,
                         sort: Optional[Sort] = None,
-                        raw=False) -> QuoteIterator:
+                        raw=False,
+                        shards: Optional[int] = None) -> QuoteIterator:
         quotes = self._data_get('quotes', symbol,
                                 start=start,
                                 end=end,
@@ -667,6 +1073,7 @@ class REST(object):
                                 feed=feed,
                                 asof=asof,
                                 sort=sort,
+                                shards=shards,
                                 )
         for quote in quotes:
             if raw:
@@ -682,6 +1089,7 @@ class REST(object):
                    feed: Optional[str] = None,
                    asof: Optional[str] = None,
                    sort: Optional[Sort] = None,
+                   shards: Optional[int] = None,
                    ) -> QuotesV2:
         quotes = list(self.get_quotes_iter(symbol=symbol,
                                            start=start,
@@ -691,9 +1099,68 @@ class REST(object):
                                            raw=True,
                                            asof=asof,
                                            sort=sort,
+                                           shards=shards,
                                            ))
         return QuotesV2(quotes)
 
+    def get_quotes_frame(self,
+                         symbol: Union[str, List[str]],
+                         start: Optional[str] = None,
+                         end: Optional[str] = None,
+                         limit: int = None,
+                         feed: Optional[str] = None,
+                         asof: Optional[str] = None,
+                         sort: Optional[Sort] = None,
+                         shards: Optional[int] = None,
+                         multiindex: bool = False,
+                         downcast: Optional[str] = None,
+                         ) -> pd.DataFrame:
+        """
+        Same result as get_quotes(...).df, built column by column from the
+        api pages without creating a Quote entity per item.
+        multiindex and downcast reshape it, see entity_v2.format_frame.
+        """
+        pages = self._data_get_pages('quotes', symbol,
+                                     start=start,
+                                     end=end,
+                                     limit=limit,
+                                     feed=feed,
+                                     asof=asof,
+                                     sort=sort,
+                                     shards=shards,
+                                     )
+        builder = ColumnarFrameBuilder(quote_mapping_v2).extend(pages)
+        return builder.frame(multiindex, downcast,
+                             symbol if isinstance(symbol, str) else None)
+
+    def get_quotes_chunks(self,
+                          symbol: Union[str, List[str]],
+                          start: Optional[str] = None,
+                          end: Optional[str] = None,
+                          limit: int = None,
+                          feed: Optional[str] = None,
+                          asof: Optional[str] = None,
+                          sort: Optional[Sort] = None,
+                          shards: Optional[int] = None,
+                          chunk_rows: int = 1_000_000,
+                          ) -> Iterator[pd.DataFrame]:
+        """
+        Same data as get_quotes_frame(...), yielded as DataFrames of
+        chunk_rows rows (the last one may be shorter), so memory stays
+        bounded however long the range is. Note that with shards, a whole
+        shard is held in memory while it is being consumed.
+        """
+        pages = self._data_get_pages('quotes', symbol,
+                                     start=start,
+                                     end=end,
+                                     limit=limit,
+                                     feed=feed,
+                                     asof=asof,
+                                     sort=sort,
+                                     shards=shards,
+                                     )
+        return frame_chunks(quote_mapping_v2, pages, chunk_rows)
+
     def get_bars_iter(self,
                       symbol: Union[str, List[str]],
                       timeframe: TimeFrame,
@@ -704,7 +1171,8 @@ class REST(object):
                       feed: Optional[str] = None,
                       asof: Optional[str] = None,
                       sort: Optional[Sort] = None,
-                      raw=False) -> BarIterator:
+                      raw=False,
+                      shards: Optional[int] = None) -> BarIterator:
         bars = self._data_get('bars', symbol,
                               timeframe=timeframe,
                               adjustment=adjustment,
@@ -714,6 +1182,7 @@ class REST(object):
                               feed=feed,
                               asof=asof,
                               sort=sort,
+                              shards=shards,
                               )
         for bar in bars:
             if raw:
@@ -731,6 +1200,7 @@ class REST(object):
                  feed: Optional[str] = None,
                  asof: Optional[str] = None,
                  sort: Optional[Sort] = None,
+                 shards: Optional[int] = None,
                  ) -> BarsV2:
         bars = list(self.get_bars_iter(symbol,
                                        timeframe,
@@ -741,9 +1211,115 @@ class REST(object):
                                        feed=feed,
                                        asof=asof,
                                        sort=sort,
+                                       shards=shards,
                                        raw=True))
         return BarsV2(bars)
 
+    def get_bars_frame(self,
+                       symbol: Union[str, List[str]],
+                       timeframe: TimeFrame,
+                       start: Optional[str] = None,
+                       end: Optional[str] = None,
+                       adjustment: str = 'raw',
+                       limit: int = None,
+                       feed: Optional[str] = None,
+                       asof: Optional[str] = None,
+                       sort: Optional[Sort] = None,
+                       shards: Optional[int] = None,
+                       multiindex: bool = False,
+                       downcast: Optional[str] = None,
+                       ) -> pd.DataFrame:
+        """
+        Same result as get_bars(...).df, built column by column from the
+        api pages without creating a Bar entity per item.
+        multiindex and downcast reshape it, see entity_v2.format_frame.
+        """
+        pages = self._data_get_pages('bars', symbol,
+                                     timeframe=timeframe,
+                                     adjustment=adjustment,
+                                     start=start,
+                                     end=end,
+                                     limit=limit,
+                                     feed=feed,
+                                     asof=asof,
+                                     sort=sort,
+                                     shards=shards,
+                                     )
+        builder = ColumnarFrameBuilder(bar_mapping_v2).extend(pages)
+        return builder.frame(multiindex, downcast,
+                             symbol if isinstance(symbol, str) else None)
+
+    def get_bars_chunks(self,
+                        symbol: Union[str, List[str]],
+                        timeframe: TimeFrame,
+                        start: Optional[str] = None,
+                        end: Optional[str] = None,
+                        adjustment: str = 'raw',
+                        limit: int = None,
+                        feed: Optional[str] = None,
+                        asof: Optional[str] = None,
+                        sort: Optional[Sort] = None,
+                        shards: Optional[int] = None,
+                        chunk_rows: int = 1_000_000,
+                        ) -> Iterator[pd.DataFrame]:
+        """
+        Same data as get_bars_frame(...), yielded as DataFrames of
+        chunk_rows rows (the last one may be shorter), so memory stays
+        bounded however long the range is. Note that with shards, a whole
+        shard is held in memory while it is being consumed.
+        """
+        pages = self._data_get_pages('bars', symbol,
+                                     timeframe=timeframe,
+                                     adjustment=adjustment,
+                                     start=start,
+                                     end=end,
+                                     limit=limit,
+                                     feed=feed,
+                                     asof=asof,
+                                     sort=sort,
+                                     shards=shards,
+                                     )
+        return frame_chunks(bar_mapping_v2, pages, chunk_rows)
+
+    def sync_bars(self,
+                  store: BarStore,
+                  symbols: List[str],
+                  timeframe: TimeFrame,
+                  start: str,
+                  end: Optional[str] = None,
+                  adjustment: str = 'raw',
+                  feed: Optional[str] = None,
+                  ) -> Dict[str, int]:
+        """
+        Brings the bars of store up to date: for every symbol, only the bars
+        after the last one stored (or from start for new symbols) are
+        requested and appended to the store. Symbols that resume from the
+        same timestamp are fetched together.
+        Returns the number of new bars per symbol.
+        """
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        by_start = defaultdict(list)
+        for symbol, last in store.last_timestamps(symbols).items():
+            resume = rfc3339_nanos(last + 1) if last is not None else start
+            by_start[resume].append(symbol)
+        counts = dict.fromkeys(symbols, 0)
+        for resume, group in by_start.items():
+            pages = self._data_get_pages('bars', group,
+                                         timeframe=timeframe,
+                                         adjustment=adjustment,
+                                         start=resume,
+                                         end=end,
+                                         feed=feed,
+                                         )
+            df = ColumnarFrameBuilder(bar_mapping_v2).extend(pages).df
+            if df.empty:
+                continue
+            for symbol, bars in df.groupby('symbol', sort=False):
+                store.append(symbol, bars.drop(columns='symbol'))
+                counts[symbol] = len(bars)
+        return counts
+
     def get_latest_bar(self, symbol: str, feed: Optional[str] = None) -> BarV2:
         resp = self.data_get(
             '/stocks/{}/bars/latest'.format(symbol),
@@ -1172,8 +1748,129 @@ class REST(object):
         """
         if self._use_raw_data:
             return obj
-        else:
+        if self._metrics is None:
             return entity(obj)
+        started = time.perf_counter()
+        wrapped = entity(obj)
+        self._metrics.wrap(entity.__name__, time.perf_counter() - started)
+        return wrapped
+
+
+# request parameters shared with AsyncRest
+
+
+def _list_orders_params(status, limit, after, until, direction, params,
+                        nested, symbols, side) -> dict:
+    if params is None:
+        params = dict()
+    if limit is not None:
+        params['limit'] = limit
+    if after is not None:
+        params['after'] = after
+    if until is not None:
+        params['until'] = until
+    if direction is not None:
+        params['direction'] = direction
+    if status is not None:
+        params['status'] = status
+    if nested is not None:
+        params['nested'] = nested
+    if side is not None:
+        params['side'] = side
+    if symbols is not None:
+        params['symbols'] = ",".join(symbols)
+    return params
+
+
+def _order_params(symbol, qty, side, type, time_in_force, limit_price,
+                  stop_price, client_order_id, extended_hours, order_class,
+                  take_profit, stop_loss, trail_price, trail_percent,
+                  notional) -> dict:
+    params = {
+        'symbol':        symbol,
+        'side':          side,
+        'type':          type,
+        'time_in_force': time_in_force
+    }
+    if qty is not None:
+        params['qty'] = qty
+    if notional is not None:
+        params['notional'] = notional
+    if limit_price is not None:
+        params['limit_price'] = FLOAT(limit_price)
+    if stop_price is not None:
+        params['stop_price'] = FLOAT(stop_price)
+    if client_order_id is not None:
+        params['client_order_id'] = client_order_id
+    if extended_hours is not None:
+        params['extended_hours'] = extended_hours
+    if order_class is not None:
+        params['order_class'] = order_class
+    if take_profit is not None:
+        if 'limit_price' in take_profit:
+            take_profit['limit_price'] = FLOAT(take_profit['limit_price'])
+        params['take_profit'] = take_profit
+    if stop_loss is not None:
+        if 'limit_price' in stop_loss:
+            stop_loss['limit_price'] = FLOAT(stop_loss['limit_price'])
+        if 'stop_price' in stop_loss:
+            stop_loss['stop_price'] = FLOAT(stop_loss['stop_price'])
+        params['stop_loss'] = stop_loss
+    if trail_price is not None:
+        params['trail_price'] = trail_price
+    if trail_percent is not None:
+        params['trail_percent'] = trail_percent
+    return params
+
+
+def _replace_order_params(qty, limit_price, stop_price, trail, time_in_force,
+                          client_order_id) -> dict:
+    params = {}
+    if qty is not None:
+        params['qty'] = qty
+    if limit_price is not None:
+        params['limit_price'] = FLOAT(limit_price)
+    if stop_price is not None:
+        params['stop_price'] = FLOAT(stop_price)
+    if trail is not None:
+        params['trail'] = FLOAT(trail)
+    if time_in_force is not None:
+        params['time_in_force'] = time_in_force
+    if client_order_id is not None:
+        params['client_order_id'] = client_order_id
+    return params
+
+
+def _is_multi_symbol(symbol_or_symbols: Union[str, List[str]],
+                     api_version: str = 'v2') -> bool:
+    return api_version == 'v1beta3' or not isinstance(symbol_or_symbols, str)
+
+
+def _is_grouped_by_symbol(symbol_or_symbols: Union[str, List[str]],
+                          api_version: str = 'v2',
+                          resp_grouped_by_symbol: Optional[bool] = None,
+                          **kwargs) -> bool:
+    if resp_grouped_by_symbol is None:
+        return _is_multi_symbol(symbol_or_symbols, api_version)
+    return resp_grouped_by_symbol
+
+
+def _split_time_range(start: str, end: str, shards: int) -> List[tuple]:
+    """
+    splits [start, end] into up to `shards` consecutive, non overlapping
+    windows. The outer bounds are passed through as given, inner bounds are
+    whole seconds, each window ending 1ns before the next one starts.
+    """
+    start_ns = to_unix_nanos(start)
+    end_ns = to_unix_nanos(end)
+    step = (end_ns - start_ns) // shards // 10**9 * 10**9
+    if step <= 0:
+        return [(start, end)]
+    bounds = [start_ns - start_ns % 10**9 + step * i
+              for i in range(1, shards)]
+    starts = [start] + [rfc3339_nanos(b) for b in bounds]
+    ends = [rfc3339_nanos(b - 1) for b in bounds] + [end]
+    return list(zip(starts, ends))
 
 
 def _join_with_commas(x: Union[str, List[str]]) -> str:
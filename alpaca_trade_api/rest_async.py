@@ -1,10 +1,33 @@
+from __future__ import annotations
+
 import aiohttp
 import asyncio
+import logging
+import time
+from typing import List, Optional
 
+from alpaca_trade_api.entity import (
+    Account, AccountActivity, AccountConfigurations, Asset, Calendar, Clock,
+    Entity, Order, PortfolioHistory, Position, Watchlist,
+)
 from alpaca_trade_api.entity_v2 import BarsV2, QuotesV2, TradesV2, \
     EntityList, TradeV2, QuoteV2
-import pandas as pd
-from alpaca_trade_api.common import URL, get_credentials, get_data_url
+from alpaca_trade_api.common import (
+    URL, LazyModule, get_api_version, get_base_url, get_credentials,
+    get_data_url,
+)
+from alpaca_trade_api.jsonlib import JsonDecoder, default_decoder
+from alpaca_trade_api.metrics import RequestMetrics
+from alpaca_trade_api.ratelimit import RateLimiter
+from alpaca_trade_api.rest import (
+    APIError, RetryException, _list_orders_params, _order_params,
+    _replace_order_params,
+)
+from alpaca_trade_api.retry import RetryPolicy
+
+pd = LazyModule('pandas', 'DataFrames')
+
+logger = logging.getLogger(__name__)
 
 
 class AsyncRest:
@@ -13,14 +36,106 @@ class AsyncRest:
                  secret_key: str = None,
                  data_url: URL = None,
                  api_version: str = None,
-                 raw_data: bool = False
+                 raw_data: bool = False,
+                 connection_limit: int = 100,
+                 connection_limit_per_host: int = 0,
+                 dns_cache_ttl: Optional[int] = 300,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 json_decoder: Optional[JsonDecoder] = None,
+                 metrics: Optional[RequestMetrics] = None,
+                 base_url: URL = None,
+                 retry_policy: Optional[RetryPolicy] = None,
                  ):
         """
-        :param raw_data: should we return api response raw or wrap it with
-                         Entity objects.
+        :param api_version: of the trading api, v2 by default.
+        :param raw_data: should the trading endpoints return the api
+                         response raw or wrap it with Entity objects.
+        :param connection_limit: max number of simultaneous connections
+                         kept by the shared session (0 is unlimited)
+        :param connection_limit_per_host: same, per host (0 is unlimited)
+        :param dns_cache_ttl: seconds to cache resolved hosts (None caches
+                         forever)
+        :param rate_limiter: paces the requests on the client side, can be
+                         shared with other REST/AsyncRest instances.
+        :param json_decoder: decodes the response bodies (bytes), the
+                         fastest json library installed by default, see
+                         jsonlib.
+        :param metrics: records latencies, bytes received, DNS and connect
+                         times... of the requests, see RequestMetrics.
+        :param base_url: of the trading api, APCA_API_BASE_URL or live
+                         trading by default.
+        :param retry_policy: when and how often failed trading requests are
+                         sent again, same as REST: RetryPolicy.from_env()
+                         by default.
+
+        All the requests go through one keep-alive session, which is created
+        on first use. Close it with `await rest.close()`, or use the
+        instance as an async context manager:
+            async with AsyncRest() as rest:
+                ...
         """
         self._key_id, self._secret_key, _ = get_credentials(key_id, secret_key)
         self._data_url: URL = URL(data_url or get_data_url())
+        self._base_url: URL = URL(base_url or get_base_url())
+        self._api_version = get_api_version(api_version)
+        self._use_raw_data = raw_data
+        self._connection_limit = connection_limit
+        self._connection_limit_per_host = connection_limit_per_host
+        self._dns_cache_ttl = dns_cache_ttl
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop = None
+        self._session_closer = None
+        self._rate_limiter = rate_limiter
+        self._json_decoder = json_decoder or default_decoder
+        self._metrics = metrics
+        self._retry_policy = retry_policy or RetryPolicy.from_env()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        """
+        closes the shared session and its pooled connections
+        """
+        session, self._session = self._session, None
+        closer, self._session_closer = self._session_closer, None
+        if session is not None and not session.closed:
+            await session.close()
+        if (closer is not None and
+                closer.get_loop() is asyncio.get_running_loop()):
+            closer.cancel()
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """
+        returns the shared session, (re)creating it when it was closed or
+        belongs to a different event loop (e.g. after another asyncio.run())
+        """
+        loop = asyncio.get_running_loop()
+        if self._session is not None and self._session_loop is not loop:
+            session, self._session = self._session, None
+            await _close_other_loop_session(session, self._session_loop)
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self._connection_limit,
+                limit_per_host=self._connection_limit_per_host,
+                ttl_dns_cache=self._dns_cache_ttl,
+                use_dns_cache=True,
+            )
+            trace_configs = []
+            if self._metrics is not None:
+                trace_configs.append(_trace_config(self._metrics))
+            self._session = aiohttp.ClientSession(
+                connector=connector, trace_configs=trace_configs)
+            self._session_loop = loop
+            # asyncio.run() cancels the pending tasks before closing its
+            # loop, this one then closes the session while it still can.
+            # it is kept here as the loop only holds weak task references
+            self._session_closer = loop.create_task(
+                _close_when_cancelled(self._session))
+        return self._session
 
     def _get_historic_url(self, _type, symbol):
         return f"{self._data_url}/v2/stocks/{symbol}/{_type}"
@@ -108,12 +223,10 @@ class AsyncRest:
         url = self._get_latest_url(_type, symbol)
         opts = self._get_opts()
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, **opts) as response:
-                response = await response.json()
-                if response.get("quote"):
-                    result = TradeV2(response["trade"])
-                    return symbol, result
+        response = await self._get_json(url, opts)
+        if response.get("trade"):
+            result = TradeV2(response["trade"])
+            return symbol, result
 
     async def get_latest_quote_async(self, symbol: str) -> QuoteV2:
         """
@@ -123,12 +236,10 @@ class AsyncRest:
         url = self._get_latest_url(_type, symbol)
         opts = self._get_opts()
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, **opts) as response:
-                response = await response.json()
-                if response.get("quote"):
-                    result = QuoteV2(response["quote"])
-                    return symbol, result
+        response = await self._get_json(url, opts)
+        if response.get("quote"):
+            result = QuoteV2(response["quote"])
+            return symbol, result
 
     def _get_opts(self, payload=None):
         headers = {}
@@ -146,19 +257,473 @@ class AsyncRest:
 
         return opts
 
+    async def _get_json(self, url, opts):
+        """
+        GETs url and decodes the response body
+        """
+        return await self._request_json('GET', url, opts)
+
+    async def _request_json(self, method, url, opts, raise_errors=False,
+                            retry=0):
+        """
+        sends the request and decodes the response body, which is None when
+        empty. With raise_errors, error responses raise an APIError (or an
+        aiohttp.ClientResponseError without an error message), or a
+        RetryException when `retry` is left and the retry policy wants the
+        request sent again.
+        """
+        rate_limiter = self._rate_limiter
+        if rate_limiter is not None:
+            await rate_limiter.acquire_async()
+        metrics = self._metrics
+        started = time.perf_counter()
+        try:
+            session = await self._get_session()
+            async with session.request(method, url, **opts) as response:
+                server_seconds = time.perf_counter() - started
+                if rate_limiter is not None:
+                    rate_limiter.update(response.headers)
+                body = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if metrics is not None:
+                metrics.request(method, url, None,
+                                time.perf_counter() - started)
+            raise
+        received = time.perf_counter()
+        if metrics is not None:
+            metrics.request(method, url, response.status, received - started,
+                            len(body), server_seconds)
+            metrics.rate_limit(response.headers)
+        if raise_errors and response.status >= 400:
+            error = _api_error(response, body, self._json_decoder)
+            if retry > 0 and self._retry_policy.should_retry(
+                    method, response.status):
+                raise RetryException(response) from error
+            raise error
+        if not body:
+            return None
+        data = self._json_decoder(body)
+        if metrics is not None:
+            metrics.decode(method, url, time.perf_counter() - received)
+        return data
+
+    async def _trading_request(self, method: str, path: str, data=None):
+        url = f'{self._base_url}/{self._api_version}{path}'
+        opts = self._get_opts()
+        if method in ('GET', 'DELETE'):
+            opts['params'] = _query_params(data)
+        else:
+            del opts['params']
+            opts['json'] = data
+
+        # same as REST._request
+        policy = self._retry_policy
+        deadline = policy.deadline(time.monotonic())
+        attempt = 0
+        while True:
+            retry = max(policy.max_retries - attempt, 0)
+            try:
+                return await self._request_json(method, url, opts,
+                                                raise_errors=True,
+                                                retry=retry)
+            except RetryException as e:
+                error = e
+                retry_wait = policy.delay(
+                    attempt, e.response.headers.get('Retry-After'))
+            except aiohttp.ClientResponseError:
+                # an error response the policy doesn't retry
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not retry or not _should_retry_error(policy, method, e):
+                    raise
+                error = e
+                retry_wait = policy.delay(attempt)
+            if (deadline is not None and
+                    time.monotonic() + retry_wait > deadline):
+                logger.warning('giving up on {} after {} attempt(s)'.format(
+                    url, attempt + 1))
+                if isinstance(error, RetryException):
+                    raise error.__cause__ from None
+                raise error
+            logger.warning(
+                'sleep {:.2f} seconds and retrying {} '
+                '{} more time(s)...'.format(
+                    retry_wait, url, retry))
+            if self._metrics is not None:
+                self._metrics.retry(method, url)
+            await asyncio.sleep(retry_wait)
+            attempt += 1
+
+    def _wrap(self, obj, entity: Entity):
+        """same as REST.response_wrapper"""
+        if self._use_raw_data:
+            return obj
+        if self._metrics is None:
+            return entity(obj)
+        started = time.perf_counter()
+        wrapped = entity(obj)
+        self._metrics.wrap(entity.__name__, time.perf_counter() - started)
+        return wrapped
+
+    def _wrap_list(self, objs, entity: Entity) -> list:
+        if self._use_raw_data:
+            return objs
+        return [self._wrap(o, entity) for o in objs]
+
+    # trading api, same endpoints and parameters as the REST methods
+    # without the _async suffix
+
+    async def get_account_async(self) -> Account:
+        resp = await self._trading_request('GET', '/account')
+        return self._wrap(resp, Account)
+
+    async def get_account_configurations_async(self) -> AccountConfigurations:
+        resp = await self._trading_request('GET', '/account/configurations')
+        return self._wrap(resp, AccountConfigurations)
+
+    async def update_account_configurations_async(
+            self,
+            no_shorting: bool = None,
+            dtbp_check: str = None,
+            trade_confirm_email: str = None,
+            suspend_trade: bool = None) -> AccountConfigurations:
+        params = {}
+        if no_shorting is not None:
+            params['no_shorting'] = no_shorting
+        if dtbp_check is not None:
+            params['dtbp_check'] = dtbp_check
+        if trade_confirm_email is not None:
+            params['trade_confirm_email'] = trade_confirm_email
+        if suspend_trade is not None:
+            params['suspend_trade'] = suspend_trade
+        resp = await self._trading_request('PATCH', '/account/configurations',
+                                           params)
+        return self._wrap(resp, AccountConfigurations)
+
+    async def get_activities_async(self,
+                                   activity_types: str = None,
+                                   until: str = None,
+                                   after: str = None,
+                                   direction: str = None,
+                                   date: str = None,
+                                   page_size: int = None,
+                                   page_token: str = None
+                                   ) -> List[AccountActivity]:
+        path = '/account/activities'
+        params = {
+            'after':      after,
+            'until':      until,
+            'direction':  direction,
+            'date':       date,
+            'page_size':  page_size,
+            'page_token': page_token,
+        }
+        if isinstance(activity_types, list):
+            params['activity_types'] = ','.join(activity_types)
+        elif activity_types is not None:
+            path += f'/{activity_types}'
+        resp = await self._trading_request('GET', path, params)
+        return self._wrap_list(resp, AccountActivity)
+
+    async def get_portfolio_history_async(self,
+                                          date_start: str = None,
+                                          date_end: str = None,
+                                          period: str = None,
+                                          timeframe=None,
+                                          extended_hours: bool = None
+                                          ) -> PortfolioHistory:
+        params = {
+            'date_start':     date_start,
+            'date_end':       date_end,
+            'period':         period,
+            'timeframe':      timeframe,
+            'extended_hours': extended_hours,
+        }
+        resp = await self._trading_request(
+            'GET', '/account/portfolio/history', params)
+        return self._wrap(resp, PortfolioHistory)
+
+    async def list_orders_async(self,
+                                status: str = None,
+                                limit: int = None,
+                                after: str = None,
+                                until: str = None,
+                                direction: str = None,
+                                params=None,
+                                nested: bool = None,
+                                symbols: List[str] = None,
+                                side: str = None
+                                ) -> List[Order]:
+        params = _list_orders_params(status, limit, after, until, direction,
+                                     params, nested, symbols, side)
+        resp = await self._trading_request('GET', '/orders', params)
+        return self._wrap_list(resp, Order)
+
+    async def submit_order_async(self,
+                                 symbol: str,
+                                 qty: float = None,
+                                 side: str = "buy",
+                                 type: str = "market",
+                                 time_in_force: str = "day",
+                                 limit_price: str = None,
+                                 stop_price: str = None,
+                                 client_order_id: str = None,
+                                 extended_hours: bool = None,
+                                 order_class: str = None,
+                                 take_profit: dict = None,
+                                 stop_loss: dict = None,
+                                 trail_price: str = None,
+                                 trail_percent: str = None,
+                                 notional: float = None) -> Order:
+        params = _order_params(symbol, qty, side, type, time_in_force,
+                               limit_price, stop_price, client_order_id,
+                               extended_hours, order_class, take_profit,
+                               stop_loss, trail_price, trail_percent, notional)
+        resp = await self._trading_request('POST', '/orders', params)
+        return self._wrap(resp, Order)
+
+    async def get_order_by_client_order_id_async(self,
+                                                 client_order_id: str
+                                                 ) -> Order:
+        resp = await self._trading_request(
+            'GET', '/orders:by_client_order_id',
+            {'client_order_id': client_order_id})
+        return self._wrap(resp, Order)
+
+    async def get_order_async(self,
+                              order_id: str,
+                              nested: bool = None) -> Order:
+        params = {}
+        if nested is not None:
+            params['nested'] = nested
+        resp = await self._trading_request('GET', f'/orders/{order_id}',
+                                           params)
+        return self._wrap(resp, Order)
+
+    async def replace_order_async(self,
+                                  order_id: str,
+                                  qty: str = None,
+                                  limit_price: str = None,
+                                  stop_price: str = None,
+                                  trail: str = None,
+                                  time_in_force: str = None,
+                                  client_order_id: str = None,
+                                  ) -> Order:
+        params = _replace_order_params(qty, limit_price, stop_price, trail,
+                                       time_in_force, client_order_id)
+        resp = await self._trading_request('PATCH', f'/orders/{order_id}',
+                                           params)
+        return self._wrap(resp, Order)
+
+    async def cancel_order_async(self, order_id: str) -> None:
+        await self._trading_request('DELETE', f'/orders/{order_id}')
+
+    async def cancel_all_orders_async(self) -> None:
+        await self._trading_request('DELETE', '/orders')
+
+    async def list_positions_async(self) -> List[Position]:
+        resp = await self._trading_request('GET', '/positions')
+        return self._wrap_list(resp, Position)
+
+    async def get_position_async(self, symbol: str) -> Position:
+        resp = await self._trading_request('GET', f'/positions/{symbol}')
+        return self._wrap(resp, Position)
+
+    async def close_position_async(self, symbol: str, *,
+                                   qty: float = None) -> Position:
+        data = {'qty': qty} if qty else {}
+        resp = await self._trading_request('DELETE', f'/positions/{symbol}',
+                                           data)
+        return self._wrap(resp, Position)
+
+    async def close_all_positions_async(self) -> List[Position]:
+        resp = await self._trading_request('DELETE', '/positions')
+        return self._wrap_list(resp, Position)
+
+    async def list_assets_async(self,
+                                status=None,
+                                asset_class=None) -> List[Asset]:
+        params = {
+            'status':      status,
+            'asset_class': asset_class,
+        }
+        resp = await self._trading_request('GET', '/assets', params)
+        return self._wrap_list(resp, Asset)
+
+    async def get_asset_async(self, symbol: str) -> Asset:
+        resp = await self._trading_request('GET', f'/assets/{symbol}')
+        return self._wrap(resp, Asset)
+
+    async def get_clock_async(self) -> Clock:
+        resp = await self._trading_request('GET', '/clock')
+        return self._wrap(resp, Clock)
+
+    async def get_calendar_async(self,
+                                 start: str = None,
+                                 end: str = None) -> List[Calendar]:
+        params = {}
+        if start is not None:
+            params['start'] = start
+        if end is not None:
+            params['end'] = end
+        resp = await self._trading_request('GET', '/calendar', params)
+        return self._wrap_list(resp, Calendar)
+
+    async def get_watchlists_async(self) -> List[Watchlist]:
+        resp = await self._trading_request('GET', '/watchlists')
+        return self._wrap_list(resp, Watchlist)
+
+    async def get_watchlist_async(self, watchlist_id: str) -> Watchlist:
+        resp = await self._trading_request('GET',
+                                           f'/watchlists/{watchlist_id}')
+        return self._wrap(resp, Watchlist)
+
+    async def get_watchlist_by_name_async(self,
+                                          watchlist_name: str) -> Watchlist:
+        resp = await self._trading_request('GET', '/watchlists:by_name',
+                                           {'name': watchlist_name})
+        return self._wrap(resp, Watchlist)
+
+    async def create_watchlist_async(self,
+                                     watchlist_name: str,
+                                     symbols=None) -> Watchlist:
+        params = {'name': watchlist_name}
+        if symbols is not None:
+            params['symbols'] = symbols
+        resp = await self._trading_request('POST', '/watchlists', params)
+        return self._wrap(resp, Watchlist)
+
+    async def add_to_watchlist_async(self,
+                                     watchlist_id: str,
+                                     symbol: str) -> Watchlist:
+        resp = await self._trading_request(
+            'POST', f'/watchlists/{watchlist_id}', {'symbol': symbol})
+        return self._wrap(resp, Watchlist)
+
+    async def update_watchlist_async(self,
+                                     watchlist_id: str,
+                                     name: str = None,
+                                     symbols=None) -> Watchlist:
+        params = {}
+        if name is not None:
+            params['name'] = name
+        if symbols is not None:
+            params['symbols'] = symbols
+        resp = await self._trading_request(
+            'PUT', f'/watchlists/{watchlist_id}', params)
+        return self._wrap(resp, Watchlist)
+
+    async def delete_watchlist_async(self, watchlist_id: str) -> None:
+        await self._trading_request('DELETE', f'/watchlists/{watchlist_id}')
+
+    async def delete_from_watchlist_async(self,
+                                          watchlist_id: str,
+                                          symbol: str) -> None:
+        await self._trading_request('DELETE',
+                                    f'/watchlists/{watchlist_id}/{symbol}')
+
     async def _request(self, url, payload):
         opts = self._get_opts(payload)
-        async with aiohttp.ClientSession() as session:
-            while 1:
-                async with session.get(url, **opts) as response:
+        while 1:
+            response = await self._get_json(url, opts)
+            page_token = response.get('next_page_token')
+            payload["page_token"] = page_token
+            yield response
+
+            if not page_token:
+                break
+
+
+async def _close_when_cancelled(session: aiohttp.ClientSession):
+    try:
+        await asyncio.get_running_loop().create_future()
+    finally:
+        if not session.closed:
+            await session.close()
+
+
+async def _close_other_loop_session(session: aiohttp.ClientSession, loop):
+    """
+    closes a session created on another event loop than the running one
+    """
+    if session.closed:
+        return
+    if loop.is_running():
+        # in another thread
+        asyncio.run_coroutine_threadsafe(session.close(), loop)
+    elif loop.is_closed():
+        # closed without cancelling its tasks, its connections can't be
+        # closed anymore, this only marks the session and connector closed
+        await session.close()
+    # else _close_when_cancelled closes it if that loop runs again
+
+
+def _query_params(data: Optional[dict]) -> Optional[dict]:
+    """
+    unlike requests, aiohttp doesn't skip None values and only takes str,
+    int and float ones
+    """
+    if not data:
+        return None
+    return {k: str(v).lower() if isinstance(v, bool) else v
+            for k, v in data.items() if v is not None}
+
+
+def _api_error(response: aiohttp.ClientResponse,
+               body: bytes,
+               decode: JsonDecoder) -> Exception:
+    """
+    the exception an error response raises: an APIError, or an
+    aiohttp.ClientResponseError without an error message
+    """
+    http_error = aiohttp.ClientResponseError(
+        response.request_info, response.history, status=response.status,
+        message=response.reason or '', headers=response.headers)
+    try:
+        error = decode(body)
+    except ValueError:
+        return http_error
+    if isinstance(error, dict) and 'message' in error:
+        return APIError(error, http_error)
+    return http_error
+
+
+def _should_retry_error(policy: RetryPolicy,
+                        method: str,
+                        error: Exception) -> bool:
+    """
+    RetryPolicy.should_retry for the aiohttp errors: a failed connection
+    never reached the server, anything else may have
+    """
+    if isinstance(error, aiohttp.ClientConnectorError):
+        return True
+    return policy.is_idempotent(method)
+
+
+def _trace_config(metrics: RequestMetrics) -> aiohttp.TraceConfig:
+    """
+    reports the DNS resolution and connection (tcp + tls) times of the
+    session to metrics
+    """
+    trace_config = aiohttp.TraceConfig()
+
+    def started(phase):
+        async def on_start(session, ctx, params):
+            setattr(ctx, phase, time.perf_counter())
+        return on_start
 
-                    response = await response.json()
-                    page_token = response.get('next_page_token')
-                    payload["page_token"] = page_token
-                    yield response
+    def ended(phase):
+        async def on_end(session, ctx, params):
+            start = getattr(ctx, phase, None)
+            if start is not None:
+                metrics.connection(phase, time.perf_counter() - start)
+        return on_end
 
-                    if not page_token:
-                        break
+    trace_config.on_dns_resolvehost_start.append(started('dns'))
+    trace_config.on_dns_resolvehost_end.append(ended('dns'))
+    trace_config.on_connection_create_start.append(started('connect'))
+    trace_config.on_connection_create_end.append(ended('connect'))
+    return trace_config
 
 
 async def gather_with_concurrency(n, *tasks):
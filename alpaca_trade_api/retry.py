@@ -0,0 +1,122 @@
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Iterable, Optional
+
+from requests.exceptions import ConnectionError, ConnectTimeout, Timeout
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+# the server rejected these before doing anything, so they are safe to
+# retry whatever the verb is
+ALWAYS_RETRYABLE_CODES = frozenset([429])
+
+
+class RetryPolicy:
+    """
+    Decides whether and when a failed request is sent again.
+
+    Waits grow exponentially from `backoff` up to `max_backoff` seconds
+    with full jitter (a random wait between 0 and the exponential value),
+    so clients that fail together don't retry in lockstep. A Retry-After
+    header from the server takes precedence over the computed wait, and
+    no retry is scheduled past `max_elapsed` seconds since the first
+    attempt.
+
+    Non idempotent requests (POST, PATCH) may have been applied already
+    when a 5xx or a broken connection comes back, so these are only
+    retried on 429 and on connection failures that happened before the
+    request was sent. Pass `idempotent_methods` to change that.
+    """
+
+    def __init__(self,
+                 max_retries: int = 3,
+                 backoff: float = 3,
+                 max_backoff: float = 30,
+                 max_elapsed: Optional[float] = 120,
+                 retry_codes: Iterable[int] = (429, 504),
+                 jitter: bool = True,
+                 idempotent_methods: Iterable[str] = IDEMPOTENT_METHODS,
+                 ):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_elapsed = max_elapsed
+        self.retry_codes = list(retry_codes)
+        self.jitter = jitter
+        self.idempotent_methods = frozenset(
+            m.upper() for m in idempotent_methods)
+
+    @classmethod
+    def from_env(cls, **kwargs) -> 'RetryPolicy':
+        """
+        builds a policy from the APCA_RETRY_MAX, APCA_RETRY_WAIT and
+        APCA_RETRY_CODES environment variables
+        """
+        kwargs.setdefault(
+            'max_retries', int(os.environ.get('APCA_RETRY_MAX', 3)))
+        kwargs.setdefault(
+            'backoff', int(os.environ.get('APCA_RETRY_WAIT', 3)))
+        kwargs.setdefault('retry_codes', [int(o) for o in os.environ.get(
+            'APCA_RETRY_CODES', '429,504').split(',')])
+        return cls(**kwargs)
+
+    def is_idempotent(self, method: str) -> bool:
+        return method.upper() in self.idempotent_methods
+
+    def should_retry(self,
+                     method: str,
+                     status_code: int = None,
+                     error: Exception = None) -> bool:
+        """
+        whether a request that got `status_code` back, or failed with
+        `error`, can be sent again
+        """
+        if status_code is not None:
+            if status_code not in self.retry_codes:
+                return False
+            return (status_code in ALWAYS_RETRYABLE_CODES or
+                    self.is_idempotent(method))
+        if isinstance(error, ConnectTimeout):
+            # never reached the server
+            return True
+        if isinstance(error, (ConnectionError, Timeout)):
+            return self.is_idempotent(method)
+        return False
+
+    def delay(self, attempt: int, retry_after: str = None) -> float:
+        """
+        seconds to wait before retry number `attempt` (counting from 0)
+        """
+        wait = min(self.max_backoff, self.backoff * 2 ** attempt)
+        if self.jitter:
+            wait = random.uniform(0, wait)
+        server_wait = parse_retry_after(retry_after)
+        if server_wait is not None:
+            # still add the jitter on top, the server tells everyone the
+            # same time
+            return server_wait + (wait if self.jitter else 0)
+        return wait
+
+    def deadline(self, started: float) -> Optional[float]:
+        if self.max_elapsed is None:
+            return None
+        return started + self.max_elapsed
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Retry-After is either a number of seconds or an http date
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() -
+                   time.time())
+    except (TypeError, ValueError):
+        return None
@@ -1,15 +1,20 @@
 import asyncio
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
 import logging
 import json
 from typing import Dict, List, Optional
-import msgpack
 import re
-import websockets
+import time
 import queue
+import threading
 
-from .common import get_base_url, get_data_stream_url, get_credentials, URL
+from .bridge import DEFAULT_WORKERS, AsyncProxy, ExecutorBridge
+from .common import (
+    get_base_url, get_data_stream_url, get_credentials, to_unix_nanos, URL,
+    LazyModule,
+)
 from .entity import Entity
+from .metrics import Histogram
 from .entity_v2 import (
     quote_mapping_v2,
     trade_mapping_v2,
@@ -30,6 +35,10 @@ from .entity_v2 import (
     OrderbookV2,
 )
 
+# loaded once a stream connects
+msgpack = LazyModule('msgpack')
+websockets = LazyModule('websockets')
+
 log = logging.getLogger(__name__)
 
 # Default Params we pass to the websocket constructors
@@ -40,18 +49,416 @@ WEBSOCKET_DEFAULTS = {
 }
 
 
+# what to do when a dispatch queue is full
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'conflate')
+
+# symbols pending per queue of the conflate=True subscriptions, before the
+# reader waits for the handler
+CONFLATE_QUEUE_SIZE = 10000
+
+# seconds the stream stats rates (messages/sec, bytes/sec) are taken over
+RATE_WINDOW = 10
+
+# message type -> the channel (handlers key) it belongs to
+_MSG_CHANNELS = {
+    't': 'trades',
+    'q': 'quotes',
+    'b': 'bars',
+    'u': 'updatedBars',
+    'd': 'dailyBars',
+    's': 'statuses',
+    'l': 'lulds',
+    'x': 'cancelErrors',
+    'c': 'corrections',
+    'o': 'orderbooks',
+    'n': 'news',
+}
+
+
 def _ensure_coroutine(handler):
     if not asyncio.iscoroutinefunction(handler):
         raise ValueError('handler must be a coroutine function')
 
 
+def _as_handlers(handler) -> tuple:
+    if handler is None:
+        return ()
+    if isinstance(handler, tuple):
+        return handler
+    return (handler,)
+
+
+class _Routes(dict):
+    """
+    (message type, symbol) -> (handlers, conflate), the routing table of a
+    data stream.
+
+    Routes are worked out from the stream's handlers the first time a key
+    is seen, the wildcard ('*') included, so dispatching a message is one
+    dict lookup. The table is invalidated whenever the subscriptions
+    change, which often happens on another thread than the event loop's:
+    a route worked out while it was being invalidated is not kept.
+    """
+
+    def __init__(self, stream: '_DataStream'):
+        super().__init__()
+        self._stream = stream
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self.clear()
+
+    def __missing__(self, key):
+        generation = self._generation
+        msg_type, symbol = key
+        channel = _MSG_CHANNELS.get(msg_type)
+        subscribed = self._stream._handlers.get(channel)
+        route = _NO_ROUTE
+        if subscribed:
+            if symbol not in subscribed:
+                symbol = '*'
+            handlers = _as_handlers(subscribed.get(symbol))
+            if handlers:
+                route = (handlers,
+                         symbol in self._stream._conflated.get(channel, ()))
+        with self._lock:
+            if generation == self._generation:
+                self[key] = route
+        return route
+
+
+_NO_ROUTE = ((), False)
+
+
+class _Decoder:
+    """
+    Turns the messages of one type into entities, renaming the short keys
+    with mapping.
+
+    The keys a message type comes with rarely change, so for each key
+    layout a function building the renamed dict straight from a dict
+    display is compiled once, instead of looking up the mapping for every
+    key of every message. The last layout seen is tried first: it matches
+    when the message has as many keys and all of them are found.
+    """
+    __slots__ = ('_entity', '_mapping', '_layouts', '_size', '_decode')
+
+    max_layouts = 64
+
+    def __init__(self, entity, mapping: Optional[Dict[str, str]] = None):
+        self._entity = entity
+        self._mapping = mapping
+        self._layouts = {}
+        self._size = -1
+        self._decode = None
+
+    def __call__(self, msg: dict):
+        if self._mapping is None:
+            return self._entity(msg)
+        if len(msg) == self._size:
+            try:
+                return self._decode(msg)
+            except KeyError:
+                pass
+        keys = tuple(msg)
+        decode = self._layouts.get(keys)
+        if decode is None:
+            decode = self._compile(keys)
+        self._size = len(keys)
+        self._decode = decode
+        return decode(msg)
+
+    def _compile(self, keys):
+        mapping = self._mapping
+        if all(isinstance(k, str) for k in keys):
+            # touch the unmapped keys too, so a message only goes through
+            # this function when it has exactly these keys
+            checks = ''.join(f'    m[{k!r}]\n'
+                             for k in keys if k not in mapping)
+            items = ', '.join(f'{mapping[k]!r}: m[{k!r}]'
+                              for k in keys if k in mapping)
+            ns = {'entity': self._entity}
+            exec(f'def decode(m):\n{checks}'
+                 f'    return entity({{{items}}})\n', ns)
+            decode = ns['decode']
+        else:
+            entity = self._entity
+            wanted = set(keys)
+
+            def decode(m):
+                if m.keys() != wanted:
+                    raise KeyError(keys)
+                return entity({mapping[k]: v
+                               for k, v in m.items() if k in mapping})
+        if len(self._layouts) >= self.max_layouts:
+            self._layouts.clear()
+        self._layouts[keys] = decode
+        return decode
+
+
+class _DispatchQueue:
+    """
+    Bounded queue between the websocket reader and one handler worker.
+
+    When it is full, depending on `overflow`:
+    - block: the reader waits for the worker (backpressure)
+    - drop_oldest: the oldest message is discarded
+    - conflate: only the latest message per key (symbol) is kept, so the
+      worker always gets the freshest state. With `merge`, a message
+      replacing a pending one is merge(pending, message) instead. maxsize
+      counts keys then, and a message for a new key waits for room like
+      with block: dropping a key would lose its only pending message.
+    """
+
+    def __init__(self, maxsize: int, overflow: str = 'block', merge=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f'overflow must be one of {", ".join(OVERFLOW_POLICIES)}')
+        if maxsize <= 0:
+            raise ValueError('maxsize must be positive')
+        self._maxsize = maxsize
+        self._overflow = overflow
+        self._merge = merge
+        self._items = OrderedDict() if overflow == 'conflate' else deque()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._max_depth = 0
+        self._enqueued = 0
+        self._dropped = 0
+        self._conflated = 0
+        self._processed = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    async def put(self, key, item):
+        items = self._items
+        if self._overflow == 'conflate':
+            while key not in items and len(items) >= self._maxsize:
+                self._not_full.clear()
+                await self._not_full.wait()
+            if key in items:
+                # keeps its place in line, with the newer payload
+                items[key] = item if self._merge is None else \
+                    self._merge(items[key], item)
+                self._conflated += 1
+                return
+            items[key] = item
+        elif self._overflow == 'drop_oldest':
+            if len(items) >= self._maxsize:
+                items.popleft()
+                self._dropped += 1
+            items.append(item)
+        else:
+            while len(items) >= self._maxsize:
+                self._not_full.clear()
+                await self._not_full.wait()
+            items.append(item)
+        self._enqueued += 1
+        self._max_depth = max(self._max_depth, len(items))
+        self._not_empty.set()
+
+    async def get(self):
+        while not self._items:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        if self._overflow == 'conflate':
+            _, item = self._items.popitem(last=False)
+        else:
+            item = self._items.popleft()
+        self._processed += 1
+        self._not_full.set()
+        return item
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'depth':      len(self._items),
+            'max_depth':  self._max_depth,
+            'maxsize':    self._maxsize,
+            'enqueued':   self._enqueued,
+            'processed':  self._processed,
+            'dropped':    self._dropped,
+            'conflated':  self._conflated,
+        }
+
+
+def _merge_pending(pending, item):
+    """
+    conflates two (handlers, msg_type, msg) dispatch items. orderbook
+    messages are incremental, so they are merged instead of replaced.
+    """
+    handlers, msg_type, msg = item
+    if msg_type == 'o':
+        return handlers, msg_type, _merge_orderbooks(pending[2], msg)
+    return item
+
+
+def _merge_orderbooks(pending: dict, update: dict) -> dict:
+    """
+    One orderbook message equivalent to `pending` followed by `update`.
+    Messages carry the changed levels only (size 0 removes the level),
+    unless 'r' is set: then they are the whole book and replace it.
+    """
+    if update.get('r'):
+        return update
+    merged = dict(update)
+    for side, descending in (('b', True), ('a', False)):
+        levels = {level['p']: level for level in pending.get(side) or ()}
+        for level in update.get(side) or ():
+            levels[level['p']] = level
+        if pending.get('r'):
+            # still a whole book, the removed levels can go
+            levels = {p: level for p, level in levels.items()
+                      if level['s']}
+        merged[side] = [levels[p] for p in sorted(levels, reverse=descending)]
+    if pending.get('r'):
+        merged['r'] = True
+    return merged
+
+
+class _Rate:
+    """
+    Per second counts of the last `window` seconds, so a stall or a burst
+    shows in the rate right away instead of being averaged over the
+    lifetime of the stream.
+    """
+
+    def __init__(self, window: int = RATE_WINDOW):
+        self._window = window
+        self._started = time.monotonic()
+        self._seconds = [-1] * window
+        self._counts = [0] * window
+
+    def add(self, n: int = 1, now: float = None):
+        second = int(time.monotonic() if now is None else now)
+        i = second % self._window
+        if self._seconds[i] != second:
+            self._seconds[i] = second
+            self._counts[i] = 0
+        self._counts[i] += n
+
+    def per_second(self, now: float = None) -> float:
+        now = time.monotonic() if now is None else now
+        first = int(now) - self._window + 1
+        total = sum(n for second, n in zip(self._seconds, self._counts)
+                    if second >= first)
+        # the current second is partial, and a young stream has no counts
+        # for the start of the window
+        return total / max(min(now - first, now - self._started), 1e-9)
+
+
+class _StreamStats:
+    """
+    Throughput and latency of one websocket stream: frames and bytes
+    received, message decode time, and per channel the message count, the
+    lag between the message timestamp and its arrival (so it includes any
+    clock skew with the server) and the time spent in the handlers. Rates
+    are over the last RATE_WINDOW seconds.
+    """
+
+    def __init__(self):
+        self._started = time.monotonic()
+        self.frames = 0
+        self.bytes = 0
+        self.connects = 0
+        self.decode = Histogram()
+        self.bytes_rate = _Rate()
+        self.messages: Dict[str, int] = defaultdict(int)
+        self.message_rate: Dict[str, _Rate] = defaultdict(_Rate)
+        self.lag: Dict[str, Histogram] = defaultdict(Histogram)
+        self.handler: Dict[str, Histogram] = defaultdict(Histogram)
+
+    def frame(self, nbytes: int, decode_seconds: float):
+        self.frames += 1
+        self.bytes += nbytes
+        self.bytes_rate.add(nbytes)
+        self.decode.observe(decode_seconds)
+
+    def message(self, channel: str, timestamp, received_ns: int):
+        """timestamp in nanoseconds since the epoch, or None"""
+        self.messages[channel] += 1
+        self.message_rate[channel].add()
+        if timestamp is not None:
+            self.lag[channel].observe((received_ns - timestamp) / 1e9)
+
+    def handled(self, channel: str, seconds: float):
+        self.handler[channel].observe(seconds)
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        uptime = max(now - self._started, 1e-9)
+        channels = {}
+        for channel, count in sorted(list(self.messages.items())):
+            channels[channel] = {
+                'messages':         count,
+                'messages_per_sec': self.message_rate[channel].per_second(now),
+                'lag':              self.lag[channel].snapshot(),
+                'handler':          self.handler[channel].snapshot(),
+            }
+        return {
+            'uptime':        uptime,
+            'frames':        self.frames,
+            'bytes':         self.bytes,
+            'bytes_per_sec': self.bytes_rate.per_second(now),
+            'decode':        self.decode.snapshot(),
+            'reconnects':    max(self.connects - 1, 0),
+            'channels':      channels,
+        }
+
+
+def _msgpack_nanos(value):
+    """message timestamp, an int, or a msgpack Timestamp in raw mode"""
+    if value is None or isinstance(value, int):
+        return value
+    to_unix_nano = getattr(value, 'to_unix_nano', None)
+    return to_unix_nano() if to_unix_nano is not None else None
+
+
 class _DataStream:
+    # message type -> decoder used by _cast
+    _decoders = {
+        't': _Decoder(Trade, trade_mapping_v2),
+        'q': _Decoder(Quote, quote_mapping_v2),
+        'b': _Decoder(Bar, bar_mapping_v2),
+        'u': _Decoder(Bar, bar_mapping_v2),
+        'd': _Decoder(Bar, bar_mapping_v2),
+    }
+
     def __init__(self,
                  endpoint: str,
                  key_id: str,
                  secret_key: str,
                  raw_data: bool = False,
-                 websocket_params: Optional[Dict] = None) -> None:
+                 websocket_params: Optional[Dict] = None,
+                 dispatch_queue_size: Optional[int] = None,
+                 dispatch_overflow: str = 'block',
+                 dispatch_by: str = 'channel',
+                 collect_stats: bool = False) -> None:
+        """
+        :param dispatch_queue_size: by default handlers are awaited by the
+            websocket reader, one message after the other. When set, the
+            reader only decodes and enqueues messages, and worker tasks
+            (one per channel, or per channel and symbol) run the handlers
+            from bounded queues of this size.
+        :param dispatch_overflow: what to do when a queue is full, one of
+            'block', 'drop_oldest' or 'conflate' (keep the latest message
+            per symbol, the queue size counting symbols then).
+        :param dispatch_by: 'channel' or 'symbol', which messages share a
+            queue and a worker. Messages sharing a worker are handled in
+            order.
+        :param collect_stats: measure throughput, decode and handler times
+            and message lag, see stats().
+        """
+        if dispatch_overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f'dispatch_overflow must be one of '
+                f'{", ".join(OVERFLOW_POLICIES)}')
+        if dispatch_by not in ('channel', 'symbol'):
+            raise ValueError("dispatch_by must be 'channel' or 'symbol'")
         self._endpoint = endpoint
         self._key_id = key_id
         self._secret_key = secret_key
@@ -75,6 +482,16 @@ class _DataStream:
         if self._websocket_params is None:
             self._websocket_params = WEBSOCKET_DEFAULTS
 
+        self._dispatch_queue_size = dispatch_queue_size
+        self._dispatch_overflow = dispatch_overflow
+        self._dispatch_by = dispatch_by
+        self._queues: Dict[str, _DispatchQueue] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        # channel -> symbols subscribed with conflate=True
+        self._conflated = defaultdict(set)
+        self._routes = _Routes(self)
+        self._stats = _StreamStats() if collect_stats else None
+
     async def _connect(self):
         self._ws = await websockets.connect(
             self._endpoint,
@@ -104,6 +521,8 @@ class _DataStream:
         await self._connect()
         await self._auth()
         log.info(f'connected to: {self._endpoint}')
+        if self._stats is not None:
+            self._stats.connects += 1
 
     async def close(self):
         if self._ws:
@@ -125,7 +544,21 @@ class _DataStream:
             else:
                 try:
                     r = await asyncio.wait_for(self._ws.recv(), 5)
-                    msgs = msgpack.unpackb(r)
+                    stats = self._stats
+                    if stats is not None:
+                        received = time.time_ns()
+                        started = time.perf_counter()
+                    # unless we pass the raw data through, let msgpack
+                    # convert timestamps to nanoseconds (int)
+                    msgs = msgpack.unpackb(
+                        r, timestamp=0 if self._raw_data else 2)
+                    if stats is not None:
+                        stats.frame(len(r), time.perf_counter() - started)
+                        for msg in msgs:
+                            msg_type = msg.get('T')
+                            stats.message(
+                                _MSG_CHANNELS.get(msg_type, msg_type),
+                                _msgpack_nanos(msg.get('t')), received)
                     for msg in msgs:
                         await self._dispatch(msg)
                 except asyncio.TimeoutError:
@@ -135,69 +568,141 @@ class _DataStream:
                     pass
 
     def _cast(self, msg_type, msg):
-        result = msg
-        if not self._raw_data:
-            # convert msgpack timestamp to nanoseconds
-            if 't' in msg:
-                msg['t'] = msg['t'].seconds * int(1e9) + msg['t'].nanoseconds
-
-            if msg_type == 't':
-                result = Trade({
-                    trade_mapping_v2[k]: v
-                    for k, v in msg.items() if k in trade_mapping_v2
-                })
-            elif msg_type == 'q':
-                result = Quote({
-                    quote_mapping_v2[k]: v
-                    for k, v in msg.items() if k in quote_mapping_v2
-                })
-            elif msg_type in ('b', 'u', 'd'):
-                result = Bar({
-                    bar_mapping_v2[k]: v
-                    for k, v in msg.items() if k in bar_mapping_v2
-                })
-            else:
-                result = Entity(msg)
+        if self._raw_data:
+            return msg
+        decoder = self._decoders.get(msg_type)
+        if decoder is None:
+            return Entity(msg)
+        return decoder(msg)
+
+    async def _handle(self, handlers, msg_type, msg, conflate=False):
+        """
+        runs handlers on the message, or hands it over to a worker when
+        pipelined dispatch is enabled
+        """
+        if self._dispatch_queue_size is None and not conflate:
+            entity = self._cast(msg_type, msg)
+            if self._stats is None:
+                for handler in handlers:
+                    await handler(entity)
+                return
+            started = time.perf_counter()
+            try:
+                for handler in handlers:
+                    await handler(entity)
+            finally:
+                self._stats.handled(_MSG_CHANNELS.get(msg_type, msg_type),
+                                    time.perf_counter() - started)
+            return
+        symbol = msg.get('S')
+        name = _MSG_CHANNELS.get(msg_type, msg_type)
+        if self._dispatch_by == 'symbol' and symbol is not None:
+            name = f'{name}:{symbol}'
+        if conflate:
+            name = f'{name}:latest'
+        q = self._queues.get(name)
+        if q is None:
+            # dispatch_queue_size counts messages, a conflating queue holds
+            # one per subscribed symbol
+            q = _DispatchQueue(
+                CONFLATE_QUEUE_SIZE if conflate else
+                self._dispatch_queue_size,
+                'conflate' if conflate else self._dispatch_overflow,
+                _merge_pending)
+            self._queues[name] = q
+            self._workers[name] = asyncio.ensure_future(self._work(q))
+        await q.put((msg_type, symbol), (handlers, msg_type, msg))
+
+    async def _work(self, q: _DispatchQueue):
+        while True:
+            handlers, msg_type, msg = await q.get()
+            try:
+                entity = self._cast(msg_type, msg)
+            except Exception as e:
+                log.exception(f'error decoding {self._name} message: {e}')
+                continue
+            started = time.perf_counter()
+            for handler in handlers:
+                try:
+                    await handler(entity)
+                except Exception as e:
+                    log.exception(f'error in {self._name} handler: {e}')
+            if self._stats is not None:
+                self._stats.handled(_MSG_CHANNELS.get(msg_type, msg_type),
+                                    time.perf_counter() - started)
+
+    async def _stop_workers(self):
+        workers = list(self._workers.values())
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._workers.clear()
+        self._queues.clear()
+
+    def queue_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        depth and counters of the dispatch queues, keyed by channel (and
+        symbol when dispatching by symbol)
+        """
+        return {name: q.stats() for name, q in self._queues.items()}
+
+    def stats(self) -> dict:
+        """
+        throughput, decode time, reconnects and per channel message rate,
+        lag and handler time (when created with collect_stats=True), plus
+        the dispatch queue metrics under 'queues'
+        """
+        result = self._stats.snapshot() if self._stats is not None else {}
+        result['queues'] = self.queue_stats()
         return result
 
     async def _dispatch(self, msg):
         msg_type = msg.get('T')
-        symbol = msg.get('S')
-        if msg_type == 't':
-            handler = self._handlers['trades'].get(
-                symbol, self._handlers['trades'].get('*', None))
-            if handler:
-                await handler(self._cast(msg_type, msg))
-        elif msg_type == 'q':
-            handler = self._handlers['quotes'].get(
-                symbol, self._handlers['quotes'].get('*', None))
-            if handler:
-                await handler(self._cast(msg_type, msg))
-        elif msg_type == 'b':
-            handler = self._handlers['bars'].get(
-                symbol, self._handlers['bars'].get('*', None))
-            if handler:
-                await handler(self._cast(msg_type, msg))
-        elif msg_type == 'u':
-            handler = self._handlers['updatedBars'].get(
-                symbol, self._handlers['updatedBars'].get('*', None))
-            if handler:
-                await handler(self._cast(msg_type, msg))
-        elif msg_type == 'd':
-            handler = self._handlers['dailyBars'].get(
-                symbol, self._handlers['dailyBars'].get('*', None))
-            if handler:
-                await handler(self._cast(msg_type, msg))
+        handlers, conflate = self._routes[msg_type, msg.get('S')]
+        if handlers:
+            await self._handle(handlers, msg_type, msg, conflate)
         elif msg_type == 'subscription':
             sub = [f'{k}: {msg.get(k, [])}' for k in self._handlers]
             log.info(f'subscribed to {", ".join(sub)}')
         elif msg_type == 'error':
             log.error(f'error: {msg.get("msg")} ({msg.get("code")})')
 
+    def _set_conflate(self, channel, symbols, conflate):
+        if conflate:
+            self._conflated[channel].update(symbols)
+        else:
+            self._conflated[channel].difference_update(symbols)
+        self._routes.invalidate()
+
+    def _remove_handlers(self, channel, symbols):
+        for symbol in symbols:
+            del self._handlers[channel][symbol]
+        self._routes.invalidate()
+
+    def add_handler(self, channel, handler, *symbols):
+        """
+        subscribes handler to channel ('trades', 'quotes', ...) for
+        symbols, next to the handlers already there instead of replacing
+        them. every handler gets the same entity.
+        """
+        _ensure_coroutine(handler)
+        handlers = self._handlers[channel]
+        for symbol in symbols:
+            current = _as_handlers(handlers.get(symbol))
+            if handler not in current:
+                handlers[symbol] = current + (handler,) if current \
+                    else handler
+        self._routes.invalidate()
+        if self._running:
+            asyncio.run_coroutine_threadsafe(
+                self._subscribe_all(), self._loop
+            ).result()
+
     def _subscribe(self, handler, symbols, handlers):
         _ensure_coroutine(handler)
         for symbol in symbols:
             handlers[symbol] = handler
+        self._routes.invalidate()
         if self._running:
             asyncio.run_coroutine_threadsafe(
                 self._subscribe_all(), self._loop
@@ -243,6 +748,7 @@ class _DataStream:
             try:
                 if not self._should_run:
                     # when signaling to stop, this is how we break run_forever
+                    await self._stop_workers()
                     log.info("{} stream stopped".format(self._name))
                     return
                 if not self._running:
@@ -266,8 +772,13 @@ class _DataStream:
     def subscribe_trades(self, handler, *symbols):
         self._subscribe(handler, symbols, self._handlers['trades'])
 
-    def subscribe_quotes(self, handler, *symbols):
+    def subscribe_quotes(self, handler, *symbols, conflate=False):
+        """
+        :param conflate: only pass the latest quote of each symbol to the
+            handler, skipping the ones that came in while it was busy
+        """
         self._subscribe(handler, symbols, self._handlers['quotes'])
+        self._set_conflate('quotes', symbols, conflate)
 
     def subscribe_bars(self, handler, *symbols):
         self._subscribe(handler, symbols, self._handlers['bars'])
@@ -283,40 +794,36 @@ class _DataStream:
             asyncio.run_coroutine_threadsafe(
                 self._unsubscribe(trades=symbols),
                 self._loop).result()
-        for symbol in symbols:
-            del self._handlers['trades'][symbol]
+        self._remove_handlers('trades', symbols)
 
     def unsubscribe_quotes(self, *symbols):
         if self._running:
             asyncio.run_coroutine_threadsafe(
                 self._unsubscribe(quotes=symbols),
                 self._loop).result()
-        for symbol in symbols:
-            del self._handlers['quotes'][symbol]
+        self._remove_handlers('quotes', symbols)
+        self._set_conflate('quotes', symbols, False)
 
     def unsubscribe_bars(self, *symbols):
         if self._running:
             asyncio.run_coroutine_threadsafe(
                 self._unsubscribe(bars=symbols),
                 self._loop).result()
-        for symbol in symbols:
-            del self._handlers['bars'][symbol]
+        self._remove_handlers('bars', symbols)
 
     def unsubscribe_updated_bars(self, *symbols):
         if self._running:
             asyncio.run_coroutine_threadsafe(
                 self._unsubscribe(updated_bars=symbols),
                 self._loop).result()
-        for symbol in symbols:
-            del self._handlers['updatedBars'][symbol]
+        self._remove_handlers('updatedBars', symbols)
 
     def unsubscribe_daily_bars(self, *symbols):
         if self._running:
             asyncio.run_coroutine_threadsafe(
                 self._unsubscribe(daily_bars=symbols),
                 self._loop).result()
-        for symbol in symbols:
-            del self._handlers['dailyBars'][symbol]
+        self._remove_handlers('dailyBars', symbols)
 
     def stop(self):
         if self._loop.is_running():
@@ -326,19 +833,29 @@ class _DataStream:
 
 
 class DataStream(_DataStream):
+    _decoders = {
+        **_DataStream._decoders,
+        's': _Decoder(StatusV2, status_mapping_v2),
+        'l': _Decoder(LULDV2, luld_mapping_v2),
+        'x': _Decoder(CancelErrorV2, cancel_error_mapping_v2),
+        'c': _Decoder(CorrectionV2, correction_mapping_v2),
+    }
+
     def __init__(self,
                  key_id: str,
                  secret_key: str,
                  base_url: URL,
                  raw_data: bool,
                  feed: str = 'iex',
-                 websocket_params: Optional[Dict] = None):
+                 websocket_params: Optional[Dict] = None,
+                 **dispatch_params):
         base_url = re.sub(r'^http', 'ws', base_url)
         super().__init__(endpoint=base_url + '/v2/' + feed,
                          key_id=key_id,
                          secret_key=secret_key,
                          raw_data=raw_data,
-                         websocket_params=websocket_params
+                         websocket_params=websocket_params,
+                         **dispatch_params
                          )
         self._handlers['statuses'] = {}
         self._handlers['lulds'] = {}
@@ -346,57 +863,6 @@ class DataStream(_DataStream):
         self._handlers['corrections'] = {}
         self._name = 'stock data'
 
-    def _cast(self, msg_type, msg):
-        result = super()._cast(msg_type, msg)
-        if not self._raw_data:
-            if msg_type == 's':
-                result = StatusV2({
-                    status_mapping_v2[k]: v
-                    for k, v in msg.items() if k in status_mapping_v2
-                })
-            elif msg_type == 'l':
-                result = LULDV2({
-                    luld_mapping_v2[k]: v
-                    for k, v in msg.items() if k in luld_mapping_v2
-                })
-            elif msg_type == 'x':
-                result = CancelErrorV2({
-                    cancel_error_mapping_v2[k]: v
-                    for k, v in msg.items() if k in cancel_error_mapping_v2
-                })
-            elif msg_type == 'c':
-                result = CorrectionV2({
-                    correction_mapping_v2[k]: v
-                    for k, v in msg.items() if k in correction_mapping_v2
-                })
-        return result
-
-    async def _dispatch(self, msg):
-        msg_type = msg.get('T')
-        symbol = msg.get('S')
-        if msg_type == 's':
-            handler = self._handlers['statuses'].get(
-                symbol, self._handlers['statuses'].get('*', None))
-            if handler:
-                await handler(self._cast(msg_type, msg))
-        elif msg_type == 'l':
-            handler = self._handlers['lulds'].get(
-                symbol, self._handlers['lulds'].get('*', None))
-            if handler:
-                await handler(self._cast(msg_type, msg))
-        elif msg_type == 'x':
-            handler = self._handlers['cancelErrors'].get(
-                symbol, self._handlers['cancelErrors'].get('*', None))
-            if handler:
-                await handler(self._cast(msg_type, msg))
-        elif msg_type == 'c':
-            handler = self._handlers['corrections'].get(
-                symbol, self._handlers['corrections'].get('*', None))
-            if handler:
-                await handler(self._cast(msg_type, msg))
-        else:
-            await super()._dispatch(msg)
-
     async def _unsubscribe(self,
                            trades=(),
                            quotes=(),
@@ -430,37 +896,43 @@ class DataStream(_DataStream):
             asyncio.run_coroutine_threadsafe(
                 self._unsubscribe(statuses=symbols),
                 self._loop).result()
-        for symbol in symbols:
-            del self._handlers['statuses'][symbol]
+        self._remove_handlers('statuses', symbols)
 
     def unsubscribe_lulds(self, *symbols):
         if self._running:
             asyncio.run_coroutine_threadsafe(
                 self._unsubscribe(lulds=symbols),
                 self._loop).result()
-        for symbol in symbols:
-            del self._handlers['lulds'][symbol]
+        self._remove_handlers('lulds', symbols)
 
     def register_handler(self, msg_type, handler, *symbols):
         if handler is not None:
             _ensure_coroutine(handler)
             for symbol in symbols:
                 self._handlers[msg_type][symbol] = handler
+            self._routes.invalidate()
 
     def unregister_handler(self, msg_type, *symbols):
         for symbol in symbols:
             if symbol in self._handlers[msg_type]:
                 del self._handlers[msg_type][symbol]
+        self._routes.invalidate()
 
 
 class CryptoDataStream(_DataStream):
+    _decoders = {
+        **_DataStream._decoders,
+        'o': _Decoder(OrderbookV2, orderbook_mapping_v2),
+    }
+
     def __init__(self,
                  key_id: str,
                  secret_key: str,
                  base_url: URL,
                  raw_data: bool,
                  exchanges: Optional[List[str]] = None,
-                 websocket_params: Optional[Dict] = None):
+                 websocket_params: Optional[Dict] = None,
+                 **dispatch_params):
         self._key_id = key_id
         self._secret_key = secret_key
         base_url = re.sub(r'^http', 'ws', base_url)
@@ -475,31 +947,11 @@ class CryptoDataStream(_DataStream):
                          secret_key=secret_key,
                          raw_data=raw_data,
                          websocket_params=websocket_params,
+                         **dispatch_params
                          )
         self._handlers['orderbooks'] = {}
         self._name = 'crypto data'
 
-    def _cast(self, msg_type, msg):
-        result = super()._cast(msg_type, msg)
-        if not self._raw_data:
-            if msg_type == 'o':
-                result = OrderbookV2({
-                    orderbook_mapping_v2[k]: v
-                    for k, v in msg.items() if k in orderbook_mapping_v2
-                })
-        return result
-
-    async def _dispatch(self, msg):
-        msg_type = msg.get('T')
-        symbol = msg.get('S')
-        if msg_type == 'o':
-            handler = self._handlers['orderbooks'].get(
-                symbol, self._handlers['orderbooks'].get('*', None))
-            if handler:
-                await handler(self._cast(msg_type, msg))
-        else:
-            await super()._dispatch(msg)
-
     async def _unsubscribe(self,
                            trades=(),
                            quotes=(),
@@ -522,25 +974,38 @@ class CryptoDataStream(_DataStream):
                     'dailyBars':   daily_bars,
                 }))
 
-    def subscribe_orderbooks(self, handler, *symbols):
+    def subscribe_orderbooks(self, handler, *symbols, conflate=False):
+        """
+        :param conflate: merge the orderbook updates of each symbol that
+            came in while the handler was busy into one, so it gets called
+            once per symbol with every level that changed (size 0 for
+            removed levels) when it catches up
+        """
         self._subscribe(handler, symbols, self._handlers['orderbooks'])
+        self._set_conflate('orderbooks', symbols, conflate)
 
     def unsubscribe_orderbooks(self, *symbols):
         if self._running:
             asyncio.run_coroutine_threadsafe(
                 self._unsubscribe(orderbooks=symbols),
                 self._loop).result()
-        for symbol in symbols:
-            del self._handlers['orderbooks'][symbol]
+        self._remove_handlers('orderbooks', symbols)
+        self._set_conflate('orderbooks', symbols, False)
 
 
 class NewsDataStream(_DataStream):
+    _decoders = {
+        **_DataStream._decoders,
+        'n': _Decoder(NewsV2),
+    }
+
     def __init__(self,
                  key_id: str,
                  secret_key: str,
                  base_url: URL,
                  raw_data: bool,
-                 websocket_params: Optional[Dict] = None):
+                 websocket_params: Optional[Dict] = None,
+                 **dispatch_params):
         self._key_id = key_id
         self._secret_key = secret_key
         base_url = re.sub(r'^http', 'ws', base_url)
@@ -549,20 +1014,14 @@ class NewsDataStream(_DataStream):
                          key_id=key_id,
                          secret_key=secret_key,
                          raw_data=raw_data,
-                         websocket_params=websocket_params
+                         websocket_params=websocket_params,
+                         **dispatch_params
                          )
         self._handlers = {
             'news':    {},
         }
         self._name = 'news data'
 
-    def _cast(self, msg_type, msg):
-        result = super()._cast(msg_type, msg)
-        if not self._raw_data:
-            if msg_type == 'n':
-                result = NewsV2(msg)
-        return result
-
     async def _dispatch(self, msg):
         msg_type = msg.get('T')
         if msg_type == 'n':
@@ -573,15 +1032,12 @@ class NewsDataStream(_DataStream):
             if not symbols:
                 symbols.append('*')
 
-            handlers = set()
+            handlers = {}
             for symbol in symbols:
-                handler = self._handlers['news'].get(symbol)
-                if handler is None:
-                    handler = self._handlers['news'].get('*')
-                if handler is not None:
-                    handlers.add(handler)
-            for handler in handlers:
-                await handler(self._cast(msg_type, msg))
+                for handler in self._routes[msg_type, symbol][0]:
+                    handlers[handler] = None
+            if handlers:
+                await self._handle(tuple(handlers), msg_type, msg)
         else:
             await super()._dispatch(msg)
 
@@ -601,8 +1057,7 @@ class NewsDataStream(_DataStream):
             asyncio.run_coroutine_threadsafe(
                 self._unsubscribe(news=symbols),
                 self._loop).result()
-        for symbol in symbols:
-            del self._handlers['news'][symbol]
+        self._remove_handlers('news', symbols)
 
 
 class TradingStream:
@@ -611,11 +1066,13 @@ class TradingStream:
                  secret_key: str,
                  base_url: URL,
                  raw_data: bool = False,
-                 websocket_params: Optional[Dict] = None):
+                 websocket_params: Optional[Dict] = None,
+                 collect_stats: bool = False):
         self._key_id = key_id
         self._secret_key = secret_key
         base_url = re.sub(r'^http', 'ws', base_url)
         self._endpoint = base_url + '/stream/'
+        self._stats = _StreamStats() if collect_stats else None
         self._trade_updates_handler = None
         self._ws = None
         self._running = False
@@ -652,7 +1109,16 @@ class TradingStream:
         stream = msg.get('stream')
         if stream == 'trade_updates':
             if self._trade_updates_handler:
-                await self._trade_updates_handler(self._cast(msg))
+                entity = self._cast(msg)
+                if self._stats is None:
+                    await self._trade_updates_handler(entity)
+                    return
+                started = time.perf_counter()
+                try:
+                    await self._trade_updates_handler(entity)
+                finally:
+                    self._stats.handled(stream,
+                                        time.perf_counter() - started)
 
     def _cast(self, msg):
         result = msg
@@ -682,6 +1148,8 @@ class TradingStream:
         await self._connect()
         await self._auth()
         log.info(f'connected to: {self._endpoint}')
+        if self._stats is not None:
+            self._stats.connects += 1
         await self._subscribe_trade_updates()
 
     async def _consume(self):
@@ -693,7 +1161,10 @@ class TradingStream:
             else:
                 try:
                     r = await asyncio.wait_for(self._ws.recv(), 5)
-                    msg = json.loads(r)
+                    if self._stats is None:
+                        msg = json.loads(r)
+                    else:
+                        msg = self._decode_with_stats(r)
                     await self._dispatch(msg)
                 except asyncio.TimeoutError:
                     # ws.recv is hanging when no data is received. by using
@@ -701,6 +1172,27 @@ class TradingStream:
                     # to break the loop when needed
                     pass
 
+    def _decode_with_stats(self, r):
+        received = time.time_ns()
+        started = time.perf_counter()
+        msg = json.loads(r)
+        self._stats.frame(len(r), time.perf_counter() - started)
+        data = msg.get('data')
+        timestamp = data.get('timestamp') if isinstance(data, dict) else None
+        try:
+            timestamp = to_unix_nanos(timestamp) if timestamp else None
+        except ValueError:
+            timestamp = None
+        self._stats.message(msg.get('stream'), timestamp, received)
+        return msg
+
+    def stats(self) -> dict:
+        """
+        throughput, reconnects, lag and handler time of the trade updates,
+        when created with collect_stats=True
+        """
+        return self._stats.snapshot() if self._stats is not None else {}
+
     async def _run_forever(self):
         self._loop = asyncio.get_running_loop()
         # do not start the websocket connection until we subscribe to something
@@ -760,8 +1252,29 @@ class Stream:
                  data_feed: str = 'iex',
                  raw_data: bool = False,
                  crypto_exchanges: Optional[List[str]] = None,
-                 websocket_params: Optional[Dict] = None):
+                 websocket_params: Optional[Dict] = None,
+                 dispatch_queue_size: Optional[int] = None,
+                 dispatch_overflow: str = 'block',
+                 dispatch_by: str = 'channel',
+                 collect_stats: bool = False,
+                 executor_workers: int = DEFAULT_WORKERS):
+        """
+        :param dispatch_queue_size: when set, market data handlers run in
+            worker tasks fed by bounded queues of this size, so a slow
+            handler doesn't hold up reading the websocket. See
+            dispatch_overflow ('block', 'drop_oldest' or 'conflate') and
+            dispatch_by ('channel' or 'symbol').
+        :param collect_stats: have the streams measure throughput, lag and
+            handler times, see stats().
+        :param executor_workers: size of the thread pool that bridge() and
+            run_blocking() run blocking calls on.
+        """
+        self._executor = ExecutorBridge(executor_workers)
         self._key_id, self._secret_key, _ = get_credentials(key_id, secret_key)
+        dispatch_params = dict(dispatch_queue_size=dispatch_queue_size,
+                               dispatch_overflow=dispatch_overflow,
+                               dispatch_by=dispatch_by,
+                               collect_stats=collect_stats)
         self._base_url = base_url or get_base_url()
         self._data_stream_url = data_stream_url or get_data_stream_url()
 
@@ -769,24 +1282,28 @@ class Stream:
                                          self._secret_key,
                                          self._base_url,
                                          raw_data,
-                                         websocket_params=websocket_params)
+                                         websocket_params=websocket_params,
+                                         collect_stats=collect_stats)
         self._data_ws = DataStream(self._key_id,
                                    self._secret_key,
                                    self._data_stream_url,
                                    raw_data,
                                    data_feed.lower(),
-                                   websocket_params=websocket_params)
+                                   websocket_params=websocket_params,
+                                   **dispatch_params)
         self._crypto_ws = CryptoDataStream(self._key_id,
                                            self._secret_key,
                                            self._data_stream_url,
                                            raw_data,
                                            crypto_exchanges,
-                                           websocket_params=websocket_params)
+                                           websocket_params=websocket_params,
+                                           **dispatch_params)
         self._news_ws = NewsDataStream(self._key_id,
                                        self._secret_key,
                                        self._data_stream_url,
                                        raw_data,
-                                       websocket_params=websocket_params)
+                                       websocket_params=websocket_params,
+                                       **dispatch_params)
 
     def subscribe_trade_updates(self, handler):
         self._trading_ws.subscribe_trade_updates(handler)
@@ -806,8 +1323,8 @@ class Stream:
                                        handler_corrections,
                                        *symbols)
 
-    def subscribe_quotes(self, handler, *symbols):
-        self._data_ws.subscribe_quotes(handler, *symbols)
+    def subscribe_quotes(self, handler, *symbols, conflate=False):
+        self._data_ws.subscribe_quotes(handler, *symbols, conflate=conflate)
 
     def subscribe_bars(self, handler, *symbols):
         self._data_ws.subscribe_bars(handler, *symbols)
@@ -827,8 +1344,9 @@ class Stream:
     def subscribe_crypto_trades(self, handler, *symbols):
         self._crypto_ws.subscribe_trades(handler, *symbols)
 
-    def subscribe_crypto_quotes(self, handler, *symbols):
-        self._crypto_ws.subscribe_quotes(handler, *symbols)
+    def subscribe_crypto_quotes(self, handler, *symbols, conflate=False):
+        self._crypto_ws.subscribe_quotes(handler, *symbols,
+                                         conflate=conflate)
 
     def subscribe_crypto_bars(self, handler, *symbols):
         self._crypto_ws.subscribe_bars(handler, *symbols)
@@ -839,8 +1357,10 @@ class Stream:
     def subscribe_crypto_daily_bars(self, handler, *symbols):
         self._crypto_ws.subscribe_daily_bars(handler, *symbols)
 
-    def subscribe_crypto_orderbooks(self, handler, *symbols):
-        self._crypto_ws.subscribe_orderbooks(handler, *symbols)
+    def subscribe_crypto_orderbooks(self, handler, *symbols,
+                                    conflate=False):
+        self._crypto_ws.subscribe_orderbooks(handler, *symbols,
+                                             conflate=conflate)
 
     def subscribe_news(self, handler, *symbols):
         self._news_ws.subscribe_news(handler, *symbols)
@@ -856,9 +1376,9 @@ class Stream:
 
         return decorator
 
-    def on_quote(self, *symbols):
+    def on_quote(self, *symbols, conflate=False):
         def decorator(func):
-            self.subscribe_quotes(func, *symbols)
+            self.subscribe_quotes(func, *symbols, conflate=conflate)
             return func
 
         return decorator
@@ -919,9 +1439,9 @@ class Stream:
 
         return decorator
 
-    def on_crypto_quote(self, *symbols):
+    def on_crypto_quote(self, *symbols, conflate=False):
         def decorator(func):
-            self.subscribe_crypto_quotes(func, *symbols)
+            self.subscribe_crypto_quotes(func, *symbols, conflate=conflate)
             return func
 
         return decorator
@@ -947,9 +1467,9 @@ class Stream:
 
         return decorator
 
-    def on_crypto_orderbook(self, *symbols):
+    def on_crypto_orderbook(self, *symbols, conflate=False):
         def decorator(func):
-            self.subscribe_crypto_orderbooks(func, *symbols)
+            self.subscribe_crypto_orderbooks(func, *symbols, conflate=conflate)
             return func
 
         return decorator
@@ -1005,6 +1525,50 @@ class Stream:
     def unsubscribe_news(self, *symbols):
         self._news_ws.unsubscribe_news(*symbols)
 
+    def bridge(self, client) -> AsyncProxy:
+        """
+        wraps a blocking client, e.g. REST, for handlers: its methods return
+        awaitables, running the calls on the stream's thread pool instead of
+        blocking the websockets.
+
+            rest = stream.bridge(REST())
+            order = await rest.submit_order('AAPL', qty=1)
+        """
+        return self._executor.wrap(client)
+
+    async def run_blocking(self, fn, *args, **kwargs):
+        """runs fn(*args, **kwargs) on the stream's thread pool"""
+        return await self._executor.run(fn, *args, **kwargs)
+
+    def executor_stats(self) -> dict:
+        """saturation of the thread pool, see ExecutorBridge.stats()"""
+        return self._executor.stats()
+
+    def queue_stats(self) -> Dict[str, Dict[str, Dict[str, int]]]:
+        """
+        dispatch queue metrics of the market data streams, empty unless
+        dispatch_queue_size is set
+        """
+        return {
+            'data':   self._data_ws.queue_stats(),
+            'crypto': self._crypto_ws.queue_stats(),
+            'news':   self._news_ws.queue_stats(),
+        }
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        per stream throughput, message lag, handler times and reconnects
+        (with collect_stats=True), dispatch queue metrics and the thread pool
+        saturation
+        """
+        return {
+            'trading':  self._trading_ws.stats(),
+            'data':     self._data_ws.stats(),
+            'crypto':   self._crypto_ws.stats(),
+            'news':     self._news_ws.stats(),
+            'executor': self._executor.stats(),
+        }
+
     async def _run_forever(self):
         await asyncio.gather(self._trading_ws._run_forever(),
                              self._data_ws._run_forever(),
@@ -1017,6 +1581,9 @@ class Stream:
         except KeyboardInterrupt:
             print('keyboard interrupt, bye')
             pass
+        finally:
+            # let the blocking calls in flight (e.g. orders) complete
+            self._executor.shutdown()
 
     async def stop_ws(self):
         """
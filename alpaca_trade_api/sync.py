@@ -0,0 +1,172 @@
+"""
+Local stores of historical bars, for REST.sync_bars to bring up to date.
+
+A store only needs to tell the last timestamp it holds per symbol and to
+append new bars (a DataFrame indexed by timestamp, as returned by
+get_bars_frame for a single symbol).
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import quote
+
+from .common import LazyModule
+
+pd = LazyModule('pandas', 'DataFrames')
+
+BAR_COLUMNS = ('open', 'high', 'low', 'close', 'volume', 'trade_count',
+               'vwap')
+
+
+class BarStore:
+    def last_timestamps(self,
+                        symbols: Iterable[str]) -> Dict[str, Optional[int]]:
+        """
+        the timestamp (nanoseconds since the epoch) of the latest bar of
+        every symbol, None for symbols with no bars yet
+        """
+        raise NotImplementedError()
+
+    def append(self, symbol: str, bars: pd.DataFrame):
+        """stores bars, all newer than the ones already there"""
+        raise NotImplementedError()
+
+
+class DataFrameStore(BarStore):
+    """
+    Keeps the bars in memory, one DataFrame per symbol in `frames`.
+    """
+
+    def __init__(self, frames: Optional[Dict[str, pd.DataFrame]] = None):
+        self.frames = frames if frames is not None else {}
+
+    def last_timestamps(self, symbols):
+        result = {}
+        for symbol in symbols:
+            df = self.frames.get(symbol)
+            result[symbol] = _last(df.index) if df is not None else None
+        return result
+
+    def append(self, symbol, bars):
+        df = self.frames.get(symbol)
+        if df is None or df.empty:
+            self.frames[symbol] = bars
+        else:
+            self.frames[symbol] = pd.concat([df, bars])
+
+
+class ParquetStore(BarStore):
+    """
+    One directory per symbol, every append adds a Parquet file named after
+    the timestamp of its last bar. Needs pyarrow.
+    """
+
+    def __init__(self, path: str):
+        self._path = os.path.abspath(os.path.expanduser(path))
+
+    def _dir(self, symbol: str) -> str:
+        return os.path.join(self._path, quote(symbol, safe=''))
+
+    def _parts(self, symbol: str) -> List[int]:
+        try:
+            names = os.listdir(self._dir(symbol))
+        except FileNotFoundError:
+            return []
+        return sorted(int(n[:-len('.parquet')]) for n in names
+                      if n.endswith('.parquet'))
+
+    def last_timestamps(self, symbols):
+        result = {}
+        for symbol in symbols:
+            parts = self._parts(symbol)
+            result[symbol] = parts[-1] if parts else None
+        return result
+
+    def append(self, symbol, bars):
+        if bars.empty:
+            return
+        directory = self._dir(symbol)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{_last(bars.index)}.parquet')
+        bars.to_parquet(path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def read(self, symbol: str) -> pd.DataFrame:
+        parts = self._parts(symbol)
+        if not parts:
+            return pd.DataFrame()
+        return pd.concat([
+            pd.read_parquet(os.path.join(self._dir(symbol), f'{p}.parquet'))
+            for p in parts])
+
+
+class SQLiteStore(BarStore):
+    """
+    A table of (symbol, timestamp in nanoseconds, bar columns...), keyed by
+    symbol and timestamp.
+    """
+
+    def __init__(self, path: str, table: str = 'bars'):
+        if not table.isidentifier():
+            raise ValueError(f'invalid table name: {table}')
+        self._conn = sqlite3.connect(os.path.expanduser(path))
+        self._table = table
+        columns = ', '.join(f'{c} REAL' for c in BAR_COLUMNS)
+        with self._conn:
+            self._conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {table} ('
+                f'symbol TEXT NOT NULL, timestamp INTEGER NOT NULL, '
+                f'{columns}, PRIMARY KEY (symbol, timestamp))')
+
+    def last_timestamps(self, symbols):
+        symbols = list(symbols)
+        result = dict.fromkeys(symbols)
+        for i in range(0, len(symbols), 500):
+            chunk = symbols[i:i + 500]
+            rows = self._conn.execute(
+                f'SELECT symbol, MAX(timestamp) FROM {self._table} '
+                f'WHERE symbol IN ({",".join("?" * len(chunk))}) '
+                f'GROUP BY symbol', chunk)
+            result.update(rows)
+        return result
+
+    def append(self, symbol, bars):
+        if bars.empty:
+            return
+        columns = [c for c in BAR_COLUMNS if c in bars.columns]
+        timestamps = _nanos(bars.index)
+        values = [bars[c].tolist() for c in columns]
+        rows = ((symbol, t) + row
+                for t, row in zip(timestamps, zip(*values)))
+        with self._conn:
+            self._conn.executemany(
+                f'INSERT OR REPLACE INTO {self._table} '
+                f'(symbol, timestamp, {", ".join(columns)}) '
+                f'VALUES (?, ?{", ?" * len(columns)})', rows)
+
+    def read(self, symbol: str) -> pd.DataFrame:
+        df = pd.read_sql_query(
+            f'SELECT * FROM {self._table} WHERE symbol = ? '
+            f'ORDER BY timestamp', self._conn, params=(symbol,))
+        df.index = pd.DatetimeIndex(
+            pd.to_datetime(df.pop('timestamp'), unit='ns', utc=True),
+            name='timestamp')
+        return df.drop(columns='symbol')
+
+    def close(self):
+        self._conn.close()
+
+
+def _nanos(index: pd.DatetimeIndex) -> List[int]:
+    if hasattr(index, 'as_unit'):
+        # pandas 2+ may pick a coarser unit than ns
+        index = index.as_unit('ns')
+    return index.asi8.tolist()
+
+
+def _last(index: pd.DatetimeIndex) -> Optional[int]:
+    if not len(index):
+        return None
+    return int(index.max().value)
@@ -0,0 +1,84 @@
+"""
+Runs every benchmark suite and writes one JSON document, to keep with a
+release and compare the next one against.
+
+    python -m benchmarks --output 3.2.0.json
+    python -m benchmarks --compare 3.2.0.json [--only rest,stream]
+
+``--compare`` prints how each benchmark's best time changed against the
+older results and exits with status 1 when one got slower than
+``--threshold`` (10% by default). Keep --rows and --repeat the same
+between the runs being compared, most results scale with them.
+"""
+import importlib
+import json
+import sys
+import time
+
+from .common import arguments, environment, run
+
+SUITES = ('import', 'entity', 'frames', 'json', 'rest', 'async', 'stream')
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """prints the best time ratios, returns the regressed benchmarks"""
+    regressions = []
+    for suite, results in current['suites'].items():
+        previous = baseline.get('suites', {}).get(suite, {})
+        for name, res in results.items():
+            if name not in previous:
+                continue
+            ratio = res['best'] / previous[name]['best']
+            flag = ''
+            if ratio > 1 + threshold:
+                flag = '  REGRESSION'
+                regressions.append(f'{suite}.{name}')
+            print(f'{suite}.{name:<28} {previous[name]["best"] * 1e3:10.2f}'
+                  f' -> {res["best"] * 1e3:10.2f} ms  x{ratio:.2f}{flag}')
+    return regressions
+
+
+def main():
+    parser = arguments('all the benchmark suites')
+    parser.add_argument('--only', default=','.join(SUITES),
+                        help='comma separated suites to run')
+    parser.add_argument('--output', help='write the JSON results here')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='JSON results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        # the comparison is the report
+        args.json = True
+
+    suites = [s.strip() for s in args.only.split(',') if s.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f'unknown suites: {", ".join(sorted(unknown))}')
+
+    document = dict(environment(),
+                    started=time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                          time.gmtime()),
+                    rows=args.rows,
+                    repeat=args.repeat,
+                    suites={})
+    for suite in suites:
+        module = importlib.import_module(f'{__package__}.bench_{suite}')
+        document['suites'][suite] = run(suite, module.BENCHMARKS, args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+            f.write('\n')
+    if args.compare:
+        if compare(baseline, document, args.threshold):
+            sys.exit(1)
+    elif args.json:
+        json.dump(document, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
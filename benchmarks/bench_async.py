@@ -0,0 +1,66 @@
+"""
+AsyncRest fan-out against a local stub server: one new aiohttp session per
+call (how AsyncRest used to work) versus the shared keep-alive session.
+The stub speaks plain http, so the real gap is bigger: every new session
+also pays a TLS handshake against the api.
+
+    python -m benchmarks.bench_async [--rows N] [--json]
+"""
+import asyncio
+
+import aiohttp
+
+from alpaca_trade_api.rest_async import AsyncRest, gather_with_concurrency
+
+from .common import main, measure
+from .stub_server import StubServer
+
+CONCURRENCY = 100
+
+
+def _symbols(args):
+    return [f'SYM{i}' for i in range(max(1, args.rows // 100))]
+
+
+def per_call_sessions(args):
+    symbols = _symbols(args)
+    with StubServer(rows=1) as server:
+        rest = AsyncRest('key-id', 'secret-key', data_url=server.url)
+
+        async def latest(symbol):
+            url = rest._get_latest_url('trades', symbol)
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url, **rest._get_opts()) as response:
+                    return symbol, await response.json()
+
+        async def fan_out():
+            await gather_with_concurrency(
+                CONCURRENCY, *(latest(s) for s in symbols))
+
+        res = measure(lambda: asyncio.run(fan_out()), args.repeat)
+    res['requests_per_sec'] = int(len(symbols) / res['best'])
+    return res
+
+
+def shared_session(args):
+    symbols = _symbols(args)
+    with StubServer(rows=1) as server:
+        async def fan_out():
+            async with AsyncRest('key-id', 'secret-key',
+                                 data_url=server.url) as rest:
+                await gather_with_concurrency(
+                    CONCURRENCY,
+                    *(rest.get_latest_trade_async(s) for s in symbols))
+
+        res = measure(lambda: asyncio.run(fan_out()), args.repeat)
+    res['requests_per_sec'] = int(len(symbols) / res['best'])
+    return res
+
+
+BENCHMARKS = {
+    'per_call_sessions': per_call_sessions,
+    'shared_session': shared_session,
+}
+
+if __name__ == '__main__':
+    main('async', BENCHMARKS)
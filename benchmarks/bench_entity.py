@@ -0,0 +1,76 @@
+"""
+Measures attribute access on entities, which goes through
+Entity.__getattr__ for every field.
+
+    python -m benchmarks.bench_entity [--rows N] [--json]
+"""
+from alpaca_trade_api.entity import Order
+from alpaca_trade_api.entity_v2 import TradeV2
+
+from . import payloads
+from .common import main, measure
+
+ORDER = {
+    'id': '904837e3-3b76-47ec-b432-046db621571b',
+    'client_order_id': '904837e3-3b76-47ec-b432-046db621571b',
+    'symbol': 'AAPL',
+    'qty': '15',
+    'side': 'buy',
+    'type': 'market',
+    'status': 'new',
+    'created_at': '2018-03-09T19:05:27.123456Z',
+    'submitted_at': '2018-03-09T19:05:27.123456Z',
+    'filled_at': None,
+}
+
+
+def order_timestamp_access(args):
+    orders = [Order(dict(ORDER)) for _ in range(1000)]
+    number = max(1, args.rows // 1000)
+
+    def run():
+        for o in orders:
+            o.submitted_at
+            o.created_at
+
+    res = measure(run, args.repeat, number)
+    res['accesses_per_sec'] = int(2000 / res['best'])
+    return res
+
+
+def order_plain_access(args):
+    orders = [Order(dict(ORDER)) for _ in range(1000)]
+    number = max(1, args.rows // 1000)
+
+    def run():
+        for o in orders:
+            o.symbol
+            o.qty
+
+    res = measure(run, args.repeat, number)
+    res['accesses_per_sec'] = int(2000 / res['best'])
+    return res
+
+
+def trade_v2_remapped_access(args):
+    trades = [TradeV2(t) for t in payloads.trades(1000)]
+    number = max(1, args.rows // 1000)
+
+    def run():
+        for t in trades:
+            t.price
+            t.timestamp
+
+    res = measure(run, args.repeat, number)
+    res['accesses_per_sec'] = int(2000 / res['best'])
+    return res
+
+
+BENCHMARKS = {
+    'order_timestamp_access': order_timestamp_access,
+    'order_plain_access': order_plain_access,
+    'trade_v2_remapped_access': trade_v2_remapped_access,
+}
+
+if __name__ == '__main__':
+    main('entity', BENCHMARKS)
@@ -0,0 +1,81 @@
+"""
+Compares building a bars/quotes DataFrame the classic way (one Entity per
+item, then EntityList.df) with the columnar path used by
+REST.get_bars_frame() and friends, and the timestamp parsing both use
+against plain pandas inference.
+
+    python -m benchmarks.bench_frames [--rows N] [--json]
+"""
+import pandas as pd
+
+from alpaca_trade_api.entity import rfc3339_index
+from alpaca_trade_api.entity_v2 import (
+    BarsV2, QuotesV2, ColumnarFrameBuilder, bar_mapping_v2, quote_mapping_v2,
+)
+
+from . import payloads
+from .common import main, measure
+
+
+def _entity_path(list_type, pages):
+    return list_type([item for page in pages for item in page]).df
+
+
+def _columnar_path(mapping, pages):
+    return ColumnarFrameBuilder(mapping).extend(pages).df
+
+
+def bars_entity_list(args):
+    pages = payloads.paginate(payloads.bars(args.rows))
+    res = measure(lambda: _entity_path(BarsV2, pages), args.repeat)
+    res['rows_per_sec'] = int(args.rows / res['best'])
+    return res
+
+
+def bars_columnar(args):
+    pages = payloads.paginate(payloads.bars(args.rows))
+    res = measure(lambda: _columnar_path(bar_mapping_v2, pages), args.repeat)
+    res['rows_per_sec'] = int(args.rows / res['best'])
+    return res
+
+
+def quotes_entity_list(args):
+    pages = payloads.paginate(payloads.quotes(args.rows))
+    res = measure(lambda: _entity_path(QuotesV2, pages), args.repeat)
+    res['rows_per_sec'] = int(args.rows / res['best'])
+    return res
+
+
+def quotes_columnar(args):
+    pages = payloads.paginate(payloads.quotes(args.rows))
+    res = measure(lambda: _columnar_path(quote_mapping_v2, pages),
+                  args.repeat)
+    res['rows_per_sec'] = int(args.rows / res['best'])
+    return res
+
+
+def timestamps_pandas(args):
+    index = pd.Index([q['t'] for q in payloads.quotes(args.rows)])
+    res = measure(lambda: pd.DatetimeIndex(index), args.repeat)
+    res['rows_per_sec'] = int(args.rows / res['best'])
+    return res
+
+
+def timestamps_rfc3339(args):
+    index = pd.Index([q['t'] for q in payloads.quotes(args.rows)])
+    res = measure(lambda: rfc3339_index(index), args.repeat)
+    res['rows_per_sec'] = int(args.rows / res['best'])
+    return res
+
+
+BENCHMARKS = {
+    'bars_entity_list': bars_entity_list,
+    'bars_columnar': bars_columnar,
+    'quotes_entity_list': quotes_entity_list,
+    'quotes_columnar': quotes_columnar,
+    'timestamps_pandas': timestamps_pandas,
+    'timestamps_rfc3339': timestamps_rfc3339,
+}
+
+if __name__ == '__main__':
+    main('frames', BENCHMARKS)
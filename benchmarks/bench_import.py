@@ -0,0 +1,74 @@
+"""
+Time to ``import alpaca_trade_api`` in a fresh interpreter, as paid by
+every script and worker process using the sdk. ``heavy`` lists the big
+dependencies (pandas, aiohttp, ...) the import pulled in, they are meant
+to load only once used.
+
+    python -m benchmarks.bench_import [--json]
+"""
+import json
+import os
+import subprocess
+import sys
+
+from .common import main
+
+SCRIPT = '''
+import json, sys, time
+before = set(sys.modules)
+started = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - started
+loaded = set(sys.modules) - before
+print(json.dumps([elapsed, len(loaded), sorted(loaded & {heavy})]))
+'''
+
+# the dependencies that are only imported once they're needed
+HEAVY = {'pandas', 'numpy', 'aiohttp', 'websockets', 'msgpack'}
+
+# the repo root, so the checkout is imported rather than an installed copy
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _import(statement):
+    script = SCRIPT.format(statement=statement, heavy=HEAVY)
+    out = subprocess.run([sys.executable, '-c', script], cwd=ROOT,
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out)
+
+
+def _bench(args, statement):
+    runs = [_import(statement) for _ in range(args.repeat)]
+    timings = [elapsed for elapsed, _, _ in runs]
+    return {
+        'best': min(timings),
+        'mean': sum(timings) / len(timings),
+        'repeat': args.repeat,
+        'number': 1,
+        'modules': runs[0][1],
+        'heavy': runs[0][2],
+    }
+
+
+def import_sdk(args):
+    """import alpaca_trade_api, modules counts everything it pulled in"""
+    return _bench(args, 'import alpaca_trade_api')
+
+
+def import_rest(args):
+    """what a script only talking to the trading api pays"""
+    return _bench(args, 'from alpaca_trade_api import REST')
+
+
+def import_stream(args):
+    return _bench(args, 'from alpaca_trade_api import Stream')
+
+
+BENCHMARKS = {
+    'import_sdk': import_sdk,
+    'import_rest': import_rest,
+    'import_stream': import_stream,
+}
+
+if __name__ == '__main__':
+    main('import', BENCHMARKS)
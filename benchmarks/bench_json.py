@@ -0,0 +1,65 @@
+"""
+Decoding a 10k quotes api page: the way REST used to (resp.text, then
+resp.json(), both going through text) versus decoding resp.content with
+each json library installed.
+
+    python -m benchmarks.bench_json [--json]
+"""
+import json
+
+import requests
+
+from alpaca_trade_api.jsonlib import DECODERS, get_decoder
+
+from . import payloads
+from .common import main, measure
+
+NUMBER = 10
+
+
+def _page() -> requests.Response:
+    resp = requests.Response()
+    resp.status_code = 200
+    resp.headers['Content-Type'] = 'application/json; charset=utf-8'
+    resp._content = json.dumps({
+        'quotes': payloads.quotes(payloads.PAGE_SIZE),
+        'symbol': 'AAPL',
+        'next_page_token': 'QUFQTHxRfDE2MjMxNDI4MDAwMDAwMDAwMDA=',
+    }).encode()
+    return resp
+
+
+def _result(res, resp):
+    res['mb_per_sec'] = round(len(resp.content) / res['best'] / 1e6, 1)
+    return res
+
+
+def text_then_json(args):
+    resp = _page()
+
+    def decode():
+        if resp.text != '':
+            return resp.json()
+
+    return _result(measure(decode, args.repeat, NUMBER), resp)
+
+
+def _content_benchmark(name):
+    def bench(args):
+        resp = _page()
+        decoder = get_decoder(name)
+        return _result(measure(lambda: decoder(resp.content), args.repeat,
+                               NUMBER), resp)
+    return bench
+
+
+BENCHMARKS = {'text_then_json': text_then_json}
+for _name in DECODERS:
+    try:
+        get_decoder(_name)
+    except ImportError:
+        continue
+    BENCHMARKS[f'content_{_name}'] = _content_benchmark(_name)
+
+if __name__ == '__main__':
+    main('json', BENCHMARKS)
@@ -0,0 +1,56 @@
+"""
+Historical data paging with the sync REST client against the local stub
+server: raw dicts straight from _data_get, entities, and the columnar
+frame.
+
+    python -m benchmarks.bench_rest [--rows N] [--json]
+"""
+import os
+
+from alpaca_trade_api.rest import REST
+
+from . import payloads
+from .common import main, measure
+from .stub_server import StubServer
+
+
+def _bench(args, fetch):
+    with StubServer(rows=args.rows) as server:
+        previous = os.environ.get('APCA_API_DATA_URL')
+        os.environ['APCA_API_DATA_URL'] = server.url
+        try:
+            api = REST('key-id', 'secret-key')
+            res = measure(lambda: fetch(api), args.repeat)
+        finally:
+            if previous is None:
+                del os.environ['APCA_API_DATA_URL']
+            else:
+                os.environ['APCA_API_DATA_URL'] = previous
+    res['rows_per_sec'] = int(args.rows / res['best'])
+    res['pages'] = -(-args.rows // payloads.PAGE_SIZE)
+    return res
+
+
+def data_get(args):
+    """raw trade dicts, paging through _data_get"""
+    return _bench(args, lambda api: sum(
+        1 for _ in api._data_get('trades', 'AAPL')))
+
+
+def trades_iter(args):
+    return _bench(args, lambda api: sum(
+        1 for _ in api.get_trades_iter('AAPL')))
+
+
+def trades_frame(args):
+    return _bench(args, lambda api: api.get_trades_frame('AAPL'))
+
+
+BENCHMARKS = {
+    'data_get': data_get,
+    'trades_iter': trades_iter,
+    'trades_frame': trades_frame,
+}
+
+if __name__ == '__main__':
+    main('rest', BENCHMARKS)
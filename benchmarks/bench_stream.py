@@ -0,0 +1,159 @@
+"""
+Measures casting streamed market data messages to entities, the work
+_DataStream._cast does for every message once msgpack unpacked the frame.
+Unpacking is left out, it costs the same either way (and dominates when
+msgpack runs without its C extension).
+
+    python -m benchmarks.bench_stream [--rows N] [--json]
+
+``dispatch`` measures routing messages to their handlers, ``websocket``
+the whole pipeline (receive, unpack, cast, dispatch) against the stub
+server's websocket.
+``legacy_*`` replays the per message dict comprehension _cast used to do,
+as the baseline for the decoder table.
+"""
+import asyncio
+
+import msgpack
+
+from alpaca_trade_api.entity_v2 import (
+    Quote, Trade, quote_mapping_v2, trade_mapping_v2,
+)
+from alpaca_trade_api.stream import DataStream
+
+from . import payloads
+from .common import main, measure
+from .stub_server import StubServer
+
+FRAME_SIZE = 100  # messages per websocket frame
+
+
+def _messages(kind: str, items, timestamp: int):
+    msgs = []
+    for i, item in enumerate(items):
+        msg = dict(item, T=kind, S='AAPL')
+        msg['t'] = msgpack.Timestamp(1623139200 + i, i * 1000)
+        msgs.append(msg)
+    return [m for i in range(0, len(msgs), FRAME_SIZE)
+            for m in msgpack.unpackb(
+                msgpack.packb(msgs[i:i + FRAME_SIZE], datetime=False),
+                timestamp=timestamp)]
+
+
+def _legacy_cast(msg_type, msg):
+    # same work as before, without converting msg['t'] in place so the
+    # messages can be cast again on the next round
+    t = msg['t']
+    t = t.seconds * int(1e9) + t.nanoseconds
+    if msg_type == 't':
+        result = Trade({
+            trade_mapping_v2[k]: v
+            for k, v in msg.items() if k in trade_mapping_v2
+        })
+    else:
+        result = Quote({
+            quote_mapping_v2[k]: v
+            for k, v in msg.items() if k in quote_mapping_v2
+        })
+    result._raw['timestamp'] = t
+    return result
+
+
+def _bench(args, kind, items, legacy):
+    if legacy:
+        cast = _legacy_cast
+        msgs = _messages(kind, items, timestamp=0)
+    else:
+        cast = DataStream('key-id', 'secret-key',
+                          'https://data.alpaca.markets',
+                          raw_data=False)._cast
+        msgs = _messages(kind, items, timestamp=2)
+
+    def run():
+        for msg in msgs:
+            cast(msg['T'], msg)
+
+    res = measure(run, args.repeat)
+    res['msgs_per_sec'] = int(args.rows / res['best'])
+    return res
+
+
+def legacy_trades(args):
+    return _bench(args, 't', payloads.trades(args.rows), legacy=True)
+
+
+def trades(args):
+    return _bench(args, 't', payloads.trades(args.rows), legacy=False)
+
+
+def legacy_quotes(args):
+    return _bench(args, 'q', payloads.quotes(args.rows), legacy=True)
+
+
+def quotes(args):
+    return _bench(args, 'q', payloads.quotes(args.rows), legacy=False)
+
+
+def dispatch(args):
+    """routing raw messages to handlers, mixed symbols and wildcard"""
+    ws = DataStream('key-id', 'secret-key', 'https://data.alpaca.markets',
+                    raw_data=True)
+
+    async def handler(msg):
+        pass
+
+    ws.subscribe_trades(handler, 'AAPL', 'MSFT')
+    ws.subscribe_quotes(handler, '*')
+    symbols = ['AAPL', 'MSFT', 'TSLA', 'SPY']
+    msgs = [{'T': 'tq'[i % 2], 'S': symbols[i % 4]}
+            for i in range(args.rows)]
+
+    async def run_all():
+        for msg in msgs:
+            await ws._dispatch(msg)
+
+    loop = asyncio.new_event_loop()
+    try:
+        res = measure(lambda: loop.run_until_complete(run_all()),
+                      args.repeat)
+    finally:
+        loop.close()
+    res['msgs_per_sec'] = int(args.rows / res['best'])
+    return res
+
+
+def websocket(args):
+    """trades streamed from the stub server, connect and handshake included"""
+    with StubServer(rows=args.rows, frame_size=FRAME_SIZE) as server:
+        server.stream_frames()
+
+        def run():
+            ws = DataStream('key-id', 'secret-key', server.url,
+                            raw_data=False)
+            received = 0
+
+            async def handler(trade):
+                nonlocal received
+                received += 1
+                if received == args.rows:
+                    await ws.stop_ws()
+
+            ws.subscribe_trades(handler, 'AAPL')
+            asyncio.run(ws._run_forever())
+
+        res = measure(run, args.repeat)
+    res['msgs_per_sec'] = int(args.rows / res['best'])
+    return res
+
+
+BENCHMARKS = {
+    'legacy_trades': legacy_trades,
+    'trades': trades,
+    'legacy_quotes': legacy_quotes,
+    'quotes': quotes,
+    'dispatch': dispatch,
+    'websocket': websocket,
+}
+
+if __name__ == '__main__':
+    main('stream', BENCHMARKS)
@@ -0,0 +1,85 @@
+"""
+Small helpers shared by the benchmark scripts.
+
+Every benchmark module exposes a ``BENCHMARKS`` dict of name -> callable
+and runs them through ``main`` so the output format is the same for all of
+them: a human readable table by default, or one JSON document with
+``--json``.
+"""
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+from typing import Callable, Dict
+
+
+def measure(fn: Callable, repeat: int = 5, number: int = 1) -> dict:
+    """
+    runs fn() ``number`` times per round, for ``repeat`` rounds, and returns
+    the best and mean seconds per call.
+    """
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - started) / number)
+    return {
+        'best': min(timings),
+        'mean': sum(timings) / len(timings),
+        'repeat': repeat,
+        'number': number,
+    }
+
+
+def arguments(description: str) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--json', action='store_true',
+                        help='print machine readable results')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--rows', type=int, default=100_000)
+    return parser
+
+
+def environment() -> dict:
+    """what the results depend on besides the code, for comparing runs"""
+    import alpaca_trade_api
+    return {
+        'version': alpaca_trade_api.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+    }
+
+
+def run(suite: str,
+        benchmarks: Dict[str, Callable[[argparse.Namespace], dict]],
+        args: argparse.Namespace) -> dict:
+    results = {}
+    for name, bench in benchmarks.items():
+        results[name] = bench(args)
+        if not args.json:
+            res = results[name]
+            extra = ', '.join(f'{k}={v}' for k, v in res.items()
+                              if k not in ('best', 'mean', 'repeat',
+                                           'number'))
+            print(f'{suite}.{name:<28} best {res["best"] * 1e3:10.2f} ms'
+                  f'  mean {res["mean"] * 1e3:10.2f} ms  {extra}')
+    return results
+
+
+def main(suite: str, benchmarks: Dict[str, Callable[[argparse.Namespace],
+                                                    dict]]):
+    args = arguments(f'{suite} benchmarks').parse_args()
+    results = run(suite, benchmarks, args)
+    if args.json:
+        json.dump({
+            'suite': suite,
+            'python': platform.python_version(),
+            'results': results,
+        }, sys.stdout, indent=2)
+        print()
+    return results
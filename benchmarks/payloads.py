@@ -0,0 +1,62 @@
+"""
+Deterministic, synthetic api payloads shaped like the real data api
+responses, so the benchmarks can run fully offline.
+"""
+import random
+from typing import List
+
+PAGE_SIZE = 10000
+
+
+def _timestamp(i: int) -> str:
+    seconds, nanos = divmod(i * 1_234_567, 1_000_000_000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return (f'2021-06-08T{8 + hours % 12:02d}:{minutes:02d}:{seconds:02d}.'
+            f'{nanos:09d}Z')
+
+
+def bars(n: int, seed: int = 0) -> List[dict]:
+    rnd = random.Random(seed)
+    return [{
+        't': _timestamp(i),
+        'o': round(rnd.uniform(100, 200), 2),
+        'h': round(rnd.uniform(100, 200), 2),
+        'l': round(rnd.uniform(100, 200), 2),
+        'c': round(rnd.uniform(100, 200), 2),
+        'v': rnd.randint(1, 100000),
+        'n': rnd.randint(1, 1000),
+        'vw': round(rnd.uniform(100, 200), 4),
+    } for i in range(n)]
+
+
+def trades(n: int, seed: int = 0) -> List[dict]:
+    rnd = random.Random(seed)
+    return [{
+        't': _timestamp(i),
+        'x': rnd.choice('PKQVZ'),
+        'p': round(rnd.uniform(100, 200), 2),
+        's': rnd.randint(1, 500),
+        'c': ['@', 'T'],
+        'i': i,
+        'z': 'C',
+    } for i in range(n)]
+
+
+def quotes(n: int, seed: int = 0) -> List[dict]:
+    rnd = random.Random(seed)
+    return [{
+        't': _timestamp(i),
+        'ax': rnd.choice('PKQVZ'),
+        'ap': round(rnd.uniform(100, 200), 2),
+        'as': rnd.randint(1, 50),
+        'bx': rnd.choice('PKQVZ'),
+        'bp': round(rnd.uniform(100, 200), 2),
+        'bs': rnd.randint(1, 50),
+        'c': ['R'],
+        'z': 'C',
+    } for i in range(n)]
+
+
+def paginate(items: List[dict], page_size: int = PAGE_SIZE) -> List[list]:
+    return [items[i:i + page_size] for i in range(0, len(items), page_size)]
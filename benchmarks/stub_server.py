@@ -0,0 +1,130 @@
+"""
+A local aiohttp server mimicking the data api endpoints used by the
+benchmarks. It runs on its own event loop in a background thread so that
+both the sync REST client and AsyncRest can talk to it.
+
+    with StubServer(rows=100_000) as server:
+        REST(base_url=server.url, ...)
+
+It also serves the market data websocket on /v2/{feed}: after the auth
+and subscribe handshake it sends ``rows`` trades, in frames of
+``frame_size`` messages, then waits for the client to hang up.
+"""
+import asyncio
+import json
+import threading
+
+import msgpack
+from aiohttp import web
+
+from . import payloads
+
+LATEST_TRADE = json.dumps({
+    'symbol': 'AAPL',
+    'trade': {'t': '2021-04-20T12:40:34.123456789Z', 'x': 'J', 'p': 134.7,
+              's': 20, 'c': ['@'], 'i': 32, 'z': 'C'},
+}).encode()
+
+
+class StubServer:
+    def __init__(self,
+                 rows: int = 10000,
+                 page_size: int = payloads.PAGE_SIZE,
+                 frame_size: int = 100):
+        self._pages = {}
+        for kind, items in (('bars', payloads.bars(rows)),
+                            ('trades', payloads.trades(rows)),
+                            ('quotes', payloads.quotes(rows))):
+            pages = payloads.paginate(items, page_size) or [[]]
+            self._pages[kind] = [
+                json.dumps({
+                    kind: page,
+                    'symbol': 'AAPL',
+                    'next_page_token': str(i + 1) if i + 1 < len(pages)
+                    else None,
+                }).encode()
+                for i, page in enumerate(pages)
+            ]
+        self._rows = rows
+        self._frame_size = frame_size
+        self._frames = None
+        self.requests = 0
+        self._loop = None
+        self._thread = None
+        self._runner = None
+        self.port = None
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    async def _latest(self, request):
+        self.requests += 1
+        return web.Response(body=LATEST_TRADE,
+                            content_type='application/json')
+
+    async def _historic(self, request):
+        self.requests += 1
+        pages = self._pages.get(request.match_info['kind'])
+        if pages is None:
+            raise web.HTTPNotFound()
+        page = int(request.query.get('page_token') or 0)
+        return web.Response(body=pages[page],
+                            content_type='application/json')
+
+    def stream_frames(self):
+        if self._frames is None:
+            msgs = []
+            for i, trade in enumerate(payloads.trades(self._rows)):
+                msg = dict(trade, T='t', S='AAPL')
+                msg['t'] = msgpack.Timestamp(1623139200 + i, i * 1000)
+                msgs.append(msg)
+            self._frames = [
+                msgpack.packb(msgs[i:i + self._frame_size], datetime=False)
+                for i in range(0, len(msgs), self._frame_size)
+            ]
+        return self._frames
+
+    async def _stream(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_bytes(msgpack.packb(
+            [{'T': 'success', 'msg': 'connected'}]))
+        await ws.receive()  # auth
+        await ws.send_bytes(msgpack.packb(
+            [{'T': 'success', 'msg': 'authenticated'}]))
+        await ws.receive()  # subscribe
+        for frame in self.stream_frames():
+            await ws.send_bytes(frame)
+        async for _ in ws:
+            pass
+        return ws
+
+    def __enter__(self):
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            app = web.Application()
+            app.router.add_get('/v2/stocks/{symbol}/trades/latest',
+                               self._latest)
+            app.router.add_get('/v2/stocks/{symbol}/{kind}', self._historic)
+            app.router.add_get('/v2/{feed}', self._stream)
+            self._runner = web.AppRunner(app, access_log=None)
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, '127.0.0.1', 0)
+            self._loop.run_until_complete(site.start())
+            self.port = site._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self._runner.cleanup())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
@@ -35,6 +35,15 @@ setup(
         'alpaca_trade_api',
     ],
     install_requires=REQUIREMENTS,
+    extras_require={
+        # DataFrames (.df, get_*_frame), see Lite Mode in the README
+        'pandas': [
+            'pandas>=0.18.1',  # pyup: ignore - allow all versions above this
+            'numpy>=1.11.1',  # pyup: ignore - allow all versions above this
+        ],
+        'cache': ['pyarrow'],
+        'fast-json': ['orjson'],
+    },
     tests_require=REQUIREMENTS_TEST,
     setup_requires=['pytest-runner', 'flake8'],
 )
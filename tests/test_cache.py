@@ -0,0 +1,114 @@
+import json
+
+import pytest
+import requests_mock
+
+from alpaca_trade_api.rest import REST, TimeFrame
+
+pytest.importorskip('pyarrow')
+
+from alpaca_trade_api.cache import DataCache  # noqa: E402
+
+BARS = {
+    'AAPL': [
+        {'t': '2021-06-06T23:00:00Z', 'o': 1, 'c': 1},
+        {'t': '2021-06-07T14:00:00Z', 'o': 2, 'c': 2},
+        {'t': '2021-06-08T14:00:00Z', 'o': 3, 'c': 3, 'vw': 3.1},
+        {'t': '2021-06-09T02:00:00Z', 'o': 4, 'c': 4},
+    ],
+    'MSFT': [
+        {'t': '2021-06-08T15:00:00Z', 'o': 5, 'c': 5},
+    ],
+}
+
+
+def test_data_cache(tmp_path):
+    cache = DataCache(str(tmp_path))
+    api = REST('key-id', 'secret-key', api_version='v2', data_cache=cache)
+
+    def bars(request, context):
+        symbols = request.qs['symbols'][0].upper().split(',')
+        return json.dumps({'bars': {s: BARS[s] for s in symbols},
+                           'next_page_token': None})
+
+    with requests_mock.Mocker() as m:
+        m.get('https://data.alpaca.markets/v2/stocks/bars', text=bars)
+        first = api.get_bars('AAPL', TimeFrame.Hour,
+                             '2021-06-07', '2021-06-08').df
+        # whole New York days are fetched, then trimmed to the range
+        assert list(first.open) == [2, 3]
+        assert 'symbol' not in first.columns
+        assert m.call_count == 1
+        assert m.request_history[0].qs['start'][0].upper() == \
+            '2021-06-06T04:00:00Z'
+
+        again = api.get_bars('AAPL', TimeFrame.Hour,
+                             '2021-06-07', '2021-06-08').df
+        assert again.equals(first)
+        narrow = api.get_bars('AAPL', TimeFrame.Hour,
+                              '2021-06-08T00:00:00Z', '2021-06-10').df
+        assert list(narrow.open) == [3, 4]
+        assert narrow.vwap.isna().tolist() == [False, True]
+        assert m.call_count == 2  # only 06-09 and 06-10 were missing
+
+        # other parameters are cached apart
+        api.get_bars('AAPL', TimeFrame.Hour, '2021-06-07', '2021-06-08',
+                     adjustment='split')
+        assert m.call_count == 3
+
+        # MSFT is fetched, AAPL read from disk
+        both = api.get_bars(['MSFT', 'AAPL'], TimeFrame.Hour,
+                            '2021-06-08', '2021-06-08T23:00:00Z')
+        assert [(b.S, b.o) for b in both] == [('AAPL', 3), ('MSFT', 5)]
+        assert m.call_count == 4
+        assert m.request_history[-1].qs['symbols'] == ['msft']
+
+        # a limit bypasses the cache
+        m.get('https://data.alpaca.markets/v2/stocks/AAPL/bars',
+              text=json.dumps({'bars': BARS['AAPL'][:1]}))
+        api.get_bars('AAPL', TimeFrame.Hour, '2021-06-07', '2021-06-08',
+                     limit=1)
+        assert m.call_count == 5
+
+    stats = cache.stats()
+    assert stats['files'] == stats['writes'] > 0
+    assert stats['hits'] > 0 and stats['misses'] > 0
+
+    cache = DataCache(str(tmp_path), max_bytes=stats['bytes'] // 2)
+    assert cache.stats()['files'] == stats['files']
+    cache._write(str(tmp_path / 'stocks' / 'x.parquet'), [])
+    assert cache.stats()['bytes'] <= stats['bytes'] // 2
+    assert cache.stats()['evictions'] > 0
+    cache.clear()
+    assert cache.stats()['files'] == 0
+
+
+def test_data_cache_eviction(tmp_path):
+    def bars(request, context):
+        return json.dumps({'bars': {'AAPL': BARS['AAPL']},
+                           'next_page_token': None})
+
+    with requests_mock.Mocker() as m:
+        m.get('https://data.alpaca.markets/v2/stocks/bars', text=bars)
+        api = REST('key-id', 'secret-key', api_version='v2',
+                   data_cache=DataCache(str(tmp_path)))
+        api.get_bars('AAPL', TimeFrame.Hour, '2021-06-07', '2021-06-08')
+
+        # full: the missing days can't evict the ones read from the cache
+        cache = DataCache(str(tmp_path),
+                          max_bytes=api._data_cache.stats()['bytes'])
+        api = REST('key-id', 'secret-key', api_version='v2',
+                   data_cache=cache)
+        mixed = api.get_bars('AAPL', TimeFrame.Hour,
+                             '2021-06-07', '2021-06-11')
+        assert [b.o for b in mixed] == [2, 3, 4]
+        assert cache.stats()['hits'] == 3
+        assert m.call_count == 2
+
+        # a file gone since it was found is fetched again
+        cached = sorted(tmp_path.rglob('2021-06-07.parquet'))
+        cached[0].unlink()
+        again = api.get_bars('AAPL', TimeFrame.Hour,
+                             '2021-06-07', '2021-06-08')
+        assert [b.o for b in again] == [2, 3]
+        assert m.call_count == 3
@@ -0,0 +1,122 @@
+import os
+import pickle
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from alpaca_trade_api.entity import (
+    Calendar, Order, Trade, epoch_index, rfc3339_index
+)
+from alpaca_trade_api.entity_v2 import QuoteV2, TradeV2
+
+
+def test_entity_accessors():
+    order = Order({
+        'id': '904837e3-3b76-47ec-b432-046db621571b',
+        'qty': '15',
+        'submitted_at': '2018-03-09T19:05:27Z',
+        'filled_at': None,
+        'legs': [{'id': 'leg', 'created_at': '2018-03-09T19:05:28Z'}],
+    })
+    assert not hasattr(order, '__dict__')
+    assert order.qty == '15'
+    assert order.filled_at is None
+    assert order.submitted_at == pd.Timestamp('2018-03-09T19:05:27Z')
+    # timestamps are decoded once and then reused
+    assert order.submitted_at is order.submitted_at
+    assert order.legs[0].created_at.second == 28
+    assert 'submitted_at' in Order._accessors
+
+    restored = pickle.loads(pickle.dumps(order))
+    assert restored.submitted_at == order.submitted_at
+    assert restored.legs[0].id == 'leg'
+
+    calendar = Calendar({'date': '2018-01-03', 'open': '09:30',
+                         'close': '16:00', 'session_open': '0400',
+                         'session_close': '2000'})
+    assert calendar.date.day == 3
+    assert calendar.open.minute == 30
+    assert calendar.session_close.hour == 20
+
+    trade = Trade({'symbol': 'AAPL', 'timestamp': 1618922434123456789})
+    assert trade.timestamp.nanosecond == 789
+    assert trade.symbol == 'AAPL'
+
+    trade = TradeV2({'t': '2021-04-20T12:40:34.123456789Z', 'p': 134.7})
+    assert trade.price == trade.p == 134.7
+    assert trade.timestamp == trade.t
+    assert trade.timestamp.nanosecond == 789
+
+    quote = QuoteV2({'bp': 134.66})
+    assert quote.bid_price == 134.66
+    with pytest.raises(AttributeError):
+        quote.ask_price
+
+
+def test_timestamp_index(monkeypatch):
+    values = ['2021-06-08T08:00:00Z', '2021-06-08T08:00:00.207859Z',
+              '2021-06-08T08:00:00.069956608Z']
+    index = rfc3339_index(pd.Index(values, name='timestamp'))
+    assert index.name == 'timestamp'
+    assert str(index.tz) == 'UTC'
+    assert list(index) == [pd.Timestamp(v) for v in values]
+    # other formats take the pandas path
+    index = rfc3339_index(['2021-06-08T04:00:00-04:00'])
+    assert index[0] == pd.Timestamp('2021-06-08T08:00:00Z')
+    # parsed indexes are kept as they are, without building a Timestamp
+    # per value
+    parsed = pd.date_range('2021-06-08', periods=3, freq='s', tz='UTC',
+                           name='timestamp')
+    monkeypatch.setattr(pd.DatetimeIndex, 'tolist', None)
+    assert rfc3339_index(parsed).equals(parsed)
+    assert rfc3339_index(parsed).name == 'timestamp'
+    monkeypatch.undo()
+
+    index = epoch_index(pd.Index([1623139200, 1623142800], name='time'))
+    assert index.name == 'time'
+    assert index[1] == pd.Timestamp('2021-06-08T09:00:00Z')
+    assert str(index.tz) == 'America/New_York'
+    assert epoch_index(pd.Index([1623139200.5]))[0].microsecond == 500000
+
+
+LITE_SCRIPT = '''
+import sys
+sys.modules['pandas'] = None  # as if it wasn't installed
+from alpaca_trade_api.entity import Bar, Calendar, Order, Trade
+from alpaca_trade_api.entity_v2 import TradesV2
+print(repr(Order({'created_at': '2021-04-20T12:40:34.123456789Z'})
+           .created_at))
+print(repr(Bar({'t': 1618922434}).t.isoformat()))
+calendar = Calendar({'date': '2021-04-20', 'session_open': '0400'})
+print(repr(calendar.date), repr(calendar.session_open))
+print(repr(Trade({'timestamp': 1618922434123456789}).timestamp))
+try:
+    TradesV2([{'t': '2021-04-20T12:40:34Z', 'p': 134.7}]).df
+except ImportError as e:
+    print(e)
+'''
+
+
+def test_lite_mode():
+    out = subprocess.run([sys.executable, '-c', LITE_SCRIPT], check=True,
+                         capture_output=True, text=True).stdout
+    assert out.splitlines() == [
+        'datetime.datetime(2021, 4, 20, 12, 40, 34, 123456, '
+        'tzinfo=tzutc())',
+        "'2021-04-20T08:40:34-04:00'",
+        'datetime.datetime(2021, 4, 20, 0, 0) datetime.time(4, 0)',
+        '1618922434123456789',
+        'pandas is required for DataFrames, install it with '
+        '`pip install alpaca-trade-api[pandas]`',
+    ]
+
+    # with pandas installed, APCA_LITE_MODE turns it on
+    script = ('from alpaca_trade_api.entity import Order; '
+              'print(type(Order({"created_at": "2021-04-20T12:40:34Z"})'
+              '.created_at).__name__)')
+    env = dict(os.environ, APCA_LITE_MODE='1')
+    out = subprocess.run([sys.executable, '-c', script], check=True,
+                         capture_output=True, text=True, env=env).stdout
+    assert out.strip() == 'datetime'
@@ -0,0 +1,91 @@
+import asyncio
+
+import requests
+import requests_mock
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from alpaca_trade_api.metrics import Histogram, RequestMetrics, endpoint_key
+from alpaca_trade_api.rest import REST
+from alpaca_trade_api.rest_async import AsyncRest
+from alpaca_trade_api.retry import RetryPolicy
+
+
+def test_histogram():
+    hist = Histogram(buckets=(1, 2, 4))
+    for value in (0.5, 1.5, 1.5, 3, 10):
+        hist.observe(value)
+    assert hist.percentile(50) == 2
+    assert hist.percentile(80) == 4
+    assert hist.percentile(100) == 10
+    snapshot = hist.snapshot()
+    assert snapshot['count'] == 5
+    assert snapshot['max'] == 10
+    assert snapshot['buckets'] == {'1': 1, '2': 2, '4': 1, 'inf': 1}
+    assert Histogram().snapshot() == {'count': 0}
+
+    assert endpoint_key('get', 'https://data.alpaca.markets/v2/stocks/'
+                               'AAPL/trades?limit=10') == \
+        'GET /v2/stocks/*/trades'
+    assert endpoint_key('DELETE', 'https://api.alpaca.markets/v2/orders/'
+                                  '904837e3-3b76-47ec-b432-046db621571b') == \
+        'DELETE /v2/orders/*'
+
+
+def test_rest_metrics():
+    metrics = RequestMetrics()
+    api = REST('key-id', 'secret-key', api_version='v2',
+               retry_policy=RetryPolicy(backoff=0), metrics=metrics)
+    with requests_mock.Mocker() as m:
+        m.get('https://api.alpaca.markets/v2/clock', [
+            {'exc': requests.ConnectionError},
+            {'status_code': 429, 'text': ''},
+            {'text': '{"is_open": true}',
+             'headers': {'X-RateLimit-Limit': '200',
+                         'X-RateLimit-Remaining': '150'}},
+        ])
+        assert api.get_clock().is_open
+
+    snapshot = metrics.snapshot()
+    clock = snapshot['endpoints']['GET /v2/clock']
+    assert clock['requests'] == 3
+    assert clock['retries'] == 2
+    assert clock['errors'] == 2
+    assert clock['status'] == {'None': 1, '429': 1, '200': 1}
+    assert clock['bytes'] == len('{"is_open": true}')
+    assert clock['decode']['count'] == 1
+    assert clock['latency']['p99'] >= clock['latency']['p50']
+    assert snapshot['wrap']['Clock']['count'] == 1
+    assert snapshot['rate_limit'] == {
+        'limit': 200, 'remaining': 150, 'min_remaining': 150}
+
+    metrics.reset()
+    assert metrics.snapshot()['endpoints'] == {}
+
+
+def test_async_rest_metrics():
+    async def latest_trade(request):
+        return web.json_response({
+            'symbol': request.match_info['symbol'],
+            'trade': {'t': '2021-04-20T12:40:34.123456789Z', 'p': 134.7},
+        })
+
+    app = web.Application()
+    app.router.add_get('/v2/stocks/{symbol}/trades/latest', latest_trade)
+    metrics = RequestMetrics()
+
+    async def run():
+        async with TestServer(app) as server:
+            url = str(server.make_url('')).rstrip('/')
+            async with AsyncRest('key-id', 'secret-key', data_url=url,
+                                 metrics=metrics) as rest:
+                for symbol in ('AAPL', 'MSFT'):
+                    await rest.get_latest_trade_async(symbol)
+
+    asyncio.run(run())
+    snapshot = metrics.snapshot()
+    latest = snapshot['endpoints']['GET /v2/stocks/*/trades/latest']
+    assert latest['requests'] == 2
+    assert latest['status'] == {'200': 2}
+    assert latest['server']['count'] == 2
+    assert snapshot['connections']['connect']['count'] >= 1
@@ -0,0 +1,44 @@
+import time
+
+import requests_mock
+
+from alpaca_trade_api.ratelimit import RateLimiter
+from alpaca_trade_api.rest import REST
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(limit=2, period=1)
+    assert limiter._reserve() == 0
+    assert limiter._reserve() == 0
+    # the bucket is empty, the next caller waits for one refill
+    wait = limiter._reserve()
+    assert 0 < wait <= 0.5
+    # and the one after it queues up behind
+    assert limiter._reserve() > wait
+
+    limiter = RateLimiter(limit=200)
+    limiter.update({
+        'X-RateLimit-Limit': '100',
+        'X-RateLimit-Remaining': '0',
+        'X-RateLimit-Reset': str(int(time.time()) + 5),
+    })
+    assert limiter.limit == 100
+    assert limiter._reserve() > 3
+
+    # responses without the headers leave the bucket alone
+    limiter = RateLimiter(limit=10)
+    limiter.update({})
+    assert limiter.tokens > 9
+
+
+def test_rate_limiter_rest():
+    limiter = RateLimiter(limit=200)
+    api = REST('key-id', 'secret-key', api_version='v2',
+               rate_limiter=limiter)
+    with requests_mock.Mocker() as m:
+        m.get('https://api.alpaca.markets/v2/clock',
+              text='{"is_open": false}',
+              headers={'X-RateLimit-Limit': '200',
+                       'X-RateLimit-Remaining': '3'})
+        api.get_clock()
+    assert 2 < limiter.tokens < 4
@@ -1,9 +1,19 @@
+import json
+from collections import defaultdict
 import warnings
 import alpaca_trade_api as tradeapi
+from alpaca_trade_api import jsonlib
 from alpaca_trade_api.rest import APIError
+from alpaca_trade_api.retry import RetryPolicy
 
 import os
+import subprocess
+import sys
+import threading
+import time
+import pandas as pd
 import pytest
+import requests
 import requests_mock
 
 
@@ -1177,3 +1187,344 @@ def test_no_resource_warning_with_context_manager():
         warnings.simplefilter("error")
         with tradeapi.REST("key-id", "secret-key", api_version="v1") as api:
             assert api
+
+
+def test_data_frames(reqmock):
+    api = tradeapi.REST('key-id', 'secret-key', api_version='v1')
+
+    pages = [
+        '''
+        {
+            "bars": {
+                "AAPL": [
+                    {"t": "2021-06-08T08:00:00Z", "o": 126.1, "h": 126.3,
+                     "l": 125.96, "c": 126.3, "v": 42107, "n": 1, "vw": 126.2},
+                    {"t": "2021-06-08T09:00:00Z", "o": 126.27, "h": 126.4,
+                     "l": 126.22, "c": 126.38, "v": 21095, "n": 2, "vw": 126.3}
+                ],
+                "MSFT": [
+                    {"t": "2021-06-08T08:00:00Z", "o": 252.1, "h": 252.3,
+                     "l": 251.96, "c": 252.3, "v": 1000, "n": 3, "vw": 252.2}
+                ]
+            },
+            "next_page_token": "token"
+        }
+        ''',
+        '''
+        {
+            "bars": {
+                "MSFT": [
+                    {"t": "2021-06-08T09:00:00Z", "o": 253, "h": 254,
+                     "l": 252, "c": 253.5, "v": 1200, "n": 4}
+                ]
+            },
+            "next_page_token": null
+        }
+        ''',
+    ]
+
+    def paged(request, context):
+        return pages[1 if 'page_token' in request.qs else 0]
+
+    reqmock.get('https://data.alpaca.markets/v2/stocks/bars', text=paged)
+
+    bars = api.get_bars(['AAPL', 'MSFT'], tradeapi.TimeFrame.Hour,
+                        '2021-06-08', '2021-06-08')
+    frame = api.get_bars_frame(['AAPL', 'MSFT'], tradeapi.TimeFrame.Hour,
+                               '2021-06-08', '2021-06-08')
+    assert len(frame) == 4
+    assert list(frame.symbol) == ['AAPL', 'AAPL', 'MSFT', 'MSFT']
+    assert frame.vwap.isna().sum() == 1
+    assert frame.open.iloc[-1] == 253.0
+    assert frame.index[0].tzname() == 'UTC'
+    pd.testing.assert_frame_equal(frame, bars.df, check_like=True)
+
+    multi = api.get_bars_frame(['AAPL', 'MSFT'], tradeapi.TimeFrame.Hour,
+                               '2021-06-08', '2021-06-08',
+                               multiindex=True, downcast='all')
+    assert multi.index.names == ['symbol', 'timestamp']
+    assert isinstance(multi.index.get_level_values('symbol').dtype,
+                      pd.CategoricalDtype)
+    assert 'symbol' not in multi.columns
+    assert multi.open.dtype == 'float32'
+    assert multi.volume.dtype == 'int32'
+    assert multi.loc['MSFT'].open.tolist() == pytest.approx([252.1, 253])
+    pd.testing.assert_frame_equal(
+        multi, bars.to_df(multiindex=True, downcast='all'), check_like=True)
+    with pytest.raises(ValueError):
+        bars.to_df(downcast='half')
+
+    chunks = list(api.get_bars_chunks(['AAPL', 'MSFT'],
+                                      tradeapi.TimeFrame.Hour, '2021-06-08',
+                                      '2021-06-08', chunk_rows=3))
+    assert [len(c) for c in chunks] == [3, 1]
+    pd.testing.assert_frame_equal(pd.concat(chunks), frame)
+    with pytest.raises(ValueError):
+        next(api.get_bars_chunks('AAPL', tradeapi.TimeFrame.Hour,
+                                 chunk_rows=0))
+
+    reqmock.get(
+        'https://data.alpaca.markets/v2/stocks/AAPL/trades',
+        text='''
+        {
+            "trades": [
+                {"t": "2021-06-08T08:00:00.069956608Z", "x": "P",
+                 "p": 126.1, "s": 179, "c": ["@", "T"], "i": 1, "z": "C"},
+                {"t": "2021-06-08T08:00:00.207859Z", "x": "K",
+                 "p": 125.97, "s": 1, "c": ["@", "T", "I"], "i": 2, "z": "C"}
+            ],
+            "symbol": "AAPL",
+            "next_page_token": null
+        }
+        '''
+    )
+    frame = api.get_trades_frame('AAPL', '2021-06-08', '2021-06-08')
+    assert list(frame.columns) == [
+        'exchange', 'price', 'size', 'conditions', 'id', 'tape']
+    assert frame.conditions.iloc[1] == ['@', 'T', 'I']
+    assert frame.index[0].nanosecond == 608
+    multi = api.get_trades_frame('AAPL', '2021-06-08', '2021-06-08',
+                                 multiindex=True)
+    assert list(multi.loc['AAPL'].id) == [1, 2]
+    pd.testing.assert_frame_equal(
+        frame, api.get_trades('AAPL', '2021-06-08', '2021-06-08').df)
+
+    reqmock.get(
+        'https://data.alpaca.markets/v2/stocks/AAPL/quotes',
+        text='{"quotes": [], "symbol": "AAPL", "next_page_token": null}'
+    )
+    assert api.get_quotes_frame('AAPL', '2021-06-08', '2021-06-08').empty
+
+
+def test_data_shards(reqmock):
+    api = tradeapi.REST('key-id', 'secret-key', api_version='v1')
+
+    def trades(request, context):
+        hour = int(request.qs['start'][0][11:13])
+        if 'page_token' in request.qs:
+            items = [{"t": f"2021-06-08T{hour:02d}:30:00Z", "p": hour + .5}]
+            token = None
+        else:
+            items = [{"t": f"2021-06-08T{hour:02d}:00:00Z", "p": hour}]
+            token = 'next'
+        return json.dumps({
+            'trades': items, 'symbol': 'AAPL', 'next_page_token': token})
+
+    reqmock.get('https://data.alpaca.markets/v2/stocks/AAPL/trades',
+                text=trades)
+    trades = list(api.get_trades_iter('AAPL', '2021-06-08T00:00:00Z',
+                                      '2021-06-08T04:00:00Z', shards=4))
+    assert [t.p for t in trades] == [0, .5, 1, 1.5, 2, 2.5, 3, 3.5]
+    ranges = sorted((r.qs['start'][0].upper(), r.qs['end'][0].upper())
+                    for r in reqmock.request_history
+                    if 'page_token' not in r.qs)
+    assert ranges == [
+        ('2021-06-08T00:00:00Z', '2021-06-08T00:59:59.999999999Z'),
+        ('2021-06-08T01:00:00Z', '2021-06-08T01:59:59.999999999Z'),
+        ('2021-06-08T02:00:00Z', '2021-06-08T02:59:59.999999999Z'),
+        ('2021-06-08T03:00:00Z', '2021-06-08T04:00:00Z'),
+    ]
+
+    def bars(request, context):
+        hour = int(request.qs['start'][0][11:13])
+        return json.dumps({'bars': {
+            'MSFT': [{"t": f"2021-06-08T{hour:02d}:00:00Z", "o": hour}],
+            'AAPL': [{"t": f"2021-06-08T{hour:02d}:00:00Z", "o": hour}],
+        }})
+
+    reqmock.get('https://data.alpaca.markets/v2/stocks/bars', text=bars)
+    bars = api.get_bars(['MSFT', 'AAPL'], tradeapi.TimeFrame.Hour,
+                        '2021-06-08T00:00:00Z', '2021-06-08T02:00:00Z',
+                        shards=2)
+    assert [(b.S, b.o) for b in bars] == [
+        ('AAPL', 0), ('AAPL', 1), ('MSFT', 0), ('MSFT', 1)]
+
+    # however many shards, at most max_shard_workers are paged at once
+    api = tradeapi.REST('key-id', 'secret-key', max_shard_workers=3)
+    running = []
+    concurrency = []
+    lock = threading.Lock()
+
+    def slow_trades(request, context):
+        with lock:
+            running.append(request)
+            concurrency.append(len(running))
+        time.sleep(0.005)
+        with lock:
+            running.remove(request)
+        return json.dumps({'trades': [], 'symbol': 'AAPL',
+                           'next_page_token': None})
+
+    reqmock.get('https://data.alpaca.markets/v2/stocks/AAPL/trades',
+                text=slow_trades)
+    assert list(api.get_trades_iter('AAPL', '2021-06-01T00:00:00Z',
+                                    '2021-06-08T00:00:00Z', shards=50)) == []
+    assert len(concurrency) == 50
+    assert max(concurrency) <= 3
+    adapter = api._session.get_adapter('https://')
+    assert adapter._pool_maxsize == requests.adapters.DEFAULT_POOLSIZE
+
+    # the pools grow in place, keeping the adapter's own settings
+    adapter = requests.adapters.HTTPAdapter(max_retries=2, pool_block=True)
+    api._session.mount('https://', adapter)
+    previous = adapter.poolmanager
+    api._ensure_pool_size(16)
+    assert api._session.get_adapter('https://') is adapter
+    assert adapter.max_retries.total == 2
+    assert adapter.poolmanager is not previous
+    assert adapter.poolmanager.connection_pool_kw['maxsize'] == 16
+    assert adapter.poolmanager.connection_pool_kw['block']
+    api._ensure_pool_size(4)
+    assert adapter._pool_maxsize == 16
+
+
+def test_data_symbol_batches(reqmock):
+    api = tradeapi.REST('key-id', 'secret-key', api_version='v1',
+                        symbols_per_request=2)
+
+    def bars(request, context):
+        symbols = request.qs['symbols'][0].upper().split(',')
+        limit = int(request.qs.get('limit', [10000])[0])
+        items = [(s, i) for s in sorted(symbols) for i in range(2)][:limit]
+        by_symbol = defaultdict(list)
+        for s, i in items:
+            by_symbol[s].append({"t": "2021-06-08T00:00:00Z", "o": i})
+        return json.dumps({'bars': by_symbol})
+
+    reqmock.get('https://data.alpaca.markets/v2/stocks/bars', text=bars)
+    symbols = ['MSFT', 'AAPL', 'TSLA', 'AMZN', 'GOOG']
+    bars = api.get_bars(symbols, tradeapi.TimeFrame.Day,
+                        '2021-06-08', '2021-06-08')
+    assert [b.S for b in bars] == [
+        s for s in sorted(symbols) for _ in range(2)]
+    assert sorted(r.qs['symbols'][0].upper()
+                  for r in reqmock.request_history) == [
+        'AAPL,AMZN', 'GOOG,MSFT', 'TSLA']
+
+    # the limit spans the batches
+    bars = api.get_bars(symbols, tradeapi.TimeFrame.Day,
+                        '2021-06-08', '2021-06-08', limit=5)
+    assert [(b.S, b.o) for b in bars] == [
+        ('AAPL', 0), ('AAPL', 1), ('AMZN', 0), ('AMZN', 1), ('GOOG', 0)]
+
+    # 4 letters and an encoded comma per symbol
+    api = tradeapi.REST('key-id', 'secret-key', api_version='v1',
+                        max_url_length=tradeapi.rest.DATA_URL_RESERVE + 14)
+    reqmock.reset_mock()
+    assert len(api.get_bars_frame(symbols, tradeapi.TimeFrame.Day,
+                                  '2021-06-08', '2021-06-08')) == 10
+    assert len(reqmock.request_history) == 3
+
+
+def test_json_decoder(reqmock):
+    decoded = []
+
+    def decoder(content):
+        decoded.append(content)
+        return json.loads(content)
+
+    api = tradeapi.REST('key-id', 'secret-key', api_version='v1',
+                        json_decoder=decoder)
+    reqmock.get('https://api.alpaca.markets/v1/clock',
+                content=b'{"timestamp": "2018-04-01T12:00:00.000Z", '
+                        b'"is_open": true}')
+    assert api.get_clock().is_open
+    assert decoded == [b'{"timestamp": "2018-04-01T12:00:00.000Z", '
+                       b'"is_open": true}']
+
+    reqmock.delete('https://api.alpaca.markets/v1/orders', content=b'')
+    assert api.cancel_all_orders() is None
+    assert len(decoded) == 1
+
+    assert jsonlib.get_decoder('json') is json.loads
+    assert jsonlib.default_decoder is not None
+    with pytest.raises(ValueError):
+        jsonlib.get_decoder('simplejson')
+
+
+def test_lazy_imports():
+    script = '''
+import sys
+import threading
+import time
+from alpaca_trade_api import REST
+api = REST('key-id', 'secret-key')
+heavy = {'pandas', 'numpy', 'aiohttp', 'websockets', 'msgpack'}
+print(','.join(sorted(heavy & set(sys.modules))))
+from alpaca_trade_api.entity import Order
+Order({'created_at': '2021-04-20T12:40:34Z'}).created_at
+print(','.join(sorted(heavy & set(sys.modules))))
+'''
+    out = subprocess.run([sys.executable, '-c', script], check=True,
+                         capture_output=True, text=True).stdout
+    assert out.splitlines() == ['', 'numpy,pandas']
+
+    script = '''
+import alpaca_trade_api as tradeapi
+print(tradeapi.rest.APIError.__name__, tradeapi.entity.Order.__name__)
+'''
+    out = subprocess.run([sys.executable, '-c', script], check=True,
+                         capture_output=True, text=True).stdout
+    assert out.split() == ['APIError', 'Order']
+
+    assert tradeapi.AsyncRest.__name__ == 'AsyncRest'
+    assert 'Stream' in dir(tradeapi)
+    with pytest.raises(AttributeError):
+        tradeapi.Missing
+
+
+def test_submit_orders(reqmock):
+    api = tradeapi.REST('key-id', 'secret-key',
+                        retry_policy=RetryPolicy(backoff=0))
+    submitted = defaultdict(list)
+    accepted = {}
+
+    def post_order(request, context):
+        order = request.json()
+        symbol = order['symbol']
+        submitted[symbol].append(order['client_order_id'])
+        if symbol == 'TSLA':
+            context.status_code = 403
+            return {'code': 40310000, 'message': 'insufficient buying power'}
+        accepted[order['client_order_id']] = order
+        if symbol == 'MSFT' and len(submitted[symbol]) == 1:
+            # accepted, but the response never made it back
+            raise requests.exceptions.ReadTimeout()
+        if symbol == 'SPY' and len(submitted[symbol]) == 1:
+            del accepted[order['client_order_id']]
+            context.status_code = 503
+            return {'message': 'service unavailable'}
+        return dict(order, id=order['client_order_id'])
+
+    def get_order(request, context):
+        order = accepted.get(request.qs['client_order_id'][0])
+        if order is None:
+            context.status_code = 404
+            return {'code': 40410000, 'message': 'order not found'}
+        return dict(order, id=order['client_order_id'])
+
+    reqmock.post('https://api.alpaca.markets/v2/orders', json=post_order)
+    reqmock.get('https://api.alpaca.markets/v2/orders:by_client_order_id',
+                json=get_order)
+
+    specs = [
+        {'symbol': 'AAPL', 'qty': 10, 'side': 'buy',
+         'client_order_id': 'my-aapl'},
+        {'symbol': 'MSFT', 'qty': 5, 'side': 'sell'},
+        {'symbol': 'TSLA', 'qty': 1},
+        {'symbol': 'SPY', 'qty': 2, 'type': 'limit', 'limit_price': 410},
+    ]
+    results = api.submit_orders(specs, max_concurrency=4)
+    assert [type(r).__name__ for r in results] == \
+        ['Order', 'Order', 'APIError', 'Order']
+    assert results[0].client_order_id == 'my-aapl'
+    assert [r.symbol for r in results if not isinstance(r, Exception)] == \
+        ['AAPL', 'MSFT', 'SPY']
+    assert results[2].status_code == 403
+    # found by its client_order_id instead of being placed twice
+    assert len(submitted['MSFT']) == 1
+    assert results[1].client_order_id == submitted['MSFT'][0]
+    # not there after the 503, sent again with the same id
+    assert len(set(submitted['SPY'])) == 1 and len(submitted['SPY']) == 2
+    assert 'client_order_id' not in specs[1]
+    assert api.submit_orders([]) == []
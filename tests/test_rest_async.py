@@ -0,0 +1,189 @@
+import asyncio
+import gc
+import warnings
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from alpaca_trade_api.rest import APIError
+from alpaca_trade_api.rest_async import AsyncRest
+from alpaca_trade_api.retry import RetryPolicy
+
+
+def _app(state):
+    async def latest_trade(request):
+        state['peers'].add(request.transport.get_extra_info('peername'))
+        return web.json_response({
+            'symbol': request.match_info['symbol'],
+            'trade': {'t': '2021-04-20T12:40:34.123456789Z', 'p': 134.7},
+        })
+
+    app = web.Application()
+    app.router.add_get('/v2/stocks/{symbol}/trades/latest', latest_trade)
+    return app
+
+
+def test_shared_session():
+    state = {'peers': set()}
+
+    async def run():
+        async with TestServer(_app(state)) as server:
+            url = str(server.make_url('')).rstrip('/')
+            async with AsyncRest('key-id', 'secret-key', data_url=url,
+                                 connection_limit=1) as rest:
+                for symbol in ('AAPL', 'MSFT', 'TSLA'):
+                    sym, trade = await rest.get_latest_trade_async(symbol)
+                    assert sym == symbol
+                    assert trade.price == 134.7
+                session = rest._session
+                assert not session.closed
+            assert session.closed
+            assert rest._session is None
+
+    asyncio.run(run())
+    # keep-alive: all the requests went through one connection
+    assert len(state['peers']) == 1
+
+
+def test_session_per_event_loop():
+    state = {'peers': set()}
+    rest = AsyncRest('key-id', 'secret-key', connection_limit=1)
+    sessions = []
+
+    async def run():
+        async with TestServer(_app(state)) as server:
+            rest._data_url = str(server.make_url('')).rstrip('/')
+            await rest.get_latest_trade_async('AAPL')
+            sessions.append(rest._session)
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        # not closed by the caller: each asyncio.run() closes its session
+        # with its loop
+        asyncio.run(run())
+        assert sessions[0].closed
+        asyncio.run(run())
+        assert sessions[1] is not sessions[0]
+        assert sessions[1].closed
+        del sessions[:]
+        gc.collect()
+    assert not [w for w in caught if issubclass(w.category, ResourceWarning)]
+
+
+def test_trading_endpoints():
+    requests = []
+
+    async def handler(request):
+        body = await request.json() if request.can_read_body else None
+        requests.append((request.method, request.path, dict(request.query),
+                         body, request.headers['APCA-API-KEY-ID']))
+        if request.path == '/v2/orders' and request.method == 'POST':
+            return web.json_response(dict(body, id='order-1',
+                                          status='accepted'))
+        if request.path == '/v2/orders' and request.method == 'GET':
+            return web.json_response([{'id': 'order-1', 'symbol': 'AAPL'}])
+        if request.path == '/v2/orders/order-1':
+            return web.Response(status=204)
+        if request.path == '/v2/positions':
+            return web.json_response([{'symbol': 'AAPL', 'qty': '10'}])
+        if request.path == '/v2/clock':
+            return web.json_response({
+                'timestamp': '2021-04-20T12:40:34.123Z', 'is_open': True})
+        return web.json_response(
+            {'code': 40410000, 'message': 'order not found'}, status=404)
+
+    app = web.Application()
+    app.router.add_route('*', '/{path:.*}', handler)
+
+    async def run():
+        async with TestServer(app) as server:
+            url = str(server.make_url('')).rstrip('/')
+            async with AsyncRest('key-id', 'secret-key',
+                                 base_url=url) as rest:
+                order = await rest.submit_order_async(
+                    'AAPL', qty=10, type='limit', limit_price='134.5',
+                    extended_hours=True)
+                assert order.id == 'order-1'
+                assert order.limit_price == 134.5
+
+                orders = await rest.list_orders_async(
+                    status='open', nested=True, symbols=['AAPL', 'MSFT'])
+                assert [o.symbol for o in orders] == ['AAPL']
+                assert await rest.cancel_order_async('order-1') is None
+
+                positions = await rest.list_positions_async()
+                assert positions[0].qty == '10'
+                clock = await rest.get_clock_async()
+                assert clock.is_open
+                assert clock.timestamp.year == 2021
+
+                with pytest.raises(APIError) as e:
+                    await rest.get_order_async('missing')
+                assert e.value.status_code == 404
+                assert e.value.code == 40410000
+
+    asyncio.run(run())
+    method, path, query, body, key_id = requests[0]
+    assert (method, path, key_id) == ('POST', '/v2/orders', 'key-id')
+    assert body == {'symbol': 'AAPL', 'side': 'buy', 'type': 'limit',
+                    'time_in_force': 'day', 'qty': 10,
+                    'limit_price': 134.5, 'extended_hours': True}
+    assert requests[1][2] == {'status': 'open', 'nested': 'true',
+                              'symbols': 'AAPL,MSFT'}
+    assert requests[2][:2] == ('DELETE', '/v2/orders/order-1')
+
+
+def test_trading_retries():
+    attempts = []
+
+    async def handler(request):
+        attempts.append((request.method, request.path))
+        n = attempts.count((request.method, request.path))
+        if request.path == '/v2/orders':
+            # throttled once, then accepted
+            if n == 1:
+                return web.json_response(
+                    {'code': 42910000, 'message': 'rate limit exceeded'},
+                    status=429, headers={'Retry-After': '0'})
+            return web.json_response({'id': 'order-1'})
+        if request.path == '/v2/watchlists' and n < 3:
+            return web.Response(status=504)
+        if request.path == '/v2/watchlists':
+            return web.json_response([{'id': 'wl-1', 'name': 'tech',
+                                       'assets': []}])
+        if request.path == '/v2/account/configurations':
+            return web.Response(status=504)
+        if request.path == '/v2/account/activities/FILL':
+            return web.json_response([{'id': 'act-1', 'qty': '10'}])
+        return web.json_response({'timestamp': [1623139200],
+                                  'equity': [100.0]})
+
+    app = web.Application()
+    app.router.add_route('*', '/{path:.*}', handler)
+
+    async def run():
+        async with TestServer(app) as server:
+            url = str(server.make_url('')).rstrip('/')
+            async with AsyncRest('key-id', 'secret-key', base_url=url,
+                                 retry_policy=RetryPolicy(backoff=0)) as rest:
+                order = await rest.submit_order_async('AAPL', qty=1)
+                assert order.id == 'order-1'
+                watchlists = await rest.get_watchlists_async()
+                assert watchlists[0].name == 'tech'
+                # a 504 may come after the change was applied
+                with pytest.raises(aiohttp.ClientResponseError) as e:
+                    await rest.update_account_configurations_async(
+                        no_shorting=True)
+                assert e.value.status == 504
+                activities = await rest.get_activities_async('FILL')
+                assert activities[0].qty == '10'
+                history = await rest.get_portfolio_history_async(
+                    period='1D')
+                assert history.equity == [100.0]
+
+    asyncio.run(run())
+    assert attempts.count(('POST', '/v2/orders')) == 2
+    assert attempts.count(('GET', '/v2/watchlists')) == 3
+    assert attempts.count(('PATCH', '/v2/account/configurations')) == 1
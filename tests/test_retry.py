@@ -0,0 +1,57 @@
+import pytest
+import requests
+import requests_mock
+
+from alpaca_trade_api.rest import REST, APIError
+from alpaca_trade_api.retry import RetryPolicy, parse_retry_after
+
+
+def test_retry_policy():
+    policy = RetryPolicy(backoff=1, max_backoff=5)
+    for attempt in range(6):
+        assert 0 <= policy.delay(attempt) <= min(5, 2 ** attempt)
+    assert 10 <= policy.delay(0, '10') <= 11
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    assert parse_retry_after('soon') is None
+
+    policy = RetryPolicy(jitter=False, backoff=2)
+    assert [policy.delay(a) for a in range(3)] == [2, 4, 8]
+
+    assert policy.should_retry('POST', 429)
+    assert policy.should_retry('GET', 504)
+    assert not policy.should_retry('POST', 504)
+    assert not policy.should_retry('GET', 500)
+    assert policy.should_retry('GET', error=requests.ConnectionError())
+    assert not policy.should_retry('POST', error=requests.ReadTimeout())
+    assert policy.should_retry('POST', error=requests.ConnectTimeout())
+
+
+def test_retry_rest():
+    policy = RetryPolicy(max_retries=3, backoff=0)
+    api = REST('key-id', 'secret-key', api_version='v2',
+               retry_policy=policy)
+    url = 'https://api.alpaca.markets/v2/clock'
+    with requests_mock.Mocker() as m:
+        m.get(url, [
+            {'exc': requests.ConnectionError},
+            {'status_code': 504, 'text': ''},
+            {'text': '{"is_open": true}'},
+        ])
+        assert api.get_clock().is_open
+        assert m.call_count == 3
+
+        # not idempotent, the order may have gone through
+        m.post('https://api.alpaca.markets/v2/orders', status_code=504,
+               text='{"code": 50400000, "message": "timeout"}')
+        with pytest.raises(APIError):
+            api.submit_order('AAPL', 1)
+        assert m.call_count == 4
+
+        # the server asks for more than the time left
+        policy.max_elapsed = 1
+        m.get(url, status_code=429, headers={'Retry-After': '5'},
+              text='{"code": 42910000, "message": "rate limit"}')
+        with pytest.raises(APIError) as e:
+            api.get_clock()
+        assert e.value.status_code == 429
+        assert m.call_count == 5
@@ -0,0 +1,67 @@
+import json
+
+import pandas as pd
+import pytest
+import requests_mock
+
+from alpaca_trade_api.common import to_unix_nanos
+from alpaca_trade_api.rest import REST, TimeFrame
+from alpaca_trade_api.sync import DataFrameStore, ParquetStore, SQLiteStore
+
+BARS = [
+    {'t': '2021-06-08T14:00:00Z', 'o': 1, 'h': 2, 'l': .5, 'c': 1.5,
+     'v': 100, 'n': 10, 'vw': 1.2},
+    {'t': '2021-06-08T15:00:00Z', 'o': 2, 'h': 3, 'l': 1.5, 'c': 2.5,
+     'v': 200, 'n': 20, 'vw': 2.2},
+    {'t': '2021-06-08T16:00:00Z', 'o': 3, 'h': 4, 'l': 2.5, 'c': 3.5,
+     'v': 300, 'n': 30, 'vw': 3.2},
+]
+
+
+def _bars(request, context):
+    start = to_unix_nanos(request.qs['start'][0].upper())
+    bars = [b for b in BARS if to_unix_nanos(b['t']) >= start]
+    symbols = request.qs['symbols'][0].upper().split(',')
+    return json.dumps({'bars': {s: bars for s in symbols},
+                       'next_page_token': None})
+
+
+@pytest.mark.parametrize('kind', ['frame', 'sqlite', 'parquet'])
+def test_sync_bars(tmp_path, kind):
+    if kind == 'frame':
+        store = DataFrameStore()
+    elif kind == 'sqlite':
+        store = SQLiteStore(str(tmp_path / 'bars.db'))
+    else:
+        pytest.importorskip('pyarrow')
+        store = ParquetStore(str(tmp_path / 'bars'))
+    api = REST('key-id', 'secret-key', api_version='v2')
+    with requests_mock.Mocker() as m:
+        m.get('https://data.alpaca.markets/v2/stocks/bars', text=_bars)
+        # AAPL is already there up to 15:00
+        aapl = api.get_bars_frame(['AAPL'], TimeFrame.Hour,
+                                  '2021-06-08', '2021-06-08')
+        store.append('AAPL', aapl.drop(columns='symbol').iloc[:2])
+
+        counts = api.sync_bars(store, ['AAPL', 'MSFT'], TimeFrame.Hour,
+                               '2021-06-08')
+        assert counts == {'AAPL': 1, 'MSFT': 3}
+        starts = sorted(r.qs['start'][0].upper()
+                        for r in m.request_history[1:])
+        assert starts == ['2021-06-08', '2021-06-08T15:00:00.000000001Z']
+        assert store.last_timestamps(['AAPL', 'MSFT', 'TSLA']) == {
+            'AAPL': pd.Timestamp('2021-06-08T16:00:00Z').value,
+            'MSFT': pd.Timestamp('2021-06-08T16:00:00Z').value,
+            'TSLA': None,
+        }
+
+        # nothing new
+        assert api.sync_bars(store, ['AAPL', 'MSFT'], TimeFrame.Hour,
+                             '2021-06-08') == {'AAPL': 0, 'MSFT': 0}
+
+    if kind == 'frame':
+        msft = store.frames['MSFT']
+    else:
+        msft = store.read('MSFT')
+    assert msft.close.tolist() == [1.5, 2.5, 3.5]
+    assert msft.index[0] == pd.Timestamp('2021-06-08T14:00:00Z')